@@ -0,0 +1,73 @@
+from __future__ import unicode_literals, division, print_function, absolute_import
+import sys
+import time
+import tracemalloc
+import numpy as np
+from scipy.sparse import random as sparse_random
+import repo_path  # makes textcatvis importable without installing it
+from textcatvis.sparse_utils import category_indicator
+from textcatvis.visualize_relevantwords import compute_contributions, collect_class_scores
+
+
+class RandomLinearClassifier(object):
+    """
+    a linear classifier with random weights (training a real one with hundreds of classes takes too long)
+    """
+
+    def __init__(self, n_classes, n_features, seed=42):
+        rng = np.random.RandomState(seed)
+        self.classes_ = np.array(['cat%03i' % i for i in range(n_classes)])
+        self.coef_ = rng.randn(n_classes if n_classes > 2 else 1, n_features)
+        self.intercept_ = rng.randn(n_classes if n_classes > 2 else 1)
+
+    def predict(self, featmat):
+        scores = featmat.dot(self.coef_.T) + self.intercept_
+        if len(self.classes_) == 2:
+            return self.classes_[(scores[:, 0] > 0).astype(int)]
+        return self.classes_[np.argmax(scores, axis=1)]
+
+
+def collect_class_scores_dense(clf, featmat, y_true, contribs, offsets):
+    """
+    the previous implementation: the summed up contributions are densified and the offsets added in a second array
+    """
+    known = list(range(len(y_true)))
+    if len(clf.classes_) > 2:
+        contribs_true, offsets_true = compute_contributions(clf, featmat, y_true)
+    else:
+        contribs_true, offsets_true = contribs.copy(), offsets
+    catmat, _ = category_indicator(dict(enumerate(y_true)), known, list(clf.classes_))
+    contribs_true.data -= np.repeat(offsets_true, np.diff(contribs_true.indptr))
+    scores_collected = catmat.T.dot(contribs_true).toarray().T + catmat.T.dot(offsets_true)
+    scores_collected /= np.max(np.abs(scores_collected), axis=0)
+    return scores_collected
+
+
+def measure(fun, *args):
+    tracemalloc.start()
+    t0 = time.time()
+    result = fun(*args)
+    runtime = time.time() - t0
+    peak = tracemalloc.get_traced_memory()[1] / 1024.**2
+    tracemalloc.stop()
+    return result, runtime, peak
+
+
+if __name__ == '__main__':
+    # call with the number of classes, documents and features, e.g. '$ python bench_class_scores.py 500 10000 50000'
+    n_classes = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    n_docs = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    n_features = int(sys.argv[3]) if len(sys.argv) > 3 else 50000
+    featmat = sparse_random(n_docs, n_features, density=100. / n_features, format='csr', random_state=42)
+    clf = RandomLinearClassifier(n_classes, n_features)
+    y_true = list(np.random.RandomState(1).choice(clf.classes_, n_docs))
+    y_pred = clf.predict(featmat)
+    contribs, offsets = compute_contributions(clf, featmat, y_pred)
+    print("%i classes, %i documents, %i features" % (n_classes, n_docs, n_features))
+    print("%-30s %10s %12s %12s" % ("", "time (s)", "peak (MB)", "max diff"))
+    expected, runtime, peak = measure(collect_class_scores_dense, clf, featmat, y_true, contribs, offsets)
+    print("%-30s %10.2f %12.1f %12s" % ("dense (previous)", runtime, peak, "-"))
+    for dtype in [np.float64, np.float32]:
+        scores, runtime, peak = measure(collect_class_scores, clf, featmat, y_true, contribs, offsets, dtype)
+        print("%-30s %10.2f %12.1f %12.2g" % ("collect_class_scores %s" % np.dtype(dtype).name, runtime, peak,
+                                              np.max(np.abs(scores - expected))))
@@ -0,0 +1,44 @@
+from __future__ import unicode_literals, division, print_function, absolute_import
+import sys
+import time
+import tracemalloc
+from sklearn.metrics import adjusted_rand_score
+import repo_path  # makes textcatvis importable without installing it
+from textcatvis.cluster import cluster_texts
+from synthetic import make_corpus
+
+
+def run(textdict, scalable):
+    """
+    cluster the texts and return the clusters, the runtime and the peak memory usage (in MB)
+    """
+    tracemalloc.start()
+    t0 = time.time()
+    clusters = cluster_texts(textdict, scalable=scalable)
+    runtime = time.time() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return clusters, runtime, peak / 1024.**2
+
+
+if __name__ == '__main__':
+    # call with the numbers of documents to test, e.g. '$ python bench_cluster.py 1000 5000 20000'
+    sizes = [int(n) for n in sys.argv[1:]] or [1000, 5000, 10000]
+    # the kernel pca + dense distance matrix gets too big for larger datasets
+    max_exact = 20000
+    print("%8s  %-10s %10s %12s %9s %8s" % ("n_docs", "mode", "time (s)", "peak (MB)", "clusters", "ARI"))
+    for n_docs in sizes:
+        textdict, doccats = make_corpus(n_docs, n_cats=20, doc_len=60, topic_frac=0.5)
+        results = {}
+        for scalable in [False, True]:
+            if not scalable and n_docs > max_exact:
+                continue
+            clusters, runtime, peak = run(textdict, scalable)
+            results[scalable] = clusters
+            # agreement with the true categories and, for the scalable mode, with the exact mode
+            ari = adjusted_rand_score([doccats[did] for did in textdict], [clusters[did] for did in textdict])
+            print("%8i  %-10s %10.2f %12.1f %9i %8.3f" % (n_docs, "scalable" if scalable else "exact", runtime, peak,
+                                                         len(set(clusters.values())) - 1, ari))
+        if len(results) == 2:
+            print("%8s  agreement between exact and scalable mode (ARI): %.3f" % ('', adjusted_rand_score(
+                [results[False][did] for did in textdict], [results[True][did] for did in textdict])))
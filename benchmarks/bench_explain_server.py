@@ -0,0 +1,79 @@
+from __future__ import unicode_literals, division, print_function, absolute_import
+import sys
+import threading
+import time
+import numpy as np
+from sklearn.svm import LinearSVC
+from nlputils.features import FeatureTransform
+import repo_path  # makes textcatvis importable without installing it
+from textcatvis.explain import LinearExplainer
+from textcatvis.explain_server import ExplanationService, ExplanationClient, make_server
+from textcatvis.sparse_utils import features2csr
+from synthetic import make_corpus
+
+
+def train_model(textdict, doccats):
+    """
+    train a classifier like visualize_clf (with create_html=True, i.e. without bigrams)
+    """
+    docids = sorted(textdict)
+    ft = FeatureTransform(norm='max', weight=True, renorm='length', identify_bigrams=False, norm_num=False)
+    featmat, featurenames = features2csr(ft.texts2features(textdict), docids)
+    clf = LinearSVC(C=10., class_weight='balanced', random_state=1).fit(featmat, [doccats[did] for did in docids])
+    return LinearExplainer(ft, clf, featurenames)
+
+
+def run(model, texts, n_clients, max_batch, output='json'):
+    """
+    send all texts to the http server with n_clients concurrent clients
+
+    Returns:
+        results: the results for all texts
+        latencies: the latency of every request as seen by the client (in ms)
+        runtime: the total time (in seconds)
+        stats: the statistics reported by the service
+    """
+    service = ExplanationService(model, max_batch=max_batch).start()
+    server = make_server(service, port=0)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    client = ExplanationClient('http://%s:%i' % server.server_address[:2])
+    results, latencies = [None] * len(texts), [None] * len(texts)
+
+    def work(k):
+        for i in range(k, len(texts), n_clients):
+            t0 = time.time()
+            results[i] = client.explain(texts[i], i, output)
+            latencies[i] = 1000. * (time.time() - t0)
+    t0 = time.time()
+    clients = [threading.Thread(target=work, args=(k,)) for k in range(n_clients)]
+    for c in clients:
+        c.start()
+    for c in clients:
+        c.join()
+    runtime = time.time() - t0
+    stats = client.stats()
+    server.shutdown()
+    server.server_close()
+    service.stop()
+    return results, latencies, runtime, stats
+
+
+if __name__ == '__main__':
+    # call with the number of requests and concurrent clients, e.g. '$ python bench_explain_server.py 2000 16'
+    n_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    n_clients = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    textdict, doccats = make_corpus(5000, n_cats=10, doc_len=100)
+    model = train_model(textdict, doccats)
+    docids = sorted(textdict)
+    texts = [textdict[docids[i % len(docids)]] for i in range(n_requests)]
+    # the scores computed by the service have to be the same as when explaining all documents at once
+    expected = model.explain(texts)
+    print("%-10s %10s %10s %10s %12s %12s" % ("max_batch", "req/sec", "p50 (ms)", "p99 (ms)", "mean batch", "max diff"))
+    for max_batch in [1, 64]:
+        results, latencies, runtime, stats = run(model, texts, n_clients, max_batch)
+        assert all(r['prediction'] == expected[i]['prediction'] for i, r in enumerate(results))
+        diff = max(abs(r['score'] - expected[i]['score']) for i, r in enumerate(results))
+        print("%-10i %10.1f %10.2f %10.2f %12.1f %12.2g" % (max_batch, n_requests / runtime, np.percentile(latencies, 50),
+                                                           np.percentile(latencies, 99), stats['mean_batch_size'], diff))
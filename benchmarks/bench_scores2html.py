@@ -0,0 +1,94 @@
+from __future__ import unicode_literals, division, print_function, absolute_import
+import codecs
+import os
+import random
+import re
+import tempfile
+import time
+import numpy as np
+import matplotlib
+from matplotlib.cm import get_cmap
+from nlputils.features import preprocess_text
+import repo_path  # makes textcatvis importable without installing it
+from textcatvis.vis_utils import scores2html
+
+
+def scores2html_reference(text, scores, fname='testfile', metainf='', highlight_oov=False):
+    """
+    the previous implementation of scores2html (string concatenation + re-slicing the rest of the text),
+    kept here to compare the runtime and make sure the output is still the same
+    """
+    cmap_pos = get_cmap('Greens')
+    cmap_neg = get_cmap('Reds')
+    norm = matplotlib.colors.Normalize(0., 1.)
+    if isinstance(scores, dict):
+        N = np.max(np.abs(list(scores.values())))
+        scores_dict = {word: scores[word] / N for word in scores}
+        scores = []
+        for word in re.findall(r'[\w-]+', text, re.UNICODE):
+            word_pp = preprocess_text(word, norm_num=False)
+            if word_pp in scores_dict:
+                scores.append((word, scores_dict[word_pp]))
+            else:
+                scores.append((word, None))
+    else:
+        N = np.max(np.abs([t[1] for t in scores if t[1] is not None]))
+        scores = [(w, s / N) if s is not None else (w, None) for w, s in scores]
+    htmlstr = u'<body><div style="white-space: pre-wrap; font-family: monospace;">'
+    if metainf:
+        htmlstr += '%s\n\n' % metainf
+    resttext = text
+    for word, score in scores:
+        htmlstr += resttext[:resttext.find(word)]
+        resttext = resttext[resttext.find(word) + len(word):]
+        rgbac = (1., 1., 0.)
+        if highlight_oov:
+            alpha = 0.3
+        else:
+            alpha = 0.
+        if score is not None:
+            if score < 0:
+                rgbac = cmap_neg(norm(-score))
+            else:
+                rgbac = cmap_pos(norm(score))
+            alpha = 0.5
+        htmlstr += u'<span style="background-color: rgba(%i, %i, %i, %.1f)">%s</span>'\
+            % (round(255 * rgbac[0]), round(255 * rgbac[1]), round(255 * rgbac[2]), alpha, word)
+    htmlstr += resttext
+    htmlstr += u'</div></body>'
+    with codecs.open('%s.html' % fname, 'w', encoding='utf8') as f:
+        f.write(htmlstr)
+
+
+def make_text(n_bytes=1000000, n_words=20000, seed=42):
+    """
+    generate a random text of about n_bytes with Zipf distributed words and some punctuation
+    and return it together with random scores for all words
+    """
+    random.seed(seed)
+    vocab = ["word%i" % i for i in range(n_words)]
+    weights = [1. / (i + 1) for i in range(n_words)]
+    words = []
+    length = 0
+    while length < n_bytes:
+        sentence = ' '.join(random.choices(vocab, weights, k=random.randint(5, 20))).capitalize()
+        sentence += random.choice(['. ', '! ', '? ', '.\n\n', ', and '])
+        words.append(sentence)
+        length += len(sentence)
+    scores = {w: random.uniform(-1., 1.) for w in vocab[::2]}
+    return ''.join(words), scores
+
+
+if __name__ == '__main__':
+    text, scores = make_text()
+    print("text with %i characters, %i scored words" % (len(text), len(scores)))
+    tmpdir = tempfile.mkdtemp()
+    timings = {}
+    for name, fun in [('reference', scores2html_reference), ('scores2html', scores2html)]:
+        t0 = time.time()
+        fun(text, scores, os.path.join(tmpdir, name), 'benchmark', True)
+        timings[name] = time.time() - t0
+        print("%-12s %8.3f sec" % (name, timings[name]))
+    with open(os.path.join(tmpdir, 'reference.html'), 'rb') as f1, open(os.path.join(tmpdir, 'scores2html.html'), 'rb') as f2:
+        identical = f1.read() == f2.read()
+    print("speedup: %.1fx, identical output: %s" % (timings['reference'] / timings['scores2html'], identical))
@@ -0,0 +1,60 @@
+from __future__ import unicode_literals, division, print_function, absolute_import
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import repo_path  # makes textcatvis importable without installing it
+
+
+def _rss():
+    # current resident set size of this process in MB (linux only)
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 1024.**2
+
+
+def run(n_clouds, headless):
+    """
+    create n_clouds word clouds and return the time and the increase of the RSS per word cloud
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    from textcatvis.distinctive_words import get_distinctive_words
+    from textcatvis.vis_utils import create_wordcloud
+    from synthetic import make_corpus
+    textdict, doccats = make_corpus(2000, n_cats=10, doc_len=60)
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        distinctive_words = get_distinctive_words(textdict, doccats)
+    finally:
+        sys.stdout = stdout
+    cats = sorted(distinctive_words)
+    tmpdir = tempfile.mkdtemp()
+    # the first word cloud loads the fonts etc., so it isn't counted
+    create_wordcloud(distinctive_words[cats[0]], os.path.join(tmpdir, 'warmup.png'), headless=headless)
+    rss_before = _rss()
+    t0 = time.time()
+    for i in range(n_clouds):
+        create_wordcloud(distinctive_words[cats[i % len(cats)]], os.path.join(tmpdir, '%i.png' % i), headless=headless)
+    runtime = time.time() - t0
+    rss_after = _rss()
+    shutil.rmtree(tmpdir, ignore_errors=True)
+    return {'time': runtime / n_clouds, 'rss_mb': (rss_after - rss_before) / n_clouds, 'rss_total_mb': rss_after}
+
+
+if __name__ == '__main__':
+    # call with the number of word clouds to create, e.g. '$ python bench_wordcloud.py 100'
+    if len(sys.argv) > 2 and sys.argv[1] == '--worker':
+        print(json.dumps(run(int(sys.argv[2]), sys.argv[3] == 'headless')))
+        sys.exit()
+    n_clouds = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    print("%-10s %14s %18s %16s" % ("mode", "sec / cloud", "RSS MB / cloud", "final RSS MB"))
+    # every mode runs in a separate process so the memory usage can be compared
+    for mode in ['pyplot', 'headless']:
+        out = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--worker', str(n_clouds), mode])
+        res = json.loads(out.decode('utf8').strip().split('\n')[-1])
+        print("%-10s %14.3f %18.2f %16.1f" % (mode, res['time'], res['rss_mb'], res['rss_total_mb']))
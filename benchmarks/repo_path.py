@@ -0,0 +1,10 @@
+"""
+Make the textcatvis package importable when the benchmarks are run from this directory without installing it,
+e.g. '$ cd benchmarks; python run_benchmarks.py' (import this module before textcatvis)
+"""
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
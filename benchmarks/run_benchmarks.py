@@ -0,0 +1,214 @@
+"""
+Benchmark suite for the main entry points of textcatvis
+
+Every benchmark is run on synthetic datasets (see synthetic.py) of the given sizes in a separate process,
+which records the wall time, peak RSS and throughput. The results can be saved as JSON and compared against
+a baseline (e.g. the results of the last release) to catch performance regressions:
+
+    $ python run_benchmarks.py --sizes 1000 10000 100000 --output baseline.json
+    $ python run_benchmarks.py --sizes 1000 10000 100000 --output new.json --compare baseline.json
+
+With --compare, the script exits with status 1 if any benchmark got slower or needs more memory
+than the baseline by more than the given tolerance (default: 20%).
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import repo_path  # makes textcatvis importable without installing it
+
+BENCHMARKS = ['get_distinctive_words', 'clf_contributions', 'scores2html', 'create_wordcloud', 'create_wordcloud_headless',
+              'check_occurrences', 'cluster_texts', 'select_subset', 'select_subset_hash']
+
+
+def _max_rss():
+    # peak resident set size of this process in MB (ru_maxrss is in KB on linux, but in bytes on mac)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024.**2 if sys.platform == 'darwin' else rss / 1024.
+
+
+def setup_benchmark(name, textdict, doccats):
+    """
+    prepare everything a benchmark needs (not timed)
+
+    Input:
+        name: name of the benchmark
+        textdict, doccats: the synthetic dataset
+    Returns:
+        run: a function without arguments that runs the benchmark
+        n_items: the number of documents processed by run (to compute the throughput)
+    """
+    if name == 'get_distinctive_words':
+        from textcatvis.distinctive_words import get_distinctive_words
+        return lambda: get_distinctive_words(textdict, doccats), len(textdict)
+    elif name == 'clf_contributions':
+        # the per-document scoring of visualize_clf: classifier contributions for all documents
+        from sklearn.svm import LinearSVC
+        from nlputils.features import FeatureTransform
+        from textcatvis.sparse_utils import features2csr
+        from textcatvis.visualize_relevantwords import compute_contributions
+        docids = sorted(textdict)
+        ft = FeatureTransform(norm='max', weight=True, renorm='length', identify_bigrams=False, norm_num=False)
+        featmat, featurenames = features2csr(ft.texts2features(textdict), docids)
+        clf = LinearSVC(C=10., class_weight='balanced', random_state=1).fit(featmat, [doccats[did] for did in docids])
+        labels = clf.predict(featmat)
+        return lambda: compute_contributions(clf, featmat, labels), len(docids)
+    elif name == 'scores2html':
+        from nlputils.features import FeatureTransform
+        from textcatvis.vis_utils import scores2html
+        docids = sorted(textdict)[:1000]
+        docfeats = FeatureTransform(norm='max', weight=True, renorm='max', identify_bigrams=False,
+                                    norm_num=False).texts2features(textdict)
+        tmpdir = tempfile.mkdtemp()
+
+        def run():
+            for i, did in enumerate(docids):
+                scores2html(textdict[did], docfeats[did], os.path.join(tmpdir, str(i)), did)
+            shutil.rmtree(tmpdir, ignore_errors=True)
+            os.mkdir(tmpdir)
+        return run, len(docids)
+    elif name == 'create_wordcloud':
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        from textcatvis.distinctive_words import get_distinctive_words
+        from textcatvis.vis_utils import create_wordcloud
+        distinctive_words = get_distinctive_words(textdict, doccats)
+        cats = sorted(distinctive_words)[:5]
+        tmpdir = tempfile.mkdtemp()
+
+        def run():
+            for cat in cats:
+                create_wordcloud(distinctive_words[cat], os.path.join(tmpdir, '%s.png' % cat))
+                plt.close('all')
+        return run, len(cats)
+    elif name == 'create_wordcloud_headless':
+        from textcatvis.distinctive_words import get_distinctive_words
+        from textcatvis.vis_utils import create_wordcloud
+        distinctive_words = get_distinctive_words(textdict, doccats)
+        cats = sorted(distinctive_words)[:5]
+        tmpdir = tempfile.mkdtemp()
+
+        def run():
+            for cat in cats:
+                create_wordcloud(distinctive_words[cat], os.path.join(tmpdir, '%s.png' % cat), headless=True)
+        return run, len(cats)
+    elif name == 'check_occurrences':
+        from textcatvis.check_query import check_occurrences, check_and, check_or
+        words = sorted(set(w.lower() for text in list(textdict.values())[:100] for w in text.split()))[:40]
+        queries = words[:20] + [check_and(*words[i:i+2]) for i in range(20, 30, 2)] + [check_or(*words[i:i+2]) for i in range(30, 40, 2)]
+        return lambda: check_occurrences(textdict, doccats, queries), len(textdict)
+    elif name == 'cluster_texts':
+        from textcatvis.cluster import cluster_texts
+        # the dense distance matrix of the default mode doesn't fit into memory for large datasets
+        return lambda: cluster_texts(textdict, scalable=len(textdict) > 20000), len(textdict)
+    elif name == 'select_subset':
+        from textcatvis.visualize_relevantwords import select_subset
+        return lambda: select_subset(textdict, doccats), len(textdict)
+    elif name == 'select_subset_hash':
+        from textcatvis.visualize_relevantwords import select_subset
+        return lambda: select_subset(textdict, doccats, sampling='hash', min_per_cat=20), len(textdict)
+    raise ValueError("unknown benchmark %r" % name)
+
+
+def run_worker(name, n_docs, n_cats, doc_len):
+    """
+    run a single benchmark (called in a separate process) and print the results as json
+    """
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from synthetic import make_corpus
+    textdict, doccats = make_corpus(n_docs, n_cats=n_cats, doc_len=doc_len)
+    # the benchmarks print their progress, which we don't want to mix with the results
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        run, n_items = setup_benchmark(name, textdict, doccats)
+        rss_before = _max_rss()
+        t0 = time.time()
+        run()
+        runtime = time.time() - t0
+    finally:
+        sys.stdout = stdout
+    rss_peak = _max_rss()
+    print(json.dumps({'benchmark': name, 'n_docs': n_docs, 'time': runtime, 'peak_rss_mb': rss_peak,
+                      'rss_increase_mb': rss_peak - rss_before, 'throughput': n_items / max(runtime, 1e-9)}))
+
+
+def run_benchmarks(benchmarks, sizes, n_cats=20, doc_len=100):
+    """
+    run all benchmarks for all dataset sizes, each in a separate process
+
+    Returns:
+        results: list of dicts with the results of every benchmark run
+    """
+    results = []
+    for n_docs in sizes:
+        for name in benchmarks:
+            print("running %s with %i documents" % (name, n_docs))
+            out = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--worker', name, '--sizes', str(n_docs),
+                                           '--n_cats', str(n_cats), '--doc_len', str(doc_len)])
+            results.append(json.loads(out.decode('utf8').strip().split('\n')[-1]))
+            print("    %8.3f sec, %9.1f docs/sec, peak RSS %8.1f MB" % (results[-1]['time'], results[-1]['throughput'], results[-1]['peak_rss_mb']))
+    return results
+
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    compare the results to a baseline
+
+    Input:
+        results, baseline: lists with benchmark results
+        tolerance: by how much (relative) a benchmark can be slower or use more memory before it counts as a regression
+    Returns:
+        regressions: list with (benchmark, n_docs, metric, ratio) tuples for all regressions
+    """
+    base = {(r['benchmark'], r['n_docs']): r for r in baseline}
+    regressions = []
+    print("%-22s %8s %12s %12s" % ("benchmark", "n_docs", "time", "peak RSS"))
+    for r in results:
+        key = (r['benchmark'], r['n_docs'])
+        if key not in base:
+            continue
+        ratios = {m: r[m] / max(base[key][m], 1e-9) for m in ['time', 'peak_rss_mb']}
+        print("%-22s %8i %11.2fx %11.2fx" % (key[0], key[1], ratios['time'], ratios['peak_rss_mb']))
+        for m in ratios:
+            if ratios[m] > 1. + tolerance:
+                regressions.append((key[0], key[1], m, ratios[m]))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="benchmark the main entry points of textcatvis")
+    parser.add_argument('--benchmarks', nargs='+', default=BENCHMARKS, choices=BENCHMARKS)
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1000, 10000, 100000], help="numbers of documents")
+    parser.add_argument('--n_cats', type=int, default=20, help="number of categories")
+    parser.add_argument('--doc_len', type=int, default=100, help="average number of words per document")
+    parser.add_argument('--output', default='', help="json file to save the results in")
+    parser.add_argument('--compare', default='', help="json file with baseline results")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="relative slowdown considered a regression")
+    parser.add_argument('--worker', default='', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        run_worker(args.worker, args.sizes[0], args.n_cats, args.doc_len)
+        sys.exit()
+    results = run_benchmarks(args.benchmarks, args.sizes, args.n_cats, args.doc_len)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'meta': {'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(),
+                                'platform': platform.platform(), 'n_cats': args.n_cats, 'doc_len': args.doc_len},
+                       'results': results}, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        for name, n_docs, metric, ratio in regressions:
+            print("REGRESSION: %s with %i documents: %s is %.2fx the baseline" % (name, n_docs, metric, ratio))
+        if regressions:
+            sys.exit(1)
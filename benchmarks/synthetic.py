@@ -0,0 +1,45 @@
+from __future__ import unicode_literals, division, print_function, absolute_import
+import numpy as np
+
+
+def make_corpus(n_docs=1000, n_cats=10, doc_len=100, vocab_size=20000, zipf_a=1.1, topic_frac=0.3, seed=42):
+    """
+    generate a synthetic text categorization dataset with a Zipfian vocabulary
+
+    Every category has its own set of topic words, i.e. a fraction (topic_frac) of the words of every document is
+    drawn from the category's topic words, the rest from the general vocabulary (Zipf distributed in both cases).
+
+    Input:
+        n_docs: number of documents
+        n_cats: number of categories
+        doc_len: average number of words per document (the actual lengths vary between doc_len/2 and 3*doc_len/2)
+        vocab_size: number of distinct words in the vocabulary
+        zipf_a: exponent of the Zipf distribution (the larger, the steeper)
+        topic_frac: fraction of the words in every document that are drawn from the category's topic words
+        seed: random seed
+    Returns:
+        textdict: dict with {doc_id: text}
+        doccats: dict with {doc_id: category}
+    """
+    rng = np.random.RandomState(seed)
+    # words are made up of letters only so the preprocessing keeps them as they are
+    letters = np.array(list('abcdefghijklmnopqrstuvwxyz'))
+    vocab = np.array([''.join(letters[rng.randint(0, 26, 3)]) + 'x' + ''.join(letters[list(map(int, '%05i' % i))])
+                      for i in range(vocab_size)])
+    probs = 1. / np.arange(1, vocab_size + 1)**zipf_a
+    probs /= probs.sum()
+    # every category gets a random permutation of the vocabulary for its topic words
+    topic_perms = [rng.permutation(vocab_size) for _ in range(n_cats)]
+    textdict, doccats = {}, {}
+    for i in range(n_docs):
+        cat = i % n_cats
+        n_words = rng.randint(doc_len // 2, 3 * doc_len // 2 + 1)
+        words = rng.choice(vocab_size, n_words, p=probs)
+        is_topic = rng.rand(n_words) < topic_frac
+        words[is_topic] = topic_perms[cat][words[is_topic]]
+        # add some punctuation to make the texts more realistic
+        text = ' '.join(vocab[words])
+        docid = 'cat%i doc%i' % (cat, i)
+        textdict[docid] = text[:1].upper() + text[1:] + '.'
+        doccats[docid] = 'cat%i' % cat
+    return textdict, doccats
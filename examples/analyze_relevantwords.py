@@ -3,8 +3,9 @@ import sys
 import os
 import matplotlib.pyplot as plt
 from textcatvis.data_utils import load_data
-from textcatvis.visualize_relevantwords import visualize_tfidf, visualize_distinctive, visualize_clf
+from textcatvis.pipeline import run_pipeline, METHODS
 from textcatvis.cluster import cluster_texts
+from textcatvis.feature_cache import FeatureCache
 from textcatvis.check_query import *
 
 if __name__ == '__main__':
@@ -13,32 +14,26 @@ if __name__ == '__main__':
         print("Call this script with the absolute path to a dataset, i.e. '$ python analyze_relevantwords.py /absolute/path/to/dataset'")
         sys.exit()
     path_to_data = sys.argv[1]
-    # create folders for results if they don't already exist
     dataset = os.path.basename(os.path.normpath(path_to_data))
     if not os.path.isdir('results'):
         os.mkdir('results')
-    for method in ['tfidf', 'distinctive', 'clf']:
-        if not os.path.isdir(os.path.join('results', '%s_wc_%s' % (dataset, method))):
-            os.mkdir(os.path.join('results', '%s_wc_%s' % (dataset, method)))
+    # features are stored in a cache, so they don't have to be recomputed when the script is run again
+    cache = FeatureCache(os.path.join('results', 'featcache'), max_size=5*1024**3)
     # load data
     print("loading data for dataset %s" % dataset)
     textdict, doccats = load_data(path_to_data)
     # if we only have a single category, we need to cluster the texts
-    use_clf = True
+    methods = METHODS
     if len(set(doccats.values())) == 1:
         print("clustering", end=' ')
-        doccats = cluster_texts(textdict)
+        doccats = cluster_texts(textdict, cache=cache)
         print(" - got %i clusters + %i samples considered noise" % (len(set(doccats.values()))-1, len([1 for i in doccats.values() if i == -1])))
-        use_clf = False
-    print("creating word clouds")
-    # visualize w/o html for tfidf (to get bigram word clouds)
-    scores_tfidf = visualize_tfidf(textdict, doccats, create_html=False, subdir_wc=os.path.join('results', '%s_wc_tfidf' % dataset))
-    # visualize distinctive
-    scores_distinctive = visualize_distinctive(textdict, doccats, subdir_wc=os.path.join('results', '%s_wc_distinctive' % dataset))
-    # visualize w/o html using clf (to get bigram word clouds)
-    if use_clf:
         # only classify if we had actual classes
-        scores_clf = visualize_clf(textdict, doccats, create_html=False, subdir_wc=os.path.join('results', '%s_wc_clf' % dataset))
+        methods = ['tfidf', 'distinctive']
+    print("creating word clouds")
+    # the texts are transformed into features only once for all methods (with bigrams, since no htmls are created);
+    # the word clouds are saved in results/dataset/method/ and if the script is interrupted, it continues where it stopped
+    scores = run_pipeline(textdict, doccats, os.path.join('results', dataset), methods, cache=cache)
     print("checking example queries")
     # identify fraction of articles per category containing...
     # any stop words; mentioning the current AND former president; containing the word brain
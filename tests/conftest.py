@@ -0,0 +1,31 @@
+from __future__ import unicode_literals, division, print_function, absolute_import
+import numpy as np
+import pytest
+
+
+def make_corpus(n_docs=90, n_cats=3, doc_len=30, seed=0):
+    """
+    a small text categorization dataset: every document consists of general words
+    and words specific to its category (with a few bigrams that occur in all categories)
+
+    Returns:
+        textdict: dict with {doc_id: text}
+        doccats: dict with {doc_id: category}
+    """
+    rng = np.random.RandomState(seed)
+    general = ['general%s' % chr(ord('a') + i) for i in range(20)]
+    topics = [['topic%s%s' % (chr(ord('a') + c), chr(ord('a') + i)) for i in range(10)] for c in range(n_cats)]
+    textdict, doccats = {}, {}
+    for i in range(n_docs):
+        cat = i % n_cats
+        words = list(rng.choice(general, doc_len // 2)) + list(rng.choice(topics[cat], doc_len // 2)) + ['new york'] * rng.randint(0, 3)
+        rng.shuffle(words)
+        docid = 'doc%03i' % i
+        textdict[docid] = ' '.join(words) + '.'
+        doccats[docid] = 'cat%i' % cat
+    return textdict, doccats
+
+
+@pytest.fixture
+def corpus():
+    return make_corpus()
@@ -0,0 +1,28 @@
+from __future__ import unicode_literals, division, print_function, absolute_import
+import pytest
+from textcatvis.check_query import QueryIndex, check_occurrences, check_and, check_or
+
+QUERIES = ['generala', 'topicaa', 'missingword', 'york', check_and('generala', 'topicab'), check_or('topicba', 'topicca'),
+           check_and('generalb', check_or('topicaa', check_and('topicbb', 'new'))), check_or('missingword', 'generalc')]
+
+
+def test_query_index(tmp_path, corpus):
+    textdict, doccats = corpus
+    expected = check_occurrences(textdict, doccats, QUERIES)
+    # the queries actually match some, but not all documents
+    assert 0 < expected['topicaa']['cat0'] and expected['topicaa']['cat1'] == 0
+    index = QueryIndex(textdict, doccats)
+    assert index.check_occurrences(QUERIES) == expected
+    assert check_occurrences(textdict, doccats, QUERIES, index=index) == expected
+    fname = str(tmp_path / 'index.npz')
+    index.save(fname)
+    loaded = QueryIndex.load(fname)
+    assert loaded.check_occurrences(QUERIES) == expected
+    assert loaded.docids == index.docids and loaded.categories == index.categories
+    assert (loaded.postings == index.postings).all() and (loaded.offsets == index.offsets).all()
+
+
+def test_query_index_only_query_objects(corpus):
+    textdict, doccats = corpus
+    with pytest.raises(ValueError):
+        QueryIndex(textdict, doccats).check_occurrences([(lambda words: 'generala' in words, 'custom')])
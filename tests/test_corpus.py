@@ -0,0 +1,44 @@
+from __future__ import unicode_literals, division, print_function, absolute_import
+import pytest
+from textcatvis.corpus import Corpus
+
+
+def test_textdict_subset_keys(corpus):
+    textdict, doccats = corpus
+    c = Corpus(textdict, doccats)
+    view = c.textdict(c.indices(['doc001', 'doc005']))
+    assert view['doc005'] == textdict['doc005']
+    # documents of the corpus that are not in the subset (or not in the corpus at all) are not in the view
+    for docid in ['doc002', 'unknown']:
+        with pytest.raises(KeyError):
+            view[docid]
+        assert docid not in view
+        assert view.get(docid) is None
+    assert 'doc001' in view
+    assert dict(view) == {did: textdict[did] for did in ['doc001', 'doc005']}
+
+
+def test_subsets(corpus):
+    textdict, doccats = corpus
+    c = Corpus(textdict, doccats)
+    assert len(c) == len(textdict) and c.docids == list(textdict)
+    assert c.categories == ['cat0', 'cat1', 'cat2']
+    assert all(c.text(i) == textdict[did] for i, did in enumerate(c.docids))
+    assert dict(c.textdict()) == textdict and c.doccats() == doccats
+    subset = ['doc010', 'doc003', 'doc042', 'doc007']
+    idx = c.indices(subset)
+    assert [c.docids[i] for i in idx] == subset
+    # the views keep the order of the indices
+    assert list(c.textdict(idx)) == subset and len(c.textdict(idx)) == 4
+    assert c.doccats(idx) == {did: doccats[did] for did in subset}
+    rest = c.complement(idx)
+    assert sorted(set(rest) | set(idx)) == list(range(len(c))) and not set(rest) & set(idx)
+    assert list(c.counts(idx)) == [sum(doccats[did] == cat for did in subset) for cat in c.categories]
+    for cat, docs in zip(c.categories, c.catdocs(idx)):
+        assert list(docs) == sorted(i for i in idx if doccats[c.docids[i]] == cat)
+    catmat = c.indicator(idx)
+    assert catmat.shape == (4, 3)
+    assert [c.categories[j] for j in catmat.indices] == [doccats[did] for did in subset]
+    # given categories define the codes (e.g. to use the same codes for several datasets)
+    c2 = Corpus(textdict, doccats, categories=['cat2', 'cat1', 'cat0'])
+    assert list(c2.labels[idx]) == [2 - int(doccats[did][-1]) for did in subset]
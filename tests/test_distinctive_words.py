@@ -0,0 +1,112 @@
+from __future__ import unicode_literals, division, print_function, absolute_import
+import numpy as np
+import pytest
+from textcatvis.distinctive_words import compute_tprs, compute_distinctive_scores, distinctive_fun_quotdiff, DistinctiveWordsAccumulator
+from textcatvis.sparse_utils import features2csr, category_indicator, csr2dicts
+from conftest import make_corpus
+
+
+def reference_scores(docfeats, doccats, distinctive_fun=distinctive_fun_quotdiff):
+    """
+    the distinctive scores computed word by word and category by category (like the original get_distinctive_words)
+    """
+    categories = sorted(set(doccats.values()))
+    cats_dids = {cat: [did for did in doccats if doccats[did] == cat] for cat in categories}
+    words = set(word for feats in docfeats.values() for word in feats)
+    tprs = {word: {cat: sum(docfeats[did].get(word, 0.) for did in cats_dids[cat]) / len(cats_dids[cat]) for cat in categories}
+            for word in words}
+    scores = {cat: {} for cat in categories}
+    for cat in categories:
+        for word in words:
+            tpr = tprs[word][cat]
+            if tpr:
+                fprs = [tprs[word][c] for c in categories if c != cat]
+                scores[cat][word] = distinctive_fun(tpr, np.mean(fprs) + np.std(fprs))
+    return scores
+
+
+@pytest.mark.parametrize('n_cats', [2, 3, 5])
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_distinctive_scores(n_cats, n_jobs):
+    from nlputils.features import FeatureTransform
+    textdict, doccats = make_corpus(20 * n_cats, n_cats)
+    docfeats = FeatureTransform(norm='max', weight=False, renorm=False, identify_bigrams=True, norm_num=False).texts2features(textdict)
+    docids = list(docfeats)
+    featmat, featurenames = features2csr(docfeats, docids)
+    catmat, categories = category_indicator(doccats, docids, sorted(set(doccats.values())))
+    scores = compute_distinctive_scores(compute_tprs(featmat, catmat), n_jobs=n_jobs)
+    expected = reference_scores(docfeats, doccats)
+    for i, cat in enumerate(categories):
+        start, end = scores.indptr[i], scores.indptr[i + 1]
+        result = {featurenames[j]: v for j, v in zip(scores.indices[start:end], scores.data[start:end])}
+        assert set(result) == set(expected[cat])
+        np.testing.assert_allclose([result[word] for word in sorted(result)], [expected[cat][word] for word in sorted(result)],
+                                   rtol=1e-12, atol=1e-14)
+
+
+def full_recompute(acc, textdict, doccats):
+    # the distinctive words of all current documents computed from scratch (with the accumulator's fitted bigrams)
+    docids = [did for did in textdict if doccats[did] in acc.categories]
+    docfeats = acc.ft.texts2features({did: textdict[did] for did in docids})
+    featmat, featurenames = features2csr(docfeats, docids)
+    catmat, categories = category_indicator(doccats, docids)
+    return csr2dicts(compute_distinctive_scores(compute_tprs(featmat, catmat)), categories, featurenames)
+
+
+def assert_same_scores(result, expected):
+    assert set(result) == set(expected)
+    for cat in expected:
+        assert set(result[cat]) == set(expected[cat])
+        words = sorted(expected[cat])
+        np.testing.assert_allclose([result[cat][word] for word in words], [expected[cat][word] for word in words], rtol=1e-10, atol=1e-12)
+
+
+def test_accumulator():
+    textdict, doccats = make_corpus(120, 4)
+    # documents of a new category
+    new_texts, new_cats = make_corpus(30, 1, seed=1)
+    textdict.update(('new' + did, text) for did, text in new_texts.items())
+    doccats.update(('new' + did, 'cat4') for did in new_cats)
+    docids = sorted(textdict)
+    acc = DistinctiveWordsAccumulator()
+    steps = [('add', [did for did in docids[:60] if not did.startswith('new')]),
+             ('add', [did for did in docids[60:] if not did.startswith('new')]),
+             # only some of the categories get new documents
+             ('add', [did for did in docids if doccats[did] == 'cat0'][:5]),
+             ('retire', ['cat1']),
+             ('add', [did for did in docids if did.startswith('new')]),
+             ('retire', ['cat2', 'cat3']),
+             # a single category and then again two
+             ('retire', ['cat0']),
+             ('add', [did for did in docids if doccats[did] == 'cat2'][:10])]
+    current = {}
+    previous = None
+    for action, args in steps:
+        if action == 'add':
+            acc.add({did: textdict[did] for did in args}, {did: doccats[did] for did in args})
+            # (the same document can be added twice, so the reference needs unique docids)
+            current.update(('%s_%i' % (did, len(current)), did) for did in args)
+        else:
+            acc.retire(args)
+            # (a retired category can get new documents later, but its old documents are gone)
+            current = {key: did for key, did in current.items() if doccats[did] not in args}
+        result = acc.get_distinctive_words()
+        expected = full_recompute(acc, {key: textdict[did] for key, did in current.items()},
+                                  {key: doccats[did] for key, did in current.items()})
+        assert_same_scores(result, expected)
+        assert_same_scores(csr2dicts(*acc.get_scores()), expected)
+        if previous is not None:
+            # the dicts returned earlier are not changed
+            assert_same_scores(previous[0], previous[1])
+        previous = (result, {cat: dict(scores) for cat, scores in result.items()})
+
+
+def test_accumulator_bigrams():
+    # no bigrams in the first batch
+    acc = DistinctiveWordsAccumulator()
+    acc.add({'a': 'generala topicaa york', 'b': 'generalb topicba new', 'c': 'topicca generala'}, {'a': 'cat0', 'b': 'cat1', 'c': 'cat2'})
+    assert acc.ft.bigrams == []
+    # the bigrams are not searched again in later batches
+    acc.add({'new': 'new york new york generala new york'}, {'new': 'cat0'})
+    assert acc.ft.bigrams == [] and 'new_york' not in acc.featurenames
+    assert {'new', 'york'} <= set(acc.get_distinctive_words()['cat0'])
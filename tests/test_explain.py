@@ -0,0 +1,38 @@
+from __future__ import unicode_literals, division, print_function, absolute_import
+import copy
+import pytest
+from textcatvis.explain import LinearExplainer
+from textcatvis.sparse_utils import features2csr
+from conftest import make_corpus
+
+# new documents in which the FeatureTransform would find a bigram if it searched for them again
+NEW_TEXTS = {'new%i' % i: 'new york generala new york topicaa new york topicba new york' for i in range(5)}
+
+
+def ft_state(ft):
+    return copy.deepcopy(ft.__dict__)
+
+
+@pytest.mark.parametrize('with_bigrams', [True, False])
+def test_transform_keeps_model(tmp_path, with_bigrams):
+    from nlputils.features import FeatureTransform
+    from sklearn.svm import LinearSVC
+    textdict, doccats = make_corpus()
+    if not with_bigrams:
+        textdict = {did: text.replace('new york', 'york') for did, text in textdict.items()}
+    docids = sorted(textdict)
+    ft = FeatureTransform(norm='max', weight=True, renorm='length', identify_bigrams=True, norm_num=False, bg_threshold=0.5)
+    featmat, featurenames = features2csr(ft.texts2features(textdict), docids)
+    assert ft.bigrams == (['new york'] if with_bigrams else [])
+    clf = LinearSVC(C=10., random_state=1).fit(featmat, [doccats[did] for did in docids])
+    model = LinearExplainer(ft, clf, featurenames)
+    # the training features are the same with the fitted model
+    featmat_model, _ = model.transform(textdict, docids)
+    assert (featmat_model != featmat).nnz == 0
+    model.save(str(tmp_path / 'model.npz'))
+    for m in [model, LinearExplainer.load(str(tmp_path / 'model.npz'))]:
+        state = ft_state(m.ft)
+        first = m.explain(NEW_TEXTS)
+        assert ft_state(m.ft) == state
+        assert m.explain(NEW_TEXTS) == first
+        assert ('new_york' in first['new0']['scores']) == with_bigrams
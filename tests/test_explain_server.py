@@ -0,0 +1,136 @@
+from __future__ import unicode_literals, division, print_function, absolute_import
+import json
+import threading
+from io import StringIO
+import pytest
+from textcatvis.explain import LinearExplainer
+from textcatvis.explain_server import ExplanationService, ExplanationClient, make_server, serve_jsonl
+
+
+class FailingModel(object):
+    """
+    a model that fails for all batches with a document containing 'bad'
+    """
+
+    def __init__(self, model):
+        self.model = model
+
+    def explain(self, texts):
+        if any('bad' in text for text in texts.values()):
+            raise RuntimeError("bad document")
+        return self.model.explain(texts)
+
+
+@pytest.fixture(scope='module')
+def model():
+    from nlputils.features import FeatureTransform
+    from sklearn.svm import LinearSVC
+    from textcatvis.sparse_utils import features2csr
+    from conftest import make_corpus
+    textdict, doccats = make_corpus()
+    docids = sorted(textdict)
+    ft = FeatureTransform(norm='max', weight=True, renorm='length', identify_bigrams=False, norm_num=False)
+    featmat, featurenames = features2csr(ft.texts2features(textdict), docids)
+    clf = LinearSVC(C=10., random_state=1).fit(featmat, [doccats[did] for did in docids])
+    return LinearExplainer(ft, clf, featurenames)
+
+
+TEXTS = ['generala topicaa topicab', 'generalb topicba', 'a bad document', 'topicca topiccb generalc', 'another bad one', 'generald']
+
+
+def test_error_isolation(model):
+    service = ExplanationService(FailingModel(model), max_batch=64)
+    # all requests are queued before the worker starts, so they end up in the same batch
+    requests = [service.submit(text, i) for i, text in enumerate(TEXTS)]
+    service.start()
+    for request, text in zip(requests, TEXTS):
+        if 'bad' in text:
+            with pytest.raises(RuntimeError):
+                request.wait(10)
+        else:
+            result = request.wait(10)
+            assert result['id'] == request.docid
+            assert result['prediction'] == model.explain([text])[0]['prediction']
+    # the failing documents are not counted
+    assert service.stats()['n_requests'] == 4
+    # invalid input isn't even queued
+    with pytest.raises(ValueError):
+        service.submit(42)
+    with pytest.raises(ValueError):
+        service.submit('text', output='pdf')
+    assert service.explain(TEXTS[0], output='html', timeout=10)['html'].startswith('<body>')
+    service.stop()
+
+
+def test_serve_jsonl(model):
+    service = ExplanationService(FailingModel(model)).start()
+    lines = [json.dumps({'id': i, 'text': text}) for i, text in enumerate(TEXTS)]
+    lines[1:1] = ['not json', json.dumps({'id': 'x'}), json.dumps({'id': 'y', 'text': 5}), '']
+    fout = StringIO()
+    serve_jsonl(service, StringIO('\n'.join(lines) + '\n'), fout)
+    service.stop()
+    results = [json.loads(line) for line in fout.getvalue().splitlines()]
+    # one result per non-empty line, in the same order
+    assert [r['id'] for r in results] == [0, None, 'x', 'y', 1, 2, 3, 4, 5]
+    assert [('error' in r) for r in results] == [False, True, True, True, False, True, False, True, False]
+
+
+def test_http(model):
+    service = ExplanationService(FailingModel(model)).start()
+    server = make_server(service, port=0)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        client = ExplanationClient('http://%s:%i' % server.server_address[:2])
+        assert client.explain(TEXTS[0], 'doc')['id'] == 'doc'
+        assert client.explain(TEXTS[0], output='html').startswith('<body>')
+        try:
+            from urllib.error import HTTPError
+        except ImportError:
+            from urllib2 import HTTPError
+        for text, code in [(5, 400), ('a bad document', 500)]:
+            with pytest.raises(HTTPError) as e:
+                client.explain(text)
+            assert e.value.code == code and 'error' in json.loads(e.value.read().decode('utf8'))
+        assert client.stats()['n_requests'] == 2
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.stop()
+
+
+def test_stop(model):
+    # the documents queued before stop are all scored, later ones are rejected
+    service = ExplanationService(model, max_batch=4, max_wait=0.05)
+    requests = [service.submit(text, i) for i, text in enumerate(TEXTS * 5)]
+    service.start()
+    results, errors = [], []
+
+    def submit_many():
+        for i in range(200):
+            try:
+                results.append(service.submit(TEXTS[0], i))
+            except RuntimeError as e:
+                errors.append(e)
+    threads = [threading.Thread(target=submit_many) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    service.stop()
+    for thread in threads:
+        thread.join()
+    assert len(results) + len(errors) == 800
+    for request in requests + results:
+        assert request.done() and request.wait(0)['id'] == request.docid
+    with pytest.raises(RuntimeError):
+        service.submit(TEXTS[0])
+    # if the worker was never started, the queued documents fail instead of waiting forever
+    service = ExplanationService(model)
+    request = service.submit(TEXTS[0], 'doc')
+    service.stop()
+    with pytest.raises(RuntimeError) as e:
+        request.wait(0)
+    assert 'stopped' in str(e.value)
+    # a stopped service can be started again
+    assert service.start().explain(TEXTS[0], 'doc', timeout=10)['id'] == 'doc'
+    service.stop()
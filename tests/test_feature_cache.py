@@ -0,0 +1,95 @@
+from __future__ import unicode_literals, division, print_function, absolute_import
+import os
+import numpy as np
+import pytest
+from nlputils.features import FeatureTransform
+from textcatvis.feature_cache import FeatureCache, texts2featmat
+from textcatvis.sparse_utils import features2csr
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    # count how often the features are actually computed
+    calls = []
+    texts2features = FeatureTransform.texts2features
+
+    def counting(self, textdict, fit_ids=[]):
+        calls.append(len(textdict))
+        return texts2features(self, textdict, fit_ids)
+    monkeypatch.setattr(FeatureTransform, 'texts2features', counting)
+    return calls
+
+
+def make_ft(**kwargs):
+    return FeatureTransform(norm='max', weight=True, renorm='length', norm_num=False, **kwargs)
+
+
+def test_hit_miss(tmp_path, corpus, calls):
+    textdict, _ = corpus
+    fit_ids = sorted(textdict)[:50]
+    ft = make_ft()
+    expected = ft.texts2features(textdict, fit_ids)
+    cache = FeatureCache(str(tmp_path / 'cache'))
+    del calls[:]
+    # miss: the features are computed and stored
+    ft_miss = make_ft()
+    assert cache.texts2features(ft_miss, textdict, fit_ids) == expected
+    assert calls == [len(textdict)]
+    assert len(cache._entries()) == 1
+    # hit: the features and the fitted FeatureTransform are loaded
+    ft_hit = make_ft()
+    assert cache.texts2features(ft_hit, textdict, fit_ids) == expected
+    assert ft_hit.Dw == ft.Dw and ft_hit.bigrams == ft.bigrams
+    assert calls == [len(textdict)]
+    # other texts, fit_ids or parameters are a miss
+    cache.texts2features(make_ft(), textdict)
+    cache.texts2features(make_ft(identify_bigrams=False), textdict, fit_ids)
+    cache.texts2features(make_ft(), dict(textdict, doc000='a different text'), fit_ids)
+    assert len(calls) == 4 and len(cache._entries()) == 4
+    cache.invalidate(make_ft(), textdict, fit_ids)
+    assert len(cache._entries()) == 3
+    cache.texts2features(make_ft(), textdict, fit_ids)
+    assert len(calls) == 5
+    cache.clear()
+    assert cache._entries() == [] and cache.size() == 0
+
+
+def test_texts2featmat(tmp_path, corpus, calls):
+    textdict, _ = corpus
+    cache = FeatureCache(str(tmp_path / 'cache'))
+    docids = sorted(textdict, reverse=True)[:70]
+    expected, expected_names = features2csr(make_ft().texts2features(textdict), docids)
+    for _ in range(2):
+        featmat, featurenames = texts2featmat(make_ft(), textdict, docids, cache=cache)
+        assert featurenames == expected_names
+        assert abs(featmat - expected).max() == 0 and np.all(featmat.data) and featmat.has_sorted_indices
+    # with given featurenames (incl. unknown ones)
+    names = expected_names[::2] + ['unknownword']
+    featmat, featurenames = texts2featmat(make_ft(), textdict, docids, featurenames=names, cache=cache)
+    assert featurenames == names
+    assert abs(featmat - features2csr(make_ft().texts2features(textdict), docids, names)[0]).max() == 0
+    assert calls.count(len(textdict)) == 3
+
+
+def test_eviction(tmp_path, corpus):
+    textdict, _ = corpus
+    cache = FeatureCache(str(tmp_path / 'cache'))
+    texts = [{did: text for did, text in textdict.items() if did[-1] == str(i)} for i in range(3)]
+    keys = [cache.get_key(make_ft(), t) for t in texts]
+    cache.texts2features(make_ft(), texts[0])
+    entry_size = cache.size()
+    # room for two entries
+    cache.max_size = int(2.5 * entry_size)
+    os.utime(cache._path(keys[0]), (1, 1))
+    cache.texts2features(make_ft(), texts[1])
+    os.utime(cache._path(keys[1]), (2, 2))
+    # loading an entry marks it as recently used
+    cache.texts2features(make_ft(), texts[0])
+    cache.texts2features(make_ft(), texts[2])
+    assert sorted(cache._entries()) == sorted([keys[0], keys[2]])
+    assert cache.size() <= cache.max_size
+    # the most recently used entry is always kept
+    os.utime(cache._path(keys[0]), (3, 3))
+    cache.max_size = 1
+    cache.evict()
+    assert cache._entries() == [keys[2]]
@@ -0,0 +1,44 @@
+"""
+Check that importing the textcatvis modules doesn't load the heavy dependencies before they are needed
+(every module is imported in a fresh process):
+
+    $ python -m pytest tests
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+import json
+import os
+import subprocess
+import sys
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# packages that take long to import and should only be loaded when they are actually used
+HEAVY_PACKAGES = ['matplotlib', 'sklearn', 'PIL', 'wordcloud']
+# modules that should be importable without loading any of the heavy packages
+LIGHT_MODULES = ['textcatvis.check_query', 'textcatvis.corpus', 'textcatvis.distinctive_words', 'textcatvis.data_utils',
+                 'textcatvis.feature_cache', 'textcatvis.sparse_utils', 'textcatvis.vis_utils', 'textcatvis.visualize_relevantwords',
+                 'textcatvis.cluster', 'textcatvis.explain', 'textcatvis.explain_server', 'textcatvis.instrument',
+                 'textcatvis.results', 'textcatvis.pipeline']
+
+_CODE = """
+import json, sys
+import %s
+print(json.dumps(sorted(set(m.split('.')[0] for m in sys.modules))))
+"""
+
+
+def loaded_packages(module):
+    """
+    import the module in a separate process (with the repository root as the working directory)
+
+    Returns:
+        the top-level names of all modules loaded in the process
+    """
+    out = subprocess.check_output([sys.executable, '-c', _CODE % module], cwd=REPO_ROOT)
+    return json.loads(out.decode('utf8').strip().split('\n')[-1])
+
+
+@pytest.mark.parametrize('module', LIGHT_MODULES)
+def test_no_heavy_imports(module):
+    loaded = [p for p in HEAVY_PACKAGES if p in loaded_packages(module)]
+    assert not loaded, "importing %s loads %s" % (module, ', '.join(loaded))
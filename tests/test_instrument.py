@@ -0,0 +1,25 @@
+from __future__ import unicode_literals, division, print_function, absolute_import
+import pytest
+from textcatvis import instrument
+
+
+def test_stages():
+    events = []
+    with instrument.recording(events.append):
+        with instrument.stage('outer', n_docs=3) as st:
+            with instrument.stage('inner'):
+                instrument.event('custom', x=1)
+            st.set(n_features=5)
+        with pytest.raises(ValueError):
+            with instrument.stage('failing'):
+                raise ValueError
+    # one event per stage when it's done (the start of a stage is only announced by the printed progress messages)
+    assert [(e['event'], e['stage']) for e in events] == [('custom', 'outer/inner'), ('stage_end', 'outer/inner'),
+                                                          ('stage_end', 'outer'), ('stage_end', 'failing')]
+    assert events[2]['n_docs'] == 3 and events[2]['n_features'] == 5 and events[2]['time'] >= events[1]['time']
+    assert events[3]['error'] == 'ValueError'
+    # without a sink, nothing is reported
+    assert not instrument.enabled()
+    with instrument.stage('nothing'):
+        instrument.event('custom')
+    assert len(events) == 4
@@ -0,0 +1,78 @@
+from __future__ import unicode_literals, division, print_function, absolute_import
+import codecs
+import json
+import os
+import numpy as np
+import pytest
+from textcatvis import pipeline
+from textcatvis.pipeline import SharedFeatures, run_pipeline
+from conftest import make_corpus
+
+
+def _fail(*args, **kwargs):
+    raise RuntimeError("should not be computed")
+
+
+def _done(out_dir):
+    with codecs.open(os.path.join(out_dir, 'pipeline.json'), encoding='utf8') as f:
+        return json.load(f)['done']
+
+
+def test_run_interrupt_resume(tmp_path, monkeypatch):
+    # the classifier is trained on the documents that are not visualized (i.e. all but 1000)
+    textdict, doccats = make_corpus(1200, doc_len=20)
+    expected = run_pipeline(textdict, doccats, str(tmp_path / 'expected'))
+    out_dir = str(tmp_path / 'out')
+    # the classifier fails, but the stages before it are recorded
+    monkeypatch.setattr(pipeline, 'score_clf', _fail)
+    with pytest.raises(RuntimeError):
+        run_pipeline(textdict, doccats, out_dir)
+    assert _done(out_dir) == ['features', 'scores_tfidf', 'scores_distinctive']
+    # when resuming, only the missing stages are computed
+    monkeypatch.undo()
+    monkeypatch.setattr(pipeline, 'score_tfidf', _fail)
+    monkeypatch.setattr(pipeline, 'score_distinctive', _fail)
+    results = run_pipeline(textdict, doccats, out_dir)
+    assert set(_done(out_dir)) == set(['features'] + ['%s_%s' % (s, m) for s in ['scores', 'wordclouds'] for m in pipeline.METHODS])
+    for method in pipeline.METHODS:
+        assert os.path.exists(os.path.join(out_dir, method, 'cat0.png'))
+        np.testing.assert_array_equal(results[method].scores, expected[method].scores)
+        assert results[method].categories == expected[method].categories
+    # with other parameters, everything is computed again
+    with pytest.raises(RuntimeError):
+        run_pipeline(textdict, doccats, out_dir, min_per_cat=5)
+
+
+def test_cluster_labels(tmp_path, corpus, monkeypatch):
+    from textcatvis.cluster import cluster_texts
+    textdict, _ = corpus
+    # the cluster ids are numpy ints
+    doccats = cluster_texts(textdict)
+    out_dir = str(tmp_path / 'out')
+    methods = ['tfidf', 'distinctive']
+    results = run_pipeline(textdict, doccats, out_dir, methods)
+    monkeypatch.setattr(pipeline, 'score_tfidf', _fail)
+    monkeypatch.setattr(pipeline, 'score_distinctive', _fail)
+    resumed = run_pipeline(textdict, doccats, out_dir, methods)
+    for method in methods:
+        assert resumed[method].categories == sorted(set(doccats.values()))
+        np.testing.assert_array_equal(resumed[method].scores, results[method].scores)
+
+
+def test_shared_features_save_load(tmp_path, corpus):
+    textdict, doccats = corpus
+    doccats = {did: np.int64(cat[-1]) for did, cat in doccats.items()}
+    data = SharedFeatures.from_texts(textdict, doccats)
+    data.save(str(tmp_path / 'features'))
+    loaded = SharedFeatures.load(str(tmp_path / 'features'))
+    assert abs(loaded.tf - data.tf).max() == 0
+    assert loaded.featurenames == data.featurenames
+    assert loaded.docids == data.docids
+    np.testing.assert_array_equal(loaded.labels, data.labels)
+    assert loaded.categories == data.categories == [0, 1, 2]
+    assert [tuple(bigram) for bigram in loaded.bigrams] == [tuple(bigram) for bigram in data.bigrams]
+    # the tf-idf features derived from the loaded features are the same
+    featmat, featurenames, _ = data.weighted(np.arange(60), 'length')
+    featmat_loaded, featurenames_loaded, _ = loaded.weighted(np.arange(60), 'length')
+    assert featurenames_loaded == featurenames
+    assert abs(featmat_loaded - featmat).max() == 0
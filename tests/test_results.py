@@ -0,0 +1,41 @@
+from __future__ import unicode_literals, division, print_function, absolute_import
+import numpy as np
+import pytest
+from scipy.sparse import csr_matrix
+from textcatvis.results import RelevantWords
+
+
+@pytest.fixture
+def results():
+    mat = csr_matrix(np.array([[0.5, 0., -0.25, 1.], [0., 2., 0., -1.]]))
+    # explicitly stored zeros are scores, too
+    mat.data[mat.data == 2.] = 0.
+    return RelevantWords.from_sparse(mat, [np.int64(3), np.int64(7)], ['apple', 'banana', 'cherry', 'new york'])
+
+
+def test_mapping(results):
+    assert list(results) == [3, 7] and len(results) == 2
+    assert dict(results[3]) == {'apple': 0.5, 'cherry': -0.25, 'new york': 1.}
+    assert dict(results[7]) == {'banana': 0., 'new york': -1.}
+    assert 'apple' not in results[7]
+    with pytest.raises(KeyError):
+        results[7]['apple']
+    assert results.to_dict() == {3: dict(results[3]), 7: dict(results[7])}
+    assert results.topk(3, 2) == [('new york', 1.), ('apple', 0.5)]
+    assert results.topk(3, 1, largest=False) == [('cherry', -0.25)]
+    assert results.scores.dtype == np.float32
+
+
+@pytest.mark.parametrize('fname', ['results', 'results.npz'])
+def test_save_load(tmp_path, results, fname):
+    path = str(tmp_path / fname)
+    results.save(path)
+    loaded = RelevantWords.load(path)
+    assert loaded.categories == [3, 7]
+    np.testing.assert_array_equal(loaded.vocab, results.vocab)
+    np.testing.assert_array_equal(loaded.scores, results.scores)
+    assert loaded.scores.dtype == np.float32
+    assert loaded.to_dict() == results.to_dict()
+    # the directory is memory-mapped when loading (unless mmap_mode=None)
+    assert isinstance(loaded.scores, np.memmap) == (not fname.endswith('.npz'))
+    assert not isinstance(RelevantWords.load(path, mmap_mode=None).scores, np.memmap)
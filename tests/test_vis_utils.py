@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, division, print_function, absolute_import
+import codecs
+import re
+from io import StringIO
+import numpy as np
+import pytest
+from nlputils.features import preprocess_text
+from textcatvis import vis_utils
+from textcatvis.vis_utils import write_scores2html, scores2html, posneg_color_func, make_posneg_color_func
+
+
+def reference_html(text, scores, metainf='', highlight_oov=False):
+    """
+    the html generated by the original scores2html (string concatenation + re-slicing the rest of the text)
+    """
+    import matplotlib.colors
+    from matplotlib.cm import get_cmap
+    cmap_pos = get_cmap('Greens')
+    cmap_neg = get_cmap('Reds')
+    norm = matplotlib.colors.Normalize(0., 1.)
+    if isinstance(scores, dict):
+        N = np.max(np.abs(list(scores.values())))
+        scores_dict = {word: scores[word] / N for word in scores}
+        scores = []
+        for word in re.findall(r'[\w-]+', text, re.UNICODE):
+            word_pp = preprocess_text(word, norm_num=False)
+            if word_pp in scores_dict:
+                scores.append((word, scores_dict[word_pp]))
+            else:
+                scores.append((word, None))
+    else:
+        N = np.max(np.abs([t[1] for t in scores if t[1] is not None]))
+        scores = [(w, s / N) if s is not None else (w, None) for w, s in scores]
+    htmlstr = u'<body><div style="white-space: pre-wrap; font-family: monospace;">'
+    if metainf:
+        htmlstr += '%s\n\n' % metainf
+    resttext = text
+    for word, score in scores:
+        htmlstr += resttext[:resttext.find(word)]
+        resttext = resttext[resttext.find(word) + len(word):]
+        rgbac = (1., 1., 0.)
+        if highlight_oov:
+            alpha = 0.3
+        else:
+            alpha = 0.
+        if score is not None:
+            if score < 0:
+                rgbac = cmap_neg(norm(-score))
+            else:
+                rgbac = cmap_pos(norm(score))
+            alpha = 0.5
+        htmlstr += u'<span style="background-color: rgba(%i, %i, %i, %.1f)">%s</span>'\
+            % (round(255 * rgbac[0]), round(255 * rgbac[1]), round(255 * rgbac[2]), alpha, word)
+    htmlstr += resttext
+    htmlstr += u'</div></body>'
+    return htmlstr
+
+
+TEXT = "The New-York Times reported: the market's rise (3.5%) surprised traders.\n\nÜbrigens: naïve café owners, the end"
+SCORES_DICT = {'the': -0.2, 'new-york': 1.5, 'market': 0.7, 'rise': -1.1, 'surprised': 0.05, 'café': 0.9, 'end': 0.}
+# with a list, the words don't have to be in the text (or in this order)
+SCORES_LIST = [('The', 0.3), ('New-York', None), ('missing', -2.), ('market', 1.), ('rise', -0.4), ('end', None), ('after', 0.5)]
+
+
+@pytest.mark.parametrize('scores', [SCORES_DICT, SCORES_LIST])
+@pytest.mark.parametrize('metainf', ['', 'True Class: x'])
+@pytest.mark.parametrize('highlight_oov', [False, True])
+def test_scores2html_same_as_original(tmp_path, scores, metainf, highlight_oov):
+    expected = reference_html(TEXT, scores, metainf, highlight_oov)
+    f = StringIO()
+    write_scores2html(f, TEXT, scores, metainf, highlight_oov)
+    assert f.getvalue() == expected
+    fname = str(tmp_path / 'doc')
+    scores2html(TEXT, scores, fname, metainf, highlight_oov)
+    with codecs.open(fname + '.html', encoding='utf8') as f:
+        assert f.read() == expected
+
+
+def test_posneg_color_func(monkeypatch):
+    from matplotlib.cm import get_cmap
+    from matplotlib.colors import Normalize
+    ws_dict = {'good': 0.8, 'ok': 0.1, 'bad': -0.5, 'neutral': 0.}
+    # the original color function with the module level scores and (default) normalizations
+    monkeypatch.setattr(vis_utils, 'word_scores_dict', ws_dict)
+    monkeypatch.setattr(vis_utils, 'norm_pos', None)
+    monkeypatch.setattr(vis_utils, 'norm_neg', None)
+    color_func = make_posneg_color_func(ws_dict, Normalize(0., 1.), Normalize(0., 1.))
+    assert [posneg_color_func(w) for w in ws_dict] == [color_func(w) for w in ws_dict]
+    assert posneg_color_func('good') == 'rgb(%d, %d, %d)' % tuple(round(255 * c) for c in get_cmap('Greens')(0.8)[:3])
+    # with other normalizations
+    norm_pos, norm_neg = Normalize(0., 0.8), Normalize(0.2, 0.5)
+    monkeypatch.setattr(vis_utils, 'norm_pos', norm_pos)
+    monkeypatch.setattr(vis_utils, 'norm_neg', norm_neg)
+    color_func = make_posneg_color_func(ws_dict, norm_pos, norm_neg)
+    assert [posneg_color_func(word=w, font_size=10) for w in ws_dict] == [color_func(w) for w in ws_dict]
@@ -0,0 +1,117 @@
+from __future__ import unicode_literals, division, print_function, absolute_import
+import numpy as np
+import pytest
+from textcatvis.visualize_relevantwords import compute_contributions, sum_class_contributions, class_scores, assign_folds, crossval_clf, visualize_tfidf
+from textcatvis.sparse_utils import features2csr, tfidf_weight
+from conftest import make_corpus
+
+
+def train(n_cats, use_logreg):
+    from nlputils.features import FeatureTransform
+    from sklearn.svm import LinearSVC
+    from sklearn.linear_model import LogisticRegression
+    textdict, doccats = make_corpus(30 * n_cats, n_cats)
+    docids = sorted(textdict)
+    docfeats = FeatureTransform(norm='max', weight=True, renorm='length', norm_num=False).texts2features(textdict)
+    featmat, _ = features2csr(docfeats, docids)
+    # some documents of every class are used for the test
+    train_idx, test_idx = np.arange(len(docids)) >= 2 * n_cats, np.arange(len(docids)) < 2 * n_cats
+    clf = LogisticRegression() if use_logreg else LinearSVC(C=10., random_state=1)
+    clf.fit(featmat[train_idx], [doccats[did] for did in np.array(docids)[train_idx]])
+    return clf, featmat[test_idx], [doccats[did] for did in np.array(docids)[test_idx]]
+
+
+@pytest.mark.parametrize('n_cats', [2, 4])
+@pytest.mark.parametrize('use_logreg', [False, True])
+def test_contributions(n_cats, use_logreg):
+    clf, featmat, y_true = train(n_cats, use_logreg)
+    n_features = featmat.shape[1]
+    decision = clf.decision_function(featmat)
+    y_pred = clf.predict(featmat)
+    contribs, offsets = compute_contributions(clf, featmat, y_pred)
+    assert contribs.shape == featmat.shape
+    np.testing.assert_array_equal(contribs.indptr, featmat.indptr)
+    # the contributions of all features (incl. the offsets of the features not occurring in a document)
+    # add up to the score of the predicted class (for binary problems, the score is negative for the first class)
+    totals = np.asarray(contribs.sum(axis=1)).ravel() + (n_features - np.diff(contribs.indptr)) * offsets
+    if n_cats == 2:
+        expected = np.where(y_pred == clf.classes_[0], -decision, decision)
+    else:
+        expected = decision[np.arange(len(y_pred)), np.searchsorted(clf.classes_, y_pred)]
+    np.testing.assert_allclose(totals, expected, rtol=1e-10, atol=1e-12)
+    # the summed up scores of every class add up to the decision function of its documents
+    # (for binary problems, the scores for the predicted class are collected)
+    sums, class_offsets = sum_class_contributions(clf, featmat, y_true, contribs, offsets)
+    assert sums.shape == (n_cats, n_features)
+    class_totals = np.asarray(sums.sum(axis=1)).ravel() + n_features * class_offsets
+    true_scores = expected if n_cats == 2 else decision[np.arange(len(y_true)), np.searchsorted(clf.classes_, y_true)]
+    np.testing.assert_allclose(class_totals, [true_scores[np.array(y_true) == c].sum() for c in clf.classes_], rtol=1e-10, atol=1e-12)
+    # the dense scores are the sums plus offsets, normalized by the maximum absolute score of every class
+    dense = sums.toarray() + class_offsets.reshape(-1, 1)
+    for dtype in [np.float64, np.float32]:
+        scores = class_scores(sums, class_offsets, dtype)
+        assert scores.shape == (n_features, n_cats) and scores.dtype == dtype
+        np.testing.assert_allclose(scores, (dense / np.abs(dense).max(axis=1, keepdims=True)).T, rtol=1e-5 if dtype == np.float32 else 1e-12)
+
+
+@pytest.mark.parametrize('n_folds', [2, 3, 5])
+def test_assign_folds(n_folds):
+    labels = np.repeat(np.arange(4), [7, 12, 2, 30])
+    folds = assign_folds(labels, n_folds)
+    # every document is in exactly one of the folds, and the folds have (almost) the same size
+    assert folds.shape == labels.shape
+    assert set(folds) == set(range(n_folds))
+    sizes = np.bincount(folds, minlength=n_folds)
+    assert sizes.sum() == len(labels) and sizes.max() - sizes.min() <= 1
+    # the documents of every category are distributed evenly across the folds
+    for c in range(4):
+        sizes = np.bincount(folds[labels == c], minlength=n_folds)
+        assert sizes.max() - sizes.min() <= 1
+    np.testing.assert_array_equal(folds, assign_folds(labels, n_folds))
+
+
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_crossval_clf(n_jobs):
+    from nlputils.features import FeatureTransform
+    from sklearn.svm import LinearSVC
+    textdict, doccats = make_corpus(60, 3)
+    docids = sorted(textdict)
+    categories = sorted(set(doccats.values()))
+    labels = np.array([categories.index(doccats[did]) for did in docids])
+    tf, _ = features2csr(FeatureTransform(norm='max', weight=False, renorm='max').texts2features(textdict), docids)
+    clfs, idfs, y_pred, scores, _ = crossval_clf(LinearSVC(random_state=1), tf, labels, categories, n_folds=3, n_jobs=n_jobs, train_all=True)
+    assert len(clfs) == len(idfs) == 4 and scores.shape == (tf.shape[1], 3)
+    # every document is predicted by the classifier of the one fold it was held out from
+    folds = assign_folds(labels, 3)
+    for k in range(3):
+        featmat, idf = tfidf_weight(tf, np.flatnonzero(folds != k), 'length')
+        np.testing.assert_allclose(idf, idfs[k])
+        np.testing.assert_array_equal(y_pred[folds == k], clfs[k].predict(featmat[folds == k]))
+    # the last classifier is trained on all documents
+    np.testing.assert_allclose(idfs[-1], tfidf_weight(tf, np.arange(len(docids)), 'length')[1])
+
+
+@pytest.mark.parametrize('path', ['dense', 'cache', 'batches'])
+def test_visualize_tfidf_same_as_original(tmp_path, path):
+    from nlputils.features import FeatureTransform
+    from textcatvis.feature_cache import FeatureCache
+    textdict, doccats = make_corpus(60, 3)
+    # a word occurring in all documents gets a score of 0
+    textdict = {did: text + ' everywhere' for did, text in textdict.items()}
+    # the scores summed up from the dicts with the features of the documents (like the original visualize_tfidf,
+    # without bigrams since the htmls are created)
+    docfeats = FeatureTransform(norm='max', weight=True, renorm='max', identify_bigrams=False, norm_num=False).texts2features(textdict)
+    expected = {}
+    for did, cat in doccats.items():
+        for word, score in docfeats[did].items():
+            expected.setdefault(cat, {})
+            expected[cat][word] = expected[cat].get(word, 0.) + score
+    assert all(expected[cat]['everywhere'] == 0. for cat in expected)
+    kwargs = {'batch_size': 25} if path == 'batches' else {'cache': FeatureCache(str(tmp_path / 'cache'))} if path == 'cache' else {}
+    for _ in range(2 if path == 'cache' else 1):
+        result = visualize_tfidf(textdict, doccats, subdir_html=str(tmp_path), subdir_wc=str(tmp_path), headless=True, **kwargs)
+        assert set(result) == set(expected)
+        for cat in expected:
+            assert set(result[cat]) == set(expected[cat])
+            words = sorted(expected[cat])
+            np.testing.assert_allclose([result[cat][word] for word in words], [expected[cat][word] for word in words], rtol=1e-10, atol=1e-12)
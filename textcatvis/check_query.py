@@ -1,25 +1,66 @@
 from __future__ import unicode_literals, division, print_function, absolute_import
 from builtins import range, str
 import re
+import json
+import colorsys
 import numpy as np
-import matplotlib.pyplot as plt
-from nlputils.dict_utils import invert_dict0
-from nlputils.visualize import get_colors
+from .corpus import category_codes
+
+
+class Query(tuple):
+    """
+    Query
+
+    a query as returned by check_in, check_and and check_or, which can be unpacked into (function, name)
+    (where the function checks whether the query matches a set of words and the name is used to store the results),
+    but additionally remembers how it was constructed so it can also be evaluated with a QueryIndex
+
+    Attributes:
+        - op: 'in', 'and', or 'or'
+        - args: the query word (for 'in') or a tuple with the (nested) queries combined with 'and' / 'or'
+    """
+
+    def __new__(cls, fun, name, op, args):
+        self = tuple.__new__(cls, (fun, name))
+        self.op = op
+        self.args = args
+        return self
+
+
+def _as_query(q):
+    # convert regular string queries into Query objects as well
+    if isinstance(q, str):
+        return check_in(q)
+    return q
+
+
+def _combine_name(op, args):
+    # for simple queries the name is e.g. "and:('italy', 'earthquake')", nested queries are represented by their names
+    if all(isinstance(q, str) for q in args):
+        return op + ":" + str(args)
+    return op + ":(" + ", ".join(_as_query(q)[1] for q in args) + ")"
 
 
 def check_and(*args):
-    return lambda x: all(q in x for q in args), "and:"+str(args)
+    queries = [_as_query(q) for q in args]
+    return Query(lambda x: all(q[0](x) for q in queries), _combine_name("and", args), "and", tuple(queries))
 
 
 def check_or(*args):
-    return lambda x: any(q in x for q in args), "or:"+str(args)
+    queries = [_as_query(q) for q in args]
+    return Query(lambda x: any(q[0](x) for q in queries), _combine_name("or", args), "or", tuple(queries))
 
 
 def check_in(q):
-    return lambda x: q in x, q
+    return Query(lambda x: q in x, q, "in", q)
+
+
+def _tokenize(text):
+    # do some preprocessing
+    return set(re.findall(r"[a-z0-9-]+", text.lower()))
 
 
-def check_occurrences(textdict, doccats, queries):
+def check_occurrences(textdict, doccats, queries, index=None):
     """
     For all queries, check how often they occur in documents of a specific class
 
@@ -29,16 +70,23 @@ def check_occurrences(textdict, doccats, queries):
         queries: some queries to check for; either strings or using check_and and check_or, e.g.
                  ['hello', check_and('italy', 'earthquake'), check_or('trump', 'obama')]
                  - due to preprocessing constraints, all query words have to be single words!
+                 - queries can be nested, e.g. check_and('italy', check_or('earthquake', 'avalanche'))
+        index: optional QueryIndex built for these texts - if given, the queries are evaluated with the index
+               instead of scanning all documents (textdict and doccats are then ignored)
     Returns:
         results: a dict with {query: {category: frequency}}, e.g.
                  {'hello': {'politics': 0., 'world': 0.01},
                   'and:(italy, earthquake)': {'politics': 0.1, 'world': 0.2},
                   'or:(trump, obama)': {'politics': 0.9, 'world': 0.1}}
     """
-    # invert doccats to get for every category the list of documents in it
-    catdocs = invert_dict0(doccats)
+    if index is not None:
+        return index.check_occurrences(queries)
+    # map the categories to integer codes to count the matching documents of every category with bincount
+    docids = list(doccats.keys())
+    labels, categories = category_codes(doccats, docids)
+    n_docs = np.bincount(labels, minlength=len(categories)).astype(float)
     # do some preprocessing
-    textdict = {did: set(re.findall(r"[a-z0-9-]+", textdict[did].lower())) for did in textdict}
+    docwords = [_tokenize(textdict[did]) for did in docids]
     # check for all queries
     results = {}
     for q in queries:
@@ -47,13 +95,145 @@ def check_occurrences(textdict, doccats, queries):
             q = check_in(q)
         # split in name to store results and query itself
         q, str_q = q
-        results[str_q] = {}
-        for cat in catdocs:
-            results[str_q][cat] = len([1 for did in catdocs[cat] if q(textdict[did])]) / float(len(catdocs[cat]))
+        matches = np.fromiter((q(words) for words in docwords), dtype=bool, count=len(docwords))
+        results[str_q] = dict(zip(categories, (np.bincount(labels[matches], minlength=len(categories)) / n_docs).tolist()))
     return results
 
 
-def vis_occurrences(results, bars=False, queries=[]):
+class QueryIndex(object):
+    """
+    QueryIndex
+
+    an inverted index (word -> sorted list of the documents containing it) over a collection of texts,
+    to evaluate the queries from check_in, check_and and check_or as intersections and unions of document bitmaps
+    instead of checking every query against every document
+
+    Usage:
+        # build the index once
+        index = QueryIndex(textdict, doccats)
+        # evaluate as many queries as needed (same results as check_occurrences)
+        results = index.check_occurrences(['hello', check_and('italy', check_or('earthquake', 'avalanche'))])
+        # store the index and load it again later
+        index.save('index.npz')
+        index = QueryIndex.load('index.npz')
+
+    Attributes:
+        - docids: list with the docids corresponding to the document numbers in the postings
+        - categories: list with all categories
+        - labels: array with the index of the category for each document
+        - words: dict with {word: index}, where the documents containing the word are
+                 postings[offsets[index]:offsets[index+1]]
+    """
+
+    def __init__(self, textdict=None, doccats=None):
+        self.docids, self.categories = [], []
+        self.labels = np.zeros(0, dtype=np.int32)
+        self.words = {}
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.postings = np.zeros(0, dtype=np.uint32)
+        if textdict is not None:
+            self.build(textdict, doccats)
+
+    def build(self, textdict, doccats):
+        """
+        build the index
+
+        Inputs:
+            textdict: dict with {doc_id: text}
+            doccats: dict with {doc_id: category}
+        """
+        self.docids = list(doccats.keys())
+        self.labels, self.categories = category_codes(doccats, self.docids)
+        # since the documents are added in order, all postings lists are sorted
+        postings = {}
+        for i, did in enumerate(self.docids):
+            for word in _tokenize(textdict[did]):
+                postings.setdefault(word, []).append(i)
+        words = sorted(postings)
+        self.words = {word: i for i, word in enumerate(words)}
+        self.offsets = np.cumsum([0] + [len(postings[word]) for word in words], dtype=np.int64)
+        self.postings = np.array([i for word in words for i in postings[word]], dtype=np.uint32)
+
+    def save(self, fname):
+        """
+        store the index (the postings lists are delta encoded and compressed)
+
+        Inputs:
+            fname: path to the file (should end in .npz)
+        """
+        deltas = np.diff(self.postings.astype(np.int64), prepend=0)
+        # the first document of every postings list is stored as is
+        deltas[self.offsets[:-1]] = self.postings[self.offsets[:-1]]
+        words = sorted(self.words, key=self.words.get)
+        np.savez_compressed(fname, deltas=deltas.astype(np.uint32), offsets=self.offsets, labels=self.labels,
+                            words=np.array(json.dumps(words)), docids=np.array(json.dumps(self.docids)),
+                            categories=np.array(json.dumps(self.categories)))
+
+    @classmethod
+    def load(cls, fname):
+        """
+        load an index stored with save
+
+        Inputs:
+            fname: path to the file
+        Returns:
+            index: the QueryIndex
+        """
+        index = cls()
+        with np.load(fname) as data:
+            index.offsets, index.labels = data['offsets'], data['labels']
+            index.docids = json.loads(str(data['docids']))
+            index.categories = json.loads(str(data['categories']))
+            index.words = {word: i for i, word in enumerate(json.loads(str(data['words'])))}
+            # undo the delta encoding: cumulative sum within every postings list
+            postings = np.cumsum(data['deltas'], dtype=np.int64)
+            postings -= np.repeat(np.concatenate([[0], postings[index.offsets[1:] - 1]])[:-1], np.diff(index.offsets))
+            index.postings = postings.astype(np.uint32)
+        return index
+
+    def _evaluate(self, q):
+        # get a boolean array indicating which documents match the (possibly nested) query
+        q = _as_query(q)
+        if not isinstance(q, Query):
+            raise ValueError("only queries created with check_in, check_and, and check_or can be evaluated with the index")
+        if q.op == 'in':
+            docs = np.zeros(len(self.docids), dtype=bool)
+            if q.args in self.words:
+                i = self.words[q.args]
+                docs[self.postings[self.offsets[i]:self.offsets[i + 1]]] = True
+            return docs
+        docs = self._evaluate(q.args[0])
+        for sub_q in q.args[1:]:
+            if q.op == 'and':
+                docs &= self._evaluate(sub_q)
+            else:
+                docs |= self._evaluate(sub_q)
+        return docs
+
+    def check_occurrences(self, queries):
+        """
+        For all queries, check how often they occur in documents of a specific class
+
+        Inputs:
+            queries: some queries to check for; either strings or using check_and and check_or (see check_occurrences)
+        Returns:
+            results: a dict with {query: {category: frequency}}
+        """
+        n_docs = np.bincount(self.labels, minlength=len(self.categories))
+        results = {}
+        for q in queries:
+            q = _as_query(q)
+            freq = np.bincount(self.labels[self._evaluate(q)], minlength=len(self.categories)) / n_docs.astype(float)
+            results[q[1]] = dict(zip(self.categories, freq.tolist()))
+        return results
+
+
+def _get_colors(N=100):
+    # same as nlputils.visualize.get_colors, but without importing pyplot (which that module does)
+    return [colorsys.hsv_to_rgb(x * 1. / (N+1), 1., 0.8) for x in range(N)]
+
+
+def vis_occurrences(results, bars=False, queries=[], fname=None, headless=False):
     """
     Visualize the results from check_occurrences.
 
@@ -63,6 +243,11 @@ def vis_occurrences(results, bars=False, queries=[]):
               or there are a lot of categories and queries)
               or a bar chart (if bars=True; better for actual categories)
         queries: optional list with queries, has to be keys to results
+        fname: optional file name where the plot should be saved
+        headless: if True, the plot is created without pyplot (i.e. it isn't shown and doesn't stay in memory),
+                  e.g. to only save it to fname in a batch job
+    Returns:
+        fig: the matplotlib figure
     """
     if not queries:
         queries = sorted(results.keys())
@@ -70,19 +255,33 @@ def vis_occurrences(results, bars=False, queries=[]):
     categories = sorted(results[queries[0]].keys())
     cat_names = [str(c).replace('_', '\n') for c in categories]
     r = 90 if max([len(c) for c in cat_names]) > 6 else 0
-    colors = get_colors(len(queries))
-    plt.figure()
+    colors = _get_colors(len(queries))
+    # matplotlib is only imported when it's needed since it takes a while
+    if headless:
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        fig = Figure()
+        FigureCanvasAgg(fig)
+    else:
+        import matplotlib.pyplot as plt
+        fig = plt.figure()
+    ax = fig.add_subplot(111)
     if not bars:
         for i, q in enumerate(queries):
-            plt.plot([results[q][cat] for cat in categories], color=colors[i], label=q)
-        plt.xticks(list(range(len(categories)))[::max(1, len(categories)//10)], cat_names[::max(1, len(categories)//10)], rotation=r)
-        plt.xlim([0, len(categories)-1])
+            ax.plot([results[q][cat] for cat in categories], color=colors[i], label=q)
+        ax.set_xticks(list(range(len(categories)))[::max(1, len(categories)//10)])
+        ax.set_xticklabels(cat_names[::max(1, len(categories)//10)], rotation=r)
+        ax.set_xlim([0, len(categories)-1])
     else:
         ind = np.arange(len(categories))
         width = 0.9/len(queries)
         for i, q in enumerate(queries):
-            plt.bar(ind + i*width, [results[q][cat] for cat in categories], width, color=colors[i], label=q)
-        plt.xticks(ind + 0.45, cat_names, rotation=r)
-        plt.xlim([-0.1, len(categories)])
-    plt.ylabel('frequency')
-    plt.legend(loc='center left', bbox_to_anchor=(1, 0.5))
+            ax.bar(ind + i*width, [results[q][cat] for cat in categories], width, color=colors[i], label=q)
+        ax.set_xticks(ind + 0.45)
+        ax.set_xticklabels(cat_names, rotation=r)
+        ax.set_xlim([-0.1, len(categories)])
+    ax.set_ylabel('frequency')
+    ax.legend(loc='center left', bbox_to_anchor=(1, 0.5))
+    if fname:
+        fig.savefig(fname, bbox_inches='tight')
+    return fig
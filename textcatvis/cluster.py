@@ -1,32 +1,92 @@
 from __future__ import unicode_literals, division, print_function, absolute_import
 import numpy as np
-from sklearn.metrics.pairwise import linear_kernel
-from sklearn.decomposition import KernelPCA
-from sklearn.cluster import DBSCAN
-from nlputils.features import FeatureTransform, features2mat
+from scipy.linalg import lu
+from nlputils.features import FeatureTransform
+from .feature_cache import texts2featmat
+from . import instrument
 
 
-def cluster_texts(textdict, eps=0.45, min_samples=3):
+def randomized_pca(X, n_components, n_iter=5, n_oversamples=10, seed=1):
+    """
+    reduce the data with a PCA computed with a randomized truncated SVD (Halko et al.) of the centered data,
+    where the mean is only subtracted in the products with the (sparse) matrix, i.e. the matrix isn't densified
+
+    Input:
+        X: a (sparse) n x d matrix
+        n_components: number of dimensions the data is reduced to
+        n_iter: number of power iterations (default: 5)
+        n_oversamples: number of additional random vectors used to find the range of the data (default: 10)
+        seed: seed for the random vectors (default: 1)
+    Returns:
+        X_red: a dense n x n_components array with the projection of the centered data on the principal components
+    """
+    mean = np.asarray(X.mean(axis=0)).ravel()
+
+    def dot(Q):
+        # (X - mean) * Q
+        return X.dot(Q) - mean.dot(Q)
+
+    def rdot(Q):
+        # (X - mean)^T * Q
+        return X.T.dot(Q) - np.outer(mean, Q.sum(axis=0))
+    Q = np.random.RandomState(seed).normal(size=(X.shape[1], n_components + n_oversamples))
+    # find an orthonormal basis of the range of the centered data with power iterations
+    # (like in sklearn's randomized_svd, the intermediate results are only normalized with a cheaper LU decomposition)
+    for _ in range(n_iter):
+        Q = lu(rdot(lu(dot(Q), permute_l=True)[0]), permute_l=True)[0]
+    Q = np.linalg.qr(dot(Q))[0]
+    # svd of the projection of the data on this basis
+    U, S, _ = np.linalg.svd(rdot(Q).T, full_matrices=False)
+    return Q.dot(U[:, :n_components]) * S[:n_components]
+
+
+@instrument.timed('cluster_texts')
+def cluster_texts(textdict, eps=0.45, min_samples=3, cache=None, scalable=False, n_components=250, algorithm='auto'):
     """
     cluster the given texts
 
     Input:
         textdict: dictionary with {docid: text}
+        eps, min_samples: parameters for DBSCAN
+        cache: an optional FeatureCache to load the features from instead of recomputing them
+        scalable: if True, don't compute a dense n x n kernel / distance matrix (needed for more than ~50k documents):
+                  the features are reduced with a randomized PCA of the sparse feature matrix
+                  (instead of a linear kernel PCA; both center the data) and DBSCAN gets a sparse graph
+                  with only the eps-neighbors of every document (default: False)
+        n_components: number of dimensions the features are reduced to before clustering (default: 250)
+        algorithm: algorithm used to find the eps-neighbors in the scalable mode (see sklearn's NearestNeighbors)
     Returns:
         doccats: dictionary with {docid: cluster_id}
     """
+    # sklearn is only imported when it's needed since it takes a while
+    from sklearn.cluster import DBSCAN
     doc_ids = list(textdict.keys())
     # transform texts into length normalized kpca features
     ft = FeatureTransform(norm='max', weight=True, renorm='length', norm_num=False)
-    docfeats = ft.texts2features(textdict)
-    X, featurenames = features2mat(docfeats, doc_ids)
-    e_lkpca = KernelPCA(n_components=250, kernel='linear')
-    X = e_lkpca.fit_transform(X)
-    xnorm = np.linalg.norm(X, axis=1)
-    X = X/xnorm.reshape(X.shape[0], 1)
-    # compute cosine similarity
-    D = 1. - linear_kernel(X)
+    with instrument.stage('features', n_docs=len(doc_ids)):
+        X, featurenames = texts2featmat(ft, textdict, doc_ids, cache=cache)
+    with instrument.stage('distances', n_docs=len(doc_ids), scalable=scalable):
+        if scalable:
+            from sklearn.neighbors import NearestNeighbors
+            X = randomized_pca(X, min(n_components, min(X.shape) - 1))
+            xnorm = np.linalg.norm(X, axis=1)
+            X = X/np.maximum(xnorm, 1e-12).reshape(X.shape[0], 1)
+            # for length normalized vectors, the cosine distance 1 - x*y = ||x - y||^2 / 2,
+            # i.e. all neighbors within eps cosine distance are within sqrt(2*eps) euclidean distance
+            nn = NearestNeighbors(radius=np.sqrt(2. * eps), algorithm=algorithm).fit(X)
+            D = nn.radius_neighbors_graph(mode='distance')
+            D.data = D.data**2 / 2.
+        else:
+            from sklearn.decomposition import KernelPCA
+            from sklearn.metrics.pairwise import linear_kernel
+            e_lkpca = KernelPCA(n_components=n_components, kernel='linear')
+            X = e_lkpca.fit_transform(X)
+            xnorm = np.linalg.norm(X, axis=1)
+            X = X/xnorm.reshape(X.shape[0], 1)
+            # compute cosine distance (rounding errors can make it slightly negative, which DBSCAN doesn't accept)
+            D = np.maximum(1. - linear_kernel(X), 0.)
     # and cluster with dbscan
-    clst = DBSCAN(eps=eps, metric='precomputed', min_samples=min_samples)
-    y_pred = clst.fit_predict(D)
+    with instrument.stage('dbscan', n_docs=len(doc_ids)):
+        clst = DBSCAN(eps=eps, metric='precomputed', min_samples=min_samples)
+        y_pred = clst.fit_predict(D)
     return {did: y_pred[i] for i, did in enumerate(doc_ids)}
@@ -0,0 +1,180 @@
+from __future__ import unicode_literals, division, print_function, absolute_import
+from io import StringIO
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+def category_codes(doccats, docids, categories=None):
+    """
+    Map the categories of the given documents to integer codes
+
+    Input:
+        doccats: dict with {docid: category}
+        docids: list of docids for which the codes should be returned
+        categories: list of categories defining the codes (default: all categories of the docids documents, sorted)
+    Returns:
+        labels: numpy int array with the index of the category in categories for every document
+        categories: the list of categories
+    """
+    if categories is None:
+        categories = sorted(set(doccats[did] for did in docids), key=str)
+    catidx = {cat: i for i, cat in enumerate(categories)}
+    labels = np.fromiter(map(catidx.__getitem__, map(doccats.__getitem__, docids)), dtype=np.int32, count=len(docids))
+    return labels, list(categories)
+
+
+class _TextView(Mapping):
+    """
+    a read-only dict-like view with {docid: text} on (a subset of) the documents of a Corpus
+    """
+
+    def __init__(self, corpus, idx):
+        self._corpus = corpus
+        self._idx = idx
+        # which documents of the corpus are in the view (only created when it's needed)
+        self._mask = None
+
+    def __getitem__(self, docid):
+        i = self._corpus.index(docid)
+        if self._mask is None:
+            self._mask = np.zeros(len(self._corpus), dtype=bool)
+            self._mask[self._idx] = True
+        if not self._mask[i]:
+            raise KeyError(docid)
+        return self._corpus.text(i)
+
+    def __iter__(self):
+        docids = self._corpus.docids
+        return (docids[i] for i in self._idx)
+
+    def __len__(self):
+        return len(self._idx)
+
+
+class Corpus(object):
+    """
+    Corpus
+
+    a compact representation of a text categorization dataset: the docids and categories are mapped to integer codes once,
+    the categories of the documents are kept as an array of codes and the texts in one contiguous string, so subsets of
+    the documents can be selected with integer index arrays (which can be used directly with the sparse matrices)
+    instead of building new dicts and sets with the docids
+
+    Usage:
+        corpus = Corpus(textdict, doccats)
+        # the documents of every category (instead of invert_dict0(doccats))
+        catdocs = corpus.catdocs()
+        # all documents except for the visids (instead of set differences of the docids)
+        vis_idx = corpus.indices(visids)
+        train_idx = corpus.complement(vis_idx)
+        # a dict-like view with {docid: text} for a subset, e.g. for FeatureTransform.texts2features
+        docfeats = ft.texts2features(corpus.textdict(train_idx))
+        # the doc x category indicator matrix with the rows corresponding to the train_idx documents
+        catmat = corpus.indicator(train_idx)
+
+    Attributes:
+        - docids: list with the docids, i.e. the document with index i is docids[i]
+        - categories: list with the categories (sorted), i.e. the category with code j is categories[j]
+        - labels: numpy int array with the category code of every document
+        - text_store: the texts of all documents concatenated into one string
+        - text_offsets: numpy array with the start of every text in the text_store (and the total length at the end),
+                        i.e. the text of document i is text_store[text_offsets[i]:text_offsets[i+1]]
+    """
+
+    def __init__(self, textdict, doccats, categories=None):
+        """
+        Input:
+            textdict: dict with {doc_id: text} (e.g. a data_utils.LazyTextDict, the texts are only read once)
+            doccats: dict with {doc_id: category}
+            categories: optional list of categories defining the category codes (default: all categories, sorted)
+        """
+        self.docids = list(textdict.keys())
+        # write the texts into one buffer, so there is no need to keep a list with all texts in addition to the store
+        buf = StringIO()
+        lengths = [buf.write(textdict[did]) for did in self.docids]
+        self.text_store = buf.getvalue()
+        self.text_offsets = np.zeros(len(self.docids) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.text_offsets[1:])
+        self.labels, self.categories = category_codes(doccats, self.docids, categories)
+        self._docidx = None
+
+    def __len__(self):
+        return len(self.docids)
+
+    def text(self, i):
+        """
+        Returns:
+            the text of the document with index i
+        """
+        return self.text_store[self.text_offsets[i]:self.text_offsets[i + 1]]
+
+    def index(self, docid):
+        """
+        Returns:
+            the index of the document with the given docid
+        """
+        if self._docidx is None:
+            self._docidx = {did: i for i, did in enumerate(self.docids)}
+        return self._docidx[docid]
+
+    def indices(self, docids):
+        """
+        Returns:
+            numpy int array with the indices of the documents with the given docids
+        """
+        return np.array([self.index(did) for did in docids], dtype=int)
+
+    def complement(self, idx):
+        """
+        Returns:
+            numpy int array with the (sorted) indices of all documents not in idx
+        """
+        mask = np.ones(len(self.docids), dtype=bool)
+        mask[idx] = False
+        return np.flatnonzero(mask)
+
+    def counts(self, idx=None):
+        """
+        Returns:
+            numpy int array with the number of documents (in idx or in the whole corpus) of every category
+        """
+        labels = self.labels if idx is None else self.labels[idx]
+        return np.bincount(labels, minlength=len(self.categories))
+
+    def catdocs(self, idx=None):
+        """
+        Returns:
+            list with a (sorted) numpy int array with the indices of the documents (in idx or in the whole corpus)
+            for every category
+        """
+        idx = np.arange(len(self.docids)) if idx is None else np.sort(idx)
+        order = idx[np.argsort(self.labels[idx], kind='mergesort')]
+        return np.split(order, np.cumsum(self.counts(idx))[:-1])
+
+    def indicator(self, idx=None):
+        """
+        Returns:
+            a sparse csr matrix with documents (in idx or in the whole corpus) x categories
+            with a 1 where the document belongs to the category
+        """
+        labels = self.labels if idx is None else self.labels[idx]
+        return csr_matrix((np.ones(len(labels)), labels, np.arange(len(labels) + 1)), shape=(len(labels), len(self.categories)))
+
+    def textdict(self, idx=None):
+        """
+        Returns:
+            a read-only dict-like view with {doc_id: text} for the documents in idx (or all documents)
+        """
+        return _TextView(self, np.arange(len(self.docids)) if idx is None else idx)
+
+    def doccats(self, idx=None):
+        """
+        Returns:
+            a dict with {doc_id: category} for the documents in idx (or all documents)
+        """
+        idx = range(len(self.docids)) if idx is None else idx
+        return {self.docids[i]: self.categories[self.labels[i]] for i in idx}
@@ -2,9 +2,64 @@ from __future__ import unicode_literals, division, print_function, absolute_impo
 from builtins import next
 import os
 from glob import iglob
+from itertools import islice
+from multiprocessing.pool import ThreadPool
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
 
 
-def load_data(path):
+def _list_files(path):
+    """
+    Go through the dataset folder (see load_data) and yield (docid, fname, category) for all .txt files
+    """
+    # if there are unlabeled documents in the current directory
+    for fname in iglob(os.path.join(path, '*.txt')):
+        # construct unique docid
+        docid = os.path.splitext(os.path.basename(fname))[0]
+        yield docid, fname, '.'
+    # go through all category subdirectories
+    for cat in next(os.walk(path))[1]:
+        if not cat.startswith('.'):
+            cat_path = os.path.join(path, cat)
+            # go through all txt documents
+            for fname in iglob(os.path.join(cat_path, '*.txt')):
+                # construct unique docid
+                docid = cat + ' ' + os.path.splitext(os.path.basename(fname))[0]
+                yield docid, fname, cat
+
+
+def _read_file(fname):
+    with open(fname) as f:
+        return f.read()
+
+
+class LazyTextDict(Mapping):
+    """
+    LazyTextDict
+
+    a read-only dict with {doc_id: text}, where the texts are only read from the files when they are accessed
+    (i.e. it can be used in place of the textdict returned by load_data without keeping all texts in memory)
+
+    Attributes:
+        - fnames: dict with {doc_id: path to the text file}
+    """
+
+    def __init__(self, fnames):
+        self.fnames = fnames
+
+    def __getitem__(self, docid):
+        return _read_file(self.fnames[docid])
+
+    def __iter__(self):
+        return iter(self.fnames)
+
+    def __len__(self):
+        return len(self.fnames)
+
+
+def load_data(path, lazy=False):
     """
     This is a utility function to load a text categorization dataset.
     It assumes the data is organized in the folder supplied in the path argument with different
@@ -16,30 +71,48 @@ def load_data(path):
 
     Input:
         path: path to a folder with the data
+        lazy: if True, the texts are only read from disk when they are accessed (default: False)
     Returns:
-        textdict: dict with {doc_id: text}
+        textdict: dict with {doc_id: text} (a LazyTextDict if lazy=True)
         doccats: dict with {doc_id: category}
     """
-    textdict = {}
+    fnames = {}
     doccats = {}
-    # if there are unlabeled documents in the current directory
-    for fname in iglob(os.path.join(path, '*.txt')):
-        # construct unique docid
-        docid = os.path.splitext(os.path.basename(fname))[0]
-        # save category + text
-        doccats[docid] = '.'
-        with open(fname) as f:
-            textdict[docid] = f.read()
-    # go through all category subdirectories
-    for cat in next(os.walk(path))[1]:
-        if not cat.startswith('.'):
-            cat_path = os.path.join(path, cat)
-            # go through all txt documents
-            for fname in iglob(os.path.join(cat_path, '*.txt')):
-                # construct unique docid
-                docid = cat + ' ' + os.path.splitext(os.path.basename(fname))[0]
-                # save category + text
-                doccats[docid] = cat
-                with open(fname) as f:
-                    textdict[docid] = f.read()
+    for docid, fname, cat in _list_files(path):
+        # save category + file name
+        doccats[docid] = cat
+        fnames[docid] = fname
+    if lazy:
+        return LazyTextDict(fnames), doccats
+    textdict = {docid: _read_file(fnames[docid]) for docid in fnames}
     return textdict, doccats
+
+
+def iter_data(path, chunksize=1000, n_threads=8):
+    """
+    Load a text categorization dataset (organized as described in load_data) in chunks,
+    so that never more than a few chunks of texts have to be kept in memory.
+
+    Input:
+        path: path to a folder with the data
+        chunksize: number of documents per chunk (default: 1000)
+        n_threads: number of threads used to read the files (to overlap the I/O; default: 8)
+    Yields:
+        lists with up to chunksize (doc_id, text, category) tuples
+    """
+    files = _list_files(path)
+    pool = ThreadPool(n_threads)
+
+    def read_chunk():
+        entries = list(islice(files, chunksize))
+        return entries, pool.map_async(_read_file, [fname for _, fname, _ in entries])
+    try:
+        entries, texts = read_chunk()
+        while entries:
+            texts = texts.get()
+            # start reading the next chunk in the background while the current one is processed
+            next_entries, next_texts = read_chunk()
+            yield [(docid, text, cat) for (docid, _, cat), text in zip(entries, texts)]
+            entries, texts = next_entries, next_texts
+    finally:
+        pool.terminate()
@@ -1,8 +1,13 @@
 from __future__ import unicode_literals, division, print_function, absolute_import
 import sys
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 import numpy as np
-from nlputils.dict_utils import invert_dict0, invert_dict2
+from scipy.sparse import csr_matrix
 from nlputils.features import FeatureTransform
+from .sparse_utils import features2csr, category_indicator, csr2dicts
+from .feature_cache import texts2featmat, freeze_bigrams
+from . import instrument
 
 
 def distinctive_fun_tpr(tpr, fpr):
@@ -34,7 +39,93 @@ def distinctive_fun_quotdiff(tpr, fpr):
     return 0.5 * (distinctive_fun_quot(tpr, fpr) + distinctive_fun_diff(tpr, fpr))
 
 
-def get_distinctive_words(textdict, doccats, distinctive_fun=distinctive_fun_quotdiff):
+def _score_entries(tpr, words, tpr_sum, tpr_sqsum, n_cats, distinctive_fun):
+    """
+    compute the distinctive scores for individual (category, word) entries
+
+    Input:
+        - tpr: array with the tprs of the entries (i.e. of the word in the target category)
+        - words: array with the word (column) index of every entry
+        - tpr_sum, tpr_sqsum: for every word, the sum and sum of squares of its tprs over all categories
+        - n_cats: the number of categories
+        - distinctive_fun: which formula should be used when computing the score
+    Returns:
+        - an array with the distinctive scores of the entries
+    """
+    # the fpr is the mean+std of the tprs in all other categories, which can be computed for all
+    # categories at once by subtracting the target category from the sums and sums of squares over all categories
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fpr_mean = (tpr_sum[words] - tpr) / (n_cats - 1)
+        fpr_sqmean = (tpr_sqsum[words] - tpr**2) / (n_cats - 1)
+        fpr_var = fpr_sqmean - fpr_mean**2
+        # variances within the rounding error of the sums (e.g. with only 2 categories, where the variance is 0,
+        # or slightly negative ones) are set to 0, since their square root would add noise of ~1e-8 to the fpr
+        fpr_var[fpr_var <= 4 * n_cats * np.finfo(float).eps * fpr_sqmean] = 0.
+        fpr = fpr_mean + np.sqrt(fpr_var)
+        return distinctive_fun(tpr, fpr)
+
+
+def _tpr_sums(tprs):
+    # for every word, the sum and sum of squares of its tprs over all categories
+    return np.asarray(tprs.sum(axis=0)).ravel(), np.asarray(tprs.multiply(tprs).sum(axis=0)).ravel()
+
+
+def compute_tprs(featmat, catmat):
+    """
+    compute the true positive rates for every word and category, i.e.
+    the average tf score in the category (including the zero counts)
+
+    Input:
+        - featmat: a sparse csr matrix with docs x words with the (max normalized) term frequencies
+        - catmat: a sparse indicator matrix with docs x categories
+    Returns:
+        - tprs: a sparse csr matrix with categories x words with the tpr of every word in every category
+    """
+    tprs = csr_matrix(catmat.T.dot(featmat))
+    tprs.eliminate_zeros()
+    tprs.data /= np.repeat(np.asarray(catmat.sum(axis=0)).ravel(), np.diff(tprs.indptr))
+    return tprs
+
+
+def compute_distinctive_scores(tprs, distinctive_fun=distinctive_fun_quotdiff, n_jobs=1):
+    """
+    Given the true positive rates of all words in all categories, compute the distinctive scores
+
+    Input:
+        - tprs: a sparse csr matrix with categories x words with the tpr of every word in every category
+        - distinctive_fun: which formula should be used when computing the score (default: distinctive_fun_quotdiff)
+        - n_jobs: number of threads used to score blocks of categories in parallel (default 1; -1: use all cores)
+                  the result doesn't depend on the number of threads since every entry is scored independently
+    Returns:
+        - scores: a sparse csr matrix with categories x words with the distinctive score of every word
+          for every category where the word has a tpr > 0
+    """
+    tpr_sum, tpr_sqsum = _tpr_sums(tprs)
+    if n_jobs < 0:
+        n_jobs = max(1, cpu_count() + 1 + n_jobs)
+    if n_jobs == 1:
+        scores = _score_entries(tprs.data, tprs.indices, tpr_sum, tpr_sqsum, tprs.shape[0], distinctive_fun)
+    else:
+        # split the categories into contiguous blocks with about the same number of entries, which are scored in
+        # threads (numpy releases the GIL, so the arrays can be shared) and written to their part of the result
+        bounds = np.unique(tprs.indptr[np.searchsorted(tprs.indptr, np.linspace(0, tprs.nnz, 4 * n_jobs + 1))])
+        scores = np.empty(tprs.nnz)
+
+        def score_block(k):
+            start, end = bounds[k], bounds[k + 1]
+            scores[start:end] = _score_entries(tprs.data[start:end], tprs.indices[start:end], tpr_sum, tpr_sqsum,
+                                               tprs.shape[0], distinctive_fun)
+        pool = ThreadPool(n_jobs)
+        try:
+            pool.map(score_block, range(len(bounds) - 1))
+        finally:
+            pool.close()
+            pool.join()
+    return csr_matrix((scores, tprs.indices.copy(), tprs.indptr.copy()), shape=tprs.shape)
+
+
+@instrument.timed('get_distinctive_words')
+def get_distinctive_words(textdict, doccats, distinctive_fun=distinctive_fun_quotdiff, return_mats=False, cache=None, n_jobs=1):
     """
     For every category, find distinctive (i.e. `distinguishing') words by comparing how often the word each word
     occurs in this target category compared to all other categories.
@@ -43,51 +134,233 @@ def get_distinctive_words(textdict, doccats, distinctive_fun=distinctive_fun_quo
         - textdict: a dict with {docid: text}
         - doccats: a dict with {docid: cat} (to get trends in time, cat could also be a year/day/week)
         - distinctive_fun: which formula should be used when computing the score (default: distinctive_fun_quotdiff)
+        - return_mats: if True, the scores are returned as a sparse matrix instead of a dict (default: False)
+        - cache: an optional FeatureCache to load the features from instead of recomputing them
+        - n_jobs: number of threads used to compute the scores (see compute_distinctive_scores)
     Returns:
         - distinctive_words: a dict with {cat: {word: score}},
           i.e. for every category the words and a score indicating
           how relevant the word is for this category (the higher the better)
           you could then do sorted(distinctive_words[cat], key=distinctive_words[cat].get, reverse=True)[:10]
           to get the 10 most distinguishing words for that category
+        or if return_mats=True:
+        - scores: a sparse csr matrix with categories x featurenames with the distinctive scores
+        - categories: the list of categories corresponding to the rows of the scores matrix
+        - featurenames: the list of words corresponding to the columns of the scores matrix
     """
-    # transform all texts into sets of preprocessed words and bigrams
-    print("computing features")
-    ft = FeatureTransform(norm='max', weight=False, renorm=False, identify_bigrams=True, norm_num=False)
-    docfeats = ft.texts2features(textdict)
-    #docfeats = {did: set(docfeats[did].keys()) for did in docfeats}
-    # invert this dict to get for every word the documents it occurs in
-    # word_dids = {word: set(dids) for word, dids in invert_dict1(docfeats).items()}
-    # invert the doccats dict to get for every category a list of documents belonging to it
-    cats_dids = {cat: set(dids) for cat, dids in invert_dict0(doccats).items()}
-    # get a list of all words
-    word_list = list(invert_dict2(docfeats).keys())
-    # count the true positives for every word and category
-    print("computing tpr for all words and categories")
-    tpc_words = {}
-    for word in word_list:
-        tpc_words[word] = {}
-        for cat in cats_dids:
-            # out of all docs in this category, in how many did the word occur?
-            #tpc_words[word][cat] = len(cats_dids[cat].intersection(word_dids[word])) / len(cats_dids[cat])
-            # average tf score in the category
-            # (don't just take mean of the list comprehension otherwise you're missing zero counts)
-            tpc_words[word][cat] = sum([docfeats[did][word] for did in cats_dids[cat] if word in docfeats[did]]) / len(cats_dids[cat])
+    with instrument.stage('features', n_docs=len(textdict)) as st:
+        # transform all texts into sets of preprocessed words and bigrams
+        print("computing features")
+        ft = FeatureTransform(norm='max', weight=False, renorm=False, identify_bigrams=True, norm_num=False)
+        # build a sparse doc x word matrix and a doc x category indicator matrix
+        docids = list(doccats.keys())
+        featmat, featurenames = texts2featmat(ft, textdict, docids, cache=cache)
+        catmat, categories = category_indicator(doccats, docids)
+        st.set(n_features=len(featurenames))
+    with instrument.stage('tprs', n_categories=len(categories)):
+        print("computing tpr for all words and categories")
+        tprs = compute_tprs(featmat, catmat)
     # for every category, compute a score for every word
-    distinctive_words = {}
-    for cat in cats_dids:
-        print("computing distinctive words for category %r" % cat)
-        distinctive_words[cat] = {}
-        # compute a score for every word
-        for word in word_list:
-            # in how many of the target category documents the word occurs
-            tpr = tpc_words[word][cat]
-            if tpr:
-                # in how many of the non-target category documents the word occurs (mean+std)
-                fprs = [tpc_words[word][c] for c in cats_dids if not c == cat]
-                fpr = np.mean(fprs) + np.std(fprs)
-                # compute score
-                distinctive_words[cat][word] = distinctive_fun(tpr, fpr)
-    return distinctive_words
+    print("computing distinctive words for %i categories" % len(categories))
+    with instrument.stage('scores', n_categories=len(categories), n_entries=tprs.nnz):
+        scores = compute_distinctive_scores(tprs, distinctive_fun, n_jobs)
+    if return_mats:
+        return scores, categories, featurenames
+    return csr2dicts(scores, categories, featurenames)
+
+
+class DistinctiveWordsAccumulator(object):
+    """
+    DistinctiveWordsAccumulator
+
+    keeps the summed up features and number of documents of every category, so the distinctive words can be updated
+    when new documents come in (e.g. the articles of a new day, with the days as categories) without having to go
+    through all the old texts again. When the scores are requested, only the scores that could have changed are recomputed:
+    all scores of the categories that received new documents and, in the other categories, the scores of the words that
+    occur in these or in retired categories. When the number of categories changes (i.e. a category was added or retired),
+    the fprs of all words are averaged over a different number of categories, so then the scores of all words occurring in
+    more than one category are recomputed as well (only the scores of words unique to a category stay the same), which
+    is almost as expensive as computing all scores again.
+
+    Usage:
+        acc = DistinctiveWordsAccumulator()
+        # add the first batch of documents (the bigrams are identified using this first batch only)
+        acc.add(textdict, doccats)
+        distinctive_words = acc.get_distinctive_words()
+        # add new documents (for existing or new categories) and remove old categories
+        acc.add(textdict_today, doccats_today)
+        acc.retire(['2017-01-01'])
+        distinctive_words = acc.get_distinctive_words()
+
+    Attributes:
+        - ft: the FeatureTransform used to compute the features
+        - categories: list with all current categories (rows of tpr_sums)
+        - featurenames: list with all words seen so far (columns of tpr_sums)
+        - tpr_sums: sparse csr matrix with categories x featurenames with the summed up features of all documents
+        - n_docs: array with the number of documents in every category
+    """
+
+    def __init__(self, distinctive_fun=distinctive_fun_quotdiff):
+        self.distinctive_fun = distinctive_fun
+        self.ft = FeatureTransform(norm='max', weight=False, renorm=False, identify_bigrams=True, norm_num=False)
+        self.categories, self.featurenames = [], []
+        self.catdict, self.fnamedict = {}, {}
+        self.tpr_sums = csr_matrix((0, 0))
+        self.n_docs = np.zeros(0)
+        # the last computed scores and what changed since then
+        self.distinctive_words = {}
+        self._changed_cats, self._changed_words = set(), set()
+        self._n_cats = 0
+
+    def add(self, textdict, doccats):
+        """
+        add a batch of new documents
+
+        Input:
+            - textdict: a dict with {docid: text}
+            - doccats: a dict with {docid: cat}
+        """
+        docfeats = self.ft.texts2features(textdict)
+        # the bigrams are fixed after the first batch (even if none were found)
+        freeze_bigrams(self.ft)
+        docids = list(doccats.keys())
+        # extend the list of words and categories with the new ones from this batch
+        for did in docids:
+            for word in docfeats[did]:
+                if word not in self.fnamedict:
+                    self.fnamedict[word] = len(self.featurenames)
+                    self.featurenames.append(word)
+            if doccats[did] not in self.catdict:
+                self.catdict[doccats[did]] = len(self.categories)
+                self.categories.append(doccats[did])
+        featmat, _ = features2csr(docfeats, docids, self.featurenames)
+        catmat, _ = category_indicator(doccats, docids, self.categories)
+        # add the summed up features of the batch's documents to the sums of their categories
+        self.tpr_sums.resize((len(self.categories), len(self.featurenames)))
+        self.tpr_sums = csr_matrix(self.tpr_sums + catmat.T.dot(featmat))
+        self.n_docs = np.concatenate([self.n_docs, np.zeros(len(self.categories) - len(self.n_docs))])
+        self.n_docs += np.asarray(catmat.sum(axis=0)).ravel()
+        self._changed_cats.update(doccats.values())
+
+    def add_chunk(self, chunk):
+        """
+        add a batch of new documents given as a list of (docid, text, cat) tuples (e.g. from data_utils.iter_data)
+        """
+        self.add({did: text for did, text, _ in chunk}, {did: cat for did, _, cat in chunk})
+
+    def retire(self, categories):
+        """
+        remove the given categories (e.g. days that are too old) with all their documents
+        """
+        categories = set(categories)
+        keep = [i for i, cat in enumerate(self.categories) if cat not in categories]
+        retired = self.tpr_sums[[i for i, cat in enumerate(self.categories) if cat in categories]]
+        self._changed_words.update(retired.indices.tolist())
+        self.tpr_sums = self.tpr_sums[keep]
+        self.n_docs = self.n_docs[keep]
+        self.categories = [self.categories[i] for i in keep]
+        self.catdict = {cat: i for i, cat in enumerate(self.categories)}
+        self._changed_cats.difference_update(categories)
+        for cat in categories:
+            self.distinctive_words.pop(cat, None)
+
+    def get_tprs(self):
+        """
+        Returns:
+            - tprs: a sparse csr matrix with categories x featurenames with the tpr of every word in every category
+        """
+        tprs = csr_matrix(self.tpr_sums, copy=True)
+        tprs.eliminate_zeros()
+        tprs.data /= np.repeat(self.n_docs, np.diff(tprs.indptr))
+        return tprs
+
+    def get_scores(self):
+        """
+        compute all distinctive scores (like get_distinctive_words with return_mats=True)
+
+        Returns:
+            - scores: a sparse csr matrix with categories x featurenames with the distinctive scores
+            - categories: the list of categories corresponding to the rows of the scores matrix
+            - featurenames: the (sorted) list of words corresponding to the columns of the scores matrix
+        """
+        order = np.argsort(self.featurenames)
+        tprs = csr_matrix(self.get_tprs()[:, order])
+        return compute_distinctive_scores(tprs, self.distinctive_fun), list(self.categories), [self.featurenames[j] for j in order]
+
+    def get_distinctive_words(self):
+        """
+        get the distinctive words of all categories (see get_distinctive_words)
+
+        Returns:
+            - distinctive_words: a dict with {cat: {word: score}}
+              (the dicts of the categories whose scores didn't change are the same as in the previous call,
+              so they should not be modified)
+        """
+        tprs = self.get_tprs()
+        tpr_sum, tpr_sqsum = _tpr_sums(tprs)
+        n_cats = len(self.categories)
+        if n_cats != self._n_cats:
+            if min(n_cats, self._n_cats) <= 1:
+                # with a single category, there are no fprs to compare the tprs with
+                self._changed_cats = set(self.categories)
+            else:
+                # the fprs are averaged over a different number of categories, i.e. the scores of all words
+                # occurring in more than one category change (the others have an fpr of 0 in any case)
+                self._changed_words.update(np.flatnonzero(np.bincount(tprs.indices, minlength=len(self.featurenames)) > 1).tolist())
+        # the scores of a category change completely if it received new documents
+        # and for all other categories only the scores of the words that occur in the changed categories
+        # (since their number of documents and therefore all their tprs changed) or in the retired categories change
+        other_rows = []
+        for i, cat in enumerate(self.categories):
+            if cat in self._changed_cats:
+                self._changed_words.update(tprs.indices[tprs.indptr[i]:tprs.indptr[i + 1]].tolist())
+                start, end = tprs.indptr[i], tprs.indptr[i + 1]
+                scores = _score_entries(tprs.data[start:end], tprs.indices[start:end], tpr_sum, tpr_sqsum, n_cats, self.distinctive_fun)
+                self.distinctive_words[cat] = {self.featurenames[j]: v for j, v in zip(tprs.indices[start:end], scores)}
+            else:
+                other_rows.append(i)
+        if self._changed_words and other_rows:
+            words = np.array(sorted(self._changed_words))
+            tprs = csr_matrix(tprs[other_rows][:, words])
+            scores = _score_entries(tprs.data, words[tprs.indices], tpr_sum, tpr_sqsum, n_cats, self.distinctive_fun)
+            for k, i in enumerate(other_rows):
+                start, end = tprs.indptr[k], tprs.indptr[k + 1]
+                if start < end:
+                    # the returned dicts are never changed in place, only categories with changed scores get new ones
+                    cat = self.categories[i]
+                    self.distinctive_words[cat] = dict(self.distinctive_words[cat])
+                    self.distinctive_words[cat].update(
+                        {self.featurenames[words[j]]: v for j, v in zip(tprs.indices[start:end], scores[start:end])})
+        self._changed_cats, self._changed_words = set(), set()
+        self._n_cats = n_cats
+        return {cat: self.distinctive_words[cat] for cat in self.categories}
+
+
+@instrument.timed('get_distinctive_words_chunked')
+def get_distinctive_words_chunked(chunks, distinctive_fun=distinctive_fun_quotdiff, return_mats=False):
+    """
+    Same as get_distinctive_words, but the documents are processed chunk by chunk (e.g. as returned by
+    data_utils.iter_data), so only the summed up features of every category have to be kept in memory.
+    Since the texts can't be revisited, the bigrams are identified using the first chunk only.
+
+    Input:
+        - chunks: an iterable with lists of (docid, text, cat) tuples
+        - distinctive_fun: which formula should be used when computing the score (default: distinctive_fun_quotdiff)
+        - return_mats: if True, the scores are returned as a sparse matrix instead of a dict (default: False)
+    Returns:
+        - distinctive_words: a dict with {cat: {word: score}} (see get_distinctive_words)
+        or if return_mats=True: scores, categories, featurenames
+    """
+    acc = DistinctiveWordsAccumulator(distinctive_fun)
+    for i, chunk in enumerate(chunks):
+        print("computing features for chunk %i" % i)
+        with instrument.stage('features', chunk=i, n_docs=len(chunk)):
+            acc.add_chunk(chunk)
+    print("computing distinctive words for %i categories" % len(acc.categories))
+    with instrument.stage('scores', n_categories=len(acc.categories)):
+        if return_mats:
+            return acc.get_scores()
+        return acc.get_distinctive_words()
 
 
 def test_distinctive_computations(distinctive_fun=distinctive_fun_diff, fun_name='Rate difference'):
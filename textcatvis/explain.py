@@ -0,0 +1,159 @@
+from __future__ import unicode_literals, division, print_function, absolute_import
+import json
+import numpy as np
+from nlputils.features import FeatureTransform
+from .feature_cache import FT_PARAMS, freeze_bigrams
+from .sparse_utils import features2csr
+from .visualize_relevantwords import compute_contributions
+
+
+class LinearExplainer(object):
+    """
+    LinearExplainer
+
+    everything needed to score new documents with a linear classifier trained in visualize_clf, i.e. the fitted
+    FeatureTransform (parameters, idf weights and bigrams), the vocabulary and the classifier's coefficients,
+    which can be saved to disk and loaded again, so the classifier doesn't have to be retrained to explain new documents
+
+    Usage:
+        # get the model from visualize_clf (or create it from a fitted FeatureTransform and classifier)
+        relevant_words, model = visualize_clf(textdict, doccats, return_model=True)
+        model = LinearExplainer(ft, clf, featurenames)
+        # store it and load it again later
+        model.save('model.npz')
+        model = LinearExplainer.load('model.npz')
+        # the predictions and the scores of the words in new documents, e.g. to create the html visualization
+        explanations = model.explain({'doc1': 'some text', 'doc2': 'some other text'})
+        scores2html(text, explanations['doc1']['scores'], 'doc1', 'Predicted Class: %s' % explanations['doc1']['prediction'])
+        # the model can also be passed to visualize_clf instead of training a new classifier
+        relevant_words = visualize_clf(textdict, doccats, model=model)
+
+    The model provides decision_function and predict like the original sklearn classifier (for the same features).
+    The docids and classes need to be json serializable (e.g. strings or ints).
+
+    Attributes:
+        - ft: the fitted FeatureTransform
+        - featurenames: list with the words corresponding to the columns of coef_
+        - coef_: numpy array with classes (or 1 for binary problems) x features with the coefficients of the classifier
+        - intercept_: numpy array with the intercepts of the classifier
+        - classes_: numpy array with the classes
+    """
+
+    def __init__(self, ft, clf, featurenames):
+        """
+        Input:
+            ft: the fitted FeatureTransform used to compute the training features
+                (if no bigrams were found when fitting it, identify_bigrams is turned off, see feature_cache.freeze_bigrams)
+            clf: a trained linear classifier (e.g. LinearSVC, LogisticRegression or SGDClassifier)
+            featurenames: the words defining the columns of the classifier's coef_
+        """
+        self.ft = freeze_bigrams(ft)
+        self.featurenames = list(featurenames)
+        self.coef_ = np.asarray(clf.coef_, dtype=float)
+        self.intercept_ = np.asarray(clf.intercept_, dtype=float)
+        self.classes_ = np.asarray(clf.classes_)
+
+    def save(self, fname):
+        """
+        store the model
+
+        Inputs:
+            fname: path to the file (should end in .npz)
+        """
+        ft_state = {p: getattr(self.ft, p) for p in FT_PARAMS}
+        ft_state.update({'Dw': self.ft.Dw, 'bigrams': self.ft.bigrams})
+        np.savez_compressed(fname, coef=self.coef_, intercept=self.intercept_,
+                            classes=np.array(json.dumps(self.classes_.tolist())),
+                            featurenames=np.array(json.dumps(self.featurenames)), ft=np.array(json.dumps(ft_state)))
+
+    @classmethod
+    def load(cls, fname):
+        """
+        load a model stored with save
+
+        Inputs:
+            fname: path to the file
+        Returns:
+            model: the LinearExplainer
+        """
+        model = cls.__new__(cls)
+        with np.load(fname) as data:
+            model.coef_, model.intercept_ = data['coef'], data['intercept']
+            model.classes_ = np.array(json.loads(str(data['classes'])))
+            model.featurenames = json.loads(str(data['featurenames']))
+            ft_state = json.loads(str(data['ft']))
+        model.ft = FeatureTransform(**{p: ft_state[p] for p in FT_PARAMS})
+        model.ft.Dw, model.ft.bigrams = ft_state['Dw'], ft_state['bigrams']
+        # (models stored before identify_bigrams was turned off for fitted transforms without bigrams)
+        freeze_bigrams(model.ft)
+        return model
+
+    def decision_function(self, featmat):
+        """
+        Input:
+            featmat: sparse feature matrix with docs x features (columns corresponding to featurenames)
+        Returns:
+            scores: the values of the decision function (1d array for binary problems, docs x classes otherwise)
+        """
+        scores = featmat.dot(self.coef_.T) + self.intercept_
+        return scores.ravel() if scores.shape[1] == 1 else scores
+
+    def predict(self, featmat):
+        """
+        Input:
+            featmat: sparse feature matrix with docs x features (columns corresponding to featurenames)
+        Returns:
+            labels: array with the predicted class for every document
+        """
+        scores = self.decision_function(featmat)
+        if scores.ndim == 1:
+            return self.classes_[(scores > 0).astype(int)]
+        return self.classes_[np.argmax(scores, axis=1)]
+
+    def transform(self, textdict, docids=None):
+        """
+        compute the features of new documents with the stored FeatureTransform
+
+        Input:
+            textdict: dict with {doc_id: text}
+            docids: the documents to transform (default: all, sorted)
+        Returns:
+            featmat: sparse csr matrix with docids x featurenames (words not in the vocabulary are ignored)
+            docids: the docids corresponding to the rows
+        """
+        docids = sorted(textdict) if docids is None else list(docids)
+        featmat, _ = features2csr(self.ft.texts2features({did: textdict[did] for did in docids}), docids, self.featurenames)
+        return featmat, docids
+
+    def explain(self, texts, labels={}):
+        """
+        score new documents: predict their class and compute how much every word contributed to the prediction
+
+        Input:
+            texts: dict with {doc_id: text} (or a list of texts, which then get the list index as doc_id)
+            labels: optional dict with {doc_id: class} for which the word scores should be computed instead of the
+                    predicted class (e.g. the true class of the document)
+        Returns:
+            explanations: dict with {doc_id: {'prediction': predicted class, 'score': value of the decision function
+                          for the predicted class, 'scores': {word: score}}} where the scores (for all words of the
+                          document in the vocabulary, as used by scores2html) are positive if the word speaks
+                          for the predicted (or given) class
+        """
+        if not isinstance(texts, dict):
+            texts = dict(enumerate(texts))
+        featmat, docids = self.transform(texts)
+        predictions = self.decision_function(featmat)
+        predictions_labels = self.predict(featmat)
+        if predictions.ndim == 1:
+            # the score speaks for the positive class, so for the negative class it is reversed
+            pred_scores = np.where(predictions_labels == self.classes_[1], predictions, -predictions)
+        else:
+            pred_scores = np.max(predictions, axis=1)
+        score_labels = [labels.get(did, label) for did, label in zip(docids, predictions_labels)]
+        contribs, _ = compute_contributions(self, featmat, score_labels)
+        explanations = {}
+        for i, did in enumerate(docids):
+            start, end = contribs.indptr[i], contribs.indptr[i + 1]
+            scores = dict(zip([self.featurenames[j] for j in contribs.indices[start:end]], contribs.data[start:end].tolist()))
+            explanations[did] = {'prediction': predictions_labels[i].item(), 'score': float(pred_scores[i]), 'scores': scores}
+        return explanations
@@ -0,0 +1,424 @@
+"""
+A long-running service that explains the predictions of a stored visualize_clf model (see explain.LinearExplainer)
+for new documents, i.e. returns the html with the highlighted words (like scores2html) or the scores of the
+individual words as json. Concurrent requests are collected into micro-batches, so the features and contributions
+for all documents of a batch are computed with one sparse matrix product.
+
+Start the service with a model saved with LinearExplainer.save:
+
+    $ python -m textcatvis.explain_server model.npz --port 8000
+    $ curl -d '{"text": "some text", "output": "html"}' http://localhost:8000/explain
+    $ curl http://localhost:8000/stats
+
+or process json lines with {"id": ..., "text": ..., "output": "json" or "html"} from stdin (results are written to stdout):
+
+    $ python -m textcatvis.explain_server model.npz --stdin < docs.jsonl > explanations.jsonl
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+import argparse
+import json
+import sys
+import threading
+import time
+from collections import deque
+from io import StringIO
+try:
+    from queue import Queue, Empty
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.request import Request, urlopen
+except ImportError:
+    from Queue import Queue, Empty
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib2 import Request, urlopen
+import numpy as np
+from .explain import LinearExplainer
+from .vis_utils import _align_scores, write_scores2html
+
+
+class _Request(object):
+    """
+    a document waiting to be explained by the ExplanationService (the result is set by the worker thread)
+    """
+
+    def __init__(self, docid, text, output):
+        self.docid = docid
+        self.text = text
+        self.output = output
+        self.t_start = time.time()
+        self.result = None
+        self.error = None
+        self._done = threading.Event()
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Returns:
+            result: the explanation (see ExplanationService.explain)
+        """
+        if not self._done.wait(timeout):
+            raise RuntimeError("explanation for document %r timed out" % self.docid)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class _Failed(object):
+    """
+    a request that was rejected before it was queued (used by serve_jsonl to keep the order of the output)
+    """
+
+    def __init__(self, docid, error):
+        self.docid = docid
+        self.error = error
+
+    def done(self):
+        return True
+
+    def wait(self, timeout=None):
+        raise self.error
+
+
+class ExplanationService(object):
+    """
+    ExplanationService
+
+    explain the predictions of a LinearExplainer for individual documents submitted from multiple threads:
+    the requests are put into a queue and a worker thread collects them into batches of up to max_batch documents
+    (waiting at most max_wait seconds for more requests after the first), which are scored together
+
+    Usage:
+        service = ExplanationService(LinearExplainer.load('model.npz'))
+        service.start()
+        # blocks until the document was scored (in a batch with the documents submitted by other threads)
+        result = service.explain('some text', output='json')
+        # or submit many documents and collect the results later
+        requests = [service.submit(text, docid) for docid, text in textdict.items()]
+        results = [r.wait() for r in requests]
+        print(service.stats())
+        service.stop()
+
+    Attributes:
+        - model: the LinearExplainer
+        - max_batch: maximum number of documents scored at once
+        - max_wait: how long to wait for more documents before scoring a batch (in seconds)
+        - highlight_oov: if True, out-of-vocabulary words are highlighted in yellow in the html
+        - latencies: the time from submitting to finishing the last (up to 10000) requests (in seconds)
+        - batch_sizes: the sizes of the last (up to 10000) batches
+    """
+
+    def __init__(self, model, max_batch=64, max_wait=0.005, highlight_oov=False):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.highlight_oov = highlight_oov
+        self.latencies = deque(maxlen=10000)
+        self.batch_sizes = deque(maxlen=10000)
+        self._queue = Queue()
+        self._thread = None
+        # no more requests are accepted once stop was called (the lock makes sure that all accepted requests
+        # are queued before the signal for the worker thread to stop, so they are all scored)
+        self._stopped = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        start the worker thread
+        """
+        with self._lock:
+            self._stopped = False
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._work)
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        score the remaining documents and stop the worker thread
+        (documents submitted afterwards are rejected; if the worker thread was never started,
+        the queued documents fail with a RuntimeError instead)
+        """
+        with self._lock:
+            self._stopped = True
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        while True:
+            try:
+                request = self._queue.get_nowait()
+            except Empty:
+                break
+            if request is not None:
+                request.error = RuntimeError("the service was stopped before document %r was explained" % request.docid)
+                request._done.set()
+
+    def submit(self, text, docid=None, output='json'):
+        """
+        queue a document to be explained
+
+        Input:
+            text: the raw text of the document
+            docid: an optional id of the document (returned with the result)
+            output: 'json' for the scores of the words or 'html' for the highlighted text
+        Returns:
+            request: an object whose wait() method returns the result
+        Raises a ValueError for invalid input (which is then not queued, so it can't affect the other requests)
+        and a RuntimeError if the service was stopped.
+        """
+        if not isinstance(text, str):
+            raise ValueError("text has to be a string, not %s" % type(text).__name__)
+        if output not in ('json', 'html'):
+            raise ValueError("output has to be 'json' or 'html', not %r" % output)
+        request = _Request(docid, text, output)
+        with self._lock:
+            if self._stopped:
+                raise RuntimeError("the service was stopped")
+            self._queue.put(request)
+        return request
+
+    def explain(self, text, docid=None, output='json', timeout=None):
+        """
+        explain the prediction for a document
+
+        Input:
+            text: the raw text of the document
+            docid: an optional id of the document (returned with the result)
+            output: 'json' or 'html'
+            timeout: how long to wait for the result (in seconds, default None: no limit)
+        Returns:
+            result: a dict with {'id': docid, 'prediction': predicted class, 'score': value of the decision function}
+                    and for output='json' 'spans': a list with [token, start, end, score] for every word of the text
+                    (the score is normalized by the maximum absolute score of the document, positive if the word
+                    speaks for the predicted class and None for words that are not in the vocabulary)
+                    or for output='html' 'html': the html document with the highlighted words (see scores2html)
+        """
+        return self.submit(text, docid, output).wait(timeout)
+
+    def stats(self):
+        """
+        Returns:
+            stats: dict with the number of requests and the 50th and 99th percentile of the latency (in ms)
+                   as well as the mean batch size (of the last up to 10000 requests / batches)
+        """
+        latencies = 1000. * np.array(self.latencies)
+        if not len(latencies):
+            return {'n_requests': 0}
+        return {'n_requests': len(latencies), 'p50_ms': float(np.percentile(latencies, 50)),
+                'p99_ms': float(np.percentile(latencies, 99)), 'mean_batch_size': float(np.mean(self.batch_sizes))}
+
+    def _format(self, request, explanation):
+        result = {'id': request.docid, 'prediction': explanation['prediction'], 'score': explanation['score']}
+        if request.output == 'html':
+            f = StringIO()
+            write_scores2html(f, request.text, explanation['scores'], 'Predicted Class: %s  (Score: %.4f)'
+                              % (explanation['prediction'], explanation['score']), self.highlight_oov)
+            result['html'] = f.getvalue()
+        else:
+            result['spans'] = [[word, start, end, score] for _, start, end, word, score in _align_scores(request.text, explanation['scores'])]
+        return result
+
+    def _process(self, batch):
+        try:
+            explanations = self.model.explain({i: request.text for i, request in enumerate(batch)})
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0].error = e
+                batch[0]._done.set()
+                return
+            # score the documents individually, so only the request causing the error fails
+            for request in batch:
+                self._process([request])
+            return
+        self.batch_sizes.append(len(batch))
+        for i, request in enumerate(batch):
+            try:
+                request.result = self._format(request, explanations[i])
+            except Exception as e:
+                request.error = e
+            self.latencies.append(time.time() - request.t_start)
+            request._done.set()
+
+    def _work(self):
+        stop = False
+        while not stop:
+            request = self._queue.get()
+            if request is None:
+                break
+            batch = [request]
+            # collect more requests until the batch is full or max_wait is over
+            deadline = time.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                try:
+                    request = self._queue.get(timeout=max(deadline - time.time(), 0.))
+                except Empty:
+                    break
+                if request is None:
+                    stop = True
+                    break
+                batch.append(request)
+            self._process(batch)
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    # the default of 5 pending connections is too small for many concurrent clients
+    request_queue_size = 128
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def _send(self, code, body, content_type='application/json'):
+        body = body.encode('utf8')
+        self.send_response(code)
+        self.send_header('Content-Type', '%s; charset=utf-8' % content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._send(200, json.dumps(self.server.service.stats()))
+        else:
+            self._send(404, json.dumps({'error': 'unknown path %s' % self.path}))
+
+    def do_POST(self):
+        if self.path != '/explain':
+            self._send(404, json.dumps({'error': 'unknown path %s' % self.path}))
+            return
+        try:
+            doc = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf8'))
+            if not isinstance(doc, dict) or 'text' not in doc:
+                raise ValueError("the request has to be a json object with a 'text'")
+            request = self.server.service.submit(doc['text'], doc.get('id'), doc.get('output', 'json'))
+        except ValueError as e:
+            # malformed json or invalid input
+            self._send(400, json.dumps({'error': str(e)}))
+            return
+        except Exception as e:
+            self._send(500, json.dumps({'error': '%s: %s' % (type(e).__name__, e)}))
+            return
+        try:
+            result = request.wait()
+        except Exception as e:
+            self._send(500, json.dumps({'error': '%s: %s' % (type(e).__name__, e)}))
+            return
+        if doc.get('output') == 'html':
+            self._send(200, result['html'], 'text/html')
+        else:
+            self._send(200, json.dumps(result))
+
+    def log_message(self, format, *args):
+        # don't print every request
+        pass
+
+
+def make_server(service, host='localhost', port=8000):
+    """
+    create a http server for the ExplanationService (which has to be started separately)
+
+    Input:
+        service: the ExplanationService
+        host, port: where the server should listen (port=0: pick a free port, see server.server_address)
+    Returns:
+        server: the HTTPServer (call server.serve_forever() to handle requests),
+                with POST /explain for json requests with {"text": ..., "id": ..., "output": "json" or "html"}
+                and GET /stats for the latency statistics
+    """
+    server = _ThreadingHTTPServer((host, port), _Handler)
+    server.service = service
+    return server
+
+
+class ExplanationClient(object):
+    """
+    ExplanationClient
+
+    a minimal client for the http server of the ExplanationService
+
+    Usage:
+        client = ExplanationClient('http://localhost:8000')
+        result = client.explain('some text')
+        html = client.explain('some text', output='html')
+        print(client.stats())
+    """
+
+    def __init__(self, url='http://localhost:8000'):
+        self.url = url.rstrip('/')
+
+    def explain(self, text, docid=None, output='json'):
+        """
+        Returns:
+            the result dict (see ExplanationService.explain) or for output='html' the html as a string
+        """
+        data = json.dumps({'text': text, 'id': docid, 'output': output}).encode('utf8')
+        request = Request(self.url + '/explain', data, {'Content-Type': 'application/json'})
+        response = urlopen(request).read().decode('utf8')
+        return response if output == 'html' else json.loads(response)
+
+    def stats(self):
+        return json.loads(urlopen(self.url + '/stats').read().decode('utf8'))
+
+
+def serve_jsonl(service, fin, fout):
+    """
+    explain the documents given as json lines with {"id": ..., "text": ..., "output": ...} and write the results
+    as json lines in the same order (documents are submitted as they are read, so they are scored in batches)
+
+    Input:
+        service: the (started) ExplanationService
+        fin, fout: the input and output file objects (e.g. sys.stdin and sys.stdout)
+    """
+    pending = deque()
+
+    def write_done(block=False):
+        while pending and (block or pending[0].done()):
+            request = pending.popleft()
+            try:
+                result = request.wait()
+            except Exception as e:
+                result = {'id': request.docid, 'error': str(e)}
+            fout.write(json.dumps(result) + '\n')
+        fout.flush()
+
+    for line in fin:
+        if not line.strip():
+            continue
+        doc = None
+        try:
+            doc = json.loads(line)
+            if not isinstance(doc, dict) or 'text' not in doc:
+                raise ValueError("every line has to be a json object with a 'text'")
+            pending.append(service.submit(doc['text'], doc.get('id'), doc.get('output', 'json')))
+        except ValueError as e:
+            # the invalid line gets an error record (in the same order as the results)
+            pending.append(_Failed(doc.get('id') if isinstance(doc, dict) else None, e))
+        write_done()
+    write_done(block=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="explain the predictions of a stored visualize_clf model for new documents")
+    parser.add_argument('model', help="model file saved with LinearExplainer.save")
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--stdin', action='store_true', help="read json lines from stdin instead of starting a http server")
+    parser.add_argument('--max_batch', type=int, default=64, help="maximum number of documents scored at once")
+    parser.add_argument('--max_wait', type=float, default=0.005, help="how long to wait for more documents for a batch (in seconds)")
+    args = parser.parse_args()
+    service = ExplanationService(LinearExplainer.load(args.model), args.max_batch, args.max_wait).start()
+    if args.stdin:
+        serve_jsonl(service, sys.stdin, sys.stdout)
+    else:
+        server = make_server(service, args.host, args.port)
+        print("serving explanations on http://%s:%i" % server.server_address[:2], file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.server_close()
+    service.stop()
+    print(json.dumps(service.stats()), file=sys.stderr)
@@ -0,0 +1,280 @@
+from __future__ import unicode_literals, division, print_function, absolute_import
+import codecs
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+from scipy.sparse import csr_matrix
+from .sparse_utils import features2csr
+
+# all attributes of the FeatureTransform that influence the computed features
+FT_PARAMS = ['norm', 'weight', 'renorm', 'identify_bigrams', 'to_lower', 'norm_num', 'bg_threshold']
+
+
+def freeze_bigrams(ft):
+    """
+    make sure a fitted FeatureTransform keeps its bigrams, i.e. if no bigrams were found when fitting it,
+    turn off identify_bigrams (otherwise texts2features would search for bigrams again in every new set of texts
+    and change the features of the fitted FeatureTransform)
+
+    Input:
+        - ft: a fitted FeatureTransform instance
+    Returns:
+        - ft: the same FeatureTransform
+    """
+    if not ft.bigrams:
+        ft.identify_bigrams = False
+    return ft
+
+
+class FeatureCache(object):
+    """
+    FeatureCache
+
+    an on-disk store for the features computed with FeatureTransform.texts2features, so they only have to be
+    computed once for the same texts and FeatureTransform parameters (e.g. in later runs or by later methods in the same run)
+
+    Usage:
+        # initialize the cache (the directory is created if it doesn't exist) - the cache is limited to 2 GB
+        cache = FeatureCache('featcache', max_size=2*1024**3)
+        ft = FeatureTransform(norm='max', weight=True, renorm='length', identify_bigrams=True)
+        # the first call computes the features and stores them, later calls load them from the cache
+        docfeats = cache.texts2features(ft, textdict, trainids)
+        # or get the memory-mapped sparse feature matrix directly
+        featmat, docids, featurenames = cache.texts2featmat(ft, textdict, trainids)
+        # remove the features of a dataset (e.g. when the preprocessing code changed) or everything
+        cache.invalidate(ft, textdict, trainids)
+        cache.clear()
+
+    Every entry is a subdirectory named after a hash of the texts, docids, fit_ids and the FeatureTransform parameters
+    and contains the features as a csr matrix (data.npy, indices.npy, indptr.npy), the vocabulary (vocab.txt),
+    the docids (docids.json) and the fitted idf weights and bigrams of the FeatureTransform (ft.json).
+    When the total size of the cache exceeds max_size, the least recently used entries are deleted.
+    The docids need to be json serializable (e.g. strings or ints).
+
+    Attributes:
+        - cachedir: directory where the features are stored
+        - max_size: maximum size of the cache in bytes (default None: no limit)
+    """
+
+    def __init__(self, cachedir, max_size=None):
+        self.cachedir = cachedir
+        self.max_size = max_size
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+
+    def get_key(self, ft, textdict, fit_ids=[]):
+        """
+        compute the fingerprint of the features, i.e. a hash of the texts and the FeatureTransform parameters
+        (incl. the weights and bigrams in case the FeatureTransform was already fitted)
+        """
+        h = hashlib.sha1()
+        params = {p: getattr(ft, p) for p in FT_PARAMS}
+        params['fitted'] = [sorted(ft.Dw.items()), sorted(ft.bigrams)]
+        params['fit_ids'] = sorted(str(did) for did in fit_ids)
+        h.update(json.dumps(params, sort_keys=True).encode('utf8'))
+        for did in sorted(textdict, key=str):
+            h.update(json.dumps(did).encode('utf8'))
+            h.update(b'\0')
+            h.update(textdict[did].encode('utf8'))
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def _path(self, key, fname=''):
+        return os.path.join(self.cachedir, key, fname)
+
+    def _store(self, key, ft, docfeats, docids):
+        # build the csr matrix - in contrast to features2mat, explicit zeros are kept to reproduce the dicts exactly
+        # (the rows are stored in the order of the docids and the words of every row sorted, i.e. like in features2csr,
+        # so the matrix can usually be used as it is without reordering it)
+        featurenames = sorted(set(word for did in docids for word in docfeats[did]))
+        fnamedict = {feat: i for i, feat in enumerate(featurenames)}
+        indptr, indices, data = [0], [], []
+        for did in docids:
+            for j, value in sorted((fnamedict[word], value) for word, value in docfeats[did].items()):
+                indices.append(j)
+                data.append(value)
+            indptr.append(len(indices))
+        # write everything into a temporary directory first so no incomplete entries are left when something fails
+        tmpdir = tempfile.mkdtemp(dir=self.cachedir, prefix='.tmp_')
+        try:
+            np.save(os.path.join(tmpdir, 'data.npy'), np.array(data, dtype=float))
+            np.save(os.path.join(tmpdir, 'indices.npy'), np.array(indices, dtype=np.int32))
+            np.save(os.path.join(tmpdir, 'indptr.npy'), np.array(indptr, dtype=np.int64))
+            with codecs.open(os.path.join(tmpdir, 'vocab.txt'), 'w', encoding='utf8') as f:
+                f.write('\n'.join(featurenames))
+            with codecs.open(os.path.join(tmpdir, 'docids.json'), 'w', encoding='utf8') as f:
+                json.dump(docids, f)
+            with codecs.open(os.path.join(tmpdir, 'ft.json'), 'w', encoding='utf8') as f:
+                json.dump({'Dw': ft.Dw, 'bigrams': ft.bigrams}, f)
+            os.rename(tmpdir, self._path(key))
+        except Exception:
+            # someone else might have stored the same features in the meantime
+            if not os.path.isdir(self._path(key)):
+                raise
+        finally:
+            # (after a successful rename, the temporary directory doesn't exist anymore)
+            shutil.rmtree(tmpdir, ignore_errors=True)
+        self.evict()
+
+    def _load(self, key, ft):
+        # mark the entry as recently used
+        os.utime(self._path(key), None)
+        data = np.load(self._path(key, 'data.npy'), mmap_mode='r')
+        indices = np.load(self._path(key, 'indices.npy'), mmap_mode='r')
+        indptr = np.load(self._path(key, 'indptr.npy'), mmap_mode='r')
+        with codecs.open(self._path(key, 'vocab.txt'), encoding='utf8') as f:
+            featurenames = f.read()
+            featurenames = featurenames.split('\n') if featurenames else []
+        with codecs.open(self._path(key, 'docids.json'), encoding='utf8') as f:
+            docids = json.load(f)
+        # restore the state of the FeatureTransform so it can be used to transform new documents
+        with codecs.open(self._path(key, 'ft.json'), encoding='utf8') as f:
+            ft_state = json.load(f)
+        ft.Dw, ft.bigrams = ft_state['Dw'], ft_state['bigrams']
+        freeze_bigrams(ft)
+        featmat = csr_matrix((data, indices, indptr), shape=(len(docids), len(featurenames)), copy=False)
+        return featmat, docids, featurenames
+
+    def texts2featmat(self, ft, textdict, fit_ids=[]):
+        """
+        same as ft.texts2features, but the features are loaded from the cache if possible
+
+        Input:
+            - ft: a FeatureTransform instance (will have the fitted weights and bigrams afterwards)
+            - textdict: a dict with {docid: text}
+            - fit_ids: if only a portion of all texts should be used to compute the weights and identify bigrams
+        Returns:
+            - featmat: a (memory-mapped) sparse csr matrix with docids x featurenames
+            - docids: the list of docids defining the rows of the featmat
+            - featurenames: the list of words defining the columns of the featmat
+        """
+        key = self.get_key(ft, textdict, fit_ids)
+        if not os.path.isdir(self._path(key)):
+            self._store(key, ft, ft.texts2features(textdict, fit_ids), list(textdict.keys()))
+        return self._load(key, ft)
+
+    def texts2features(self, ft, textdict, fit_ids=[]):
+        """
+        same as ft.texts2features, but the features are loaded from the cache if possible
+
+        Input:
+            - ft: a FeatureTransform instance (will have the fitted weights and bigrams afterwards)
+            - textdict: a dict with {docid: text}
+            - fit_ids: if only a portion of all texts should be used to compute the weights and identify bigrams
+        Returns:
+            - docfeats: a dict with {docid: {term: (normalized/weighted) count}}
+        """
+        featmat, docids, featurenames = self.texts2featmat(ft, textdict, fit_ids)
+        indptr, indices, data = np.asarray(featmat.indptr), np.asarray(featmat.indices), np.asarray(featmat.data)
+        return {did: {featurenames[j]: v for j, v in zip(indices[indptr[i]:indptr[i + 1]].tolist(), data[indptr[i]:indptr[i + 1]].tolist())}
+                for i, did in enumerate(docids)}
+
+    def invalidate(self, ft, textdict, fit_ids=[]):
+        """
+        delete the stored features of the given texts and FeatureTransform parameters (if they exist)
+        """
+        shutil.rmtree(self._path(self.get_key(ft, textdict, fit_ids)), ignore_errors=True)
+
+    def clear(self):
+        """
+        delete all stored features
+        """
+        for key in os.listdir(self.cachedir):
+            shutil.rmtree(self._path(key), ignore_errors=True)
+
+    def size(self):
+        """
+        Returns:
+            - the total size of all entries in the cache in bytes
+        """
+        return sum(self._entry_size(key) for key in self._entries())
+
+    def _entries(self):
+        return [key for key in os.listdir(self.cachedir) if not key.startswith('.') and os.path.isdir(self._path(key))]
+
+    def _entry_size(self, key):
+        return sum(os.path.getsize(self._path(key, fname)) for fname in os.listdir(self._path(key)))
+
+    def evict(self):
+        """
+        delete the least recently used entries until the total size of the cache is below max_size
+        """
+        if self.max_size is None:
+            return
+        entries = sorted(self._entries(), key=lambda key: os.path.getmtime(self._path(key)))
+        sizes = {key: self._entry_size(key) for key in entries}
+        total = sum(sizes.values())
+        # always keep the most recently used entry, even if it alone is too big
+        for key in entries[:-1]:
+            if total <= self.max_size:
+                break
+            shutil.rmtree(self._path(key), ignore_errors=True)
+            total -= sizes[key]
+
+
+def texts2features(ft, textdict, fit_ids=[], cache=None):
+    """
+    compute the features with ft.texts2features or, if a FeatureCache is given, load them from the cache if possible
+
+    Input:
+        - ft: a FeatureTransform instance
+        - textdict: a dict with {docid: text}
+        - fit_ids: if only a portion of all texts should be used to compute the weights and identify bigrams
+        - cache: an optional FeatureCache instance
+    Returns:
+        - docfeats: a dict with {docid: {term: (normalized/weighted) count}}
+    """
+    if cache is None:
+        docfeats = ft.texts2features(textdict, fit_ids)
+        freeze_bigrams(ft)
+        return docfeats
+    return cache.texts2features(ft, textdict, fit_ids)
+
+
+def texts2featmat(ft, textdict, docids, fit_ids=[], featurenames=[], cache=None):
+    """
+    compute the feature matrix of the docids documents, i.e. the same as
+    features2csr(texts2features(ft, textdict, fit_ids, cache), docids, featurenames), but if a FeatureCache is given,
+    the memory-mapped matrix from the cache is used directly instead of transforming it into dicts and back
+
+    Input:
+        - ft: a FeatureTransform instance
+        - textdict: a dict with {docid: text}
+        - docids: the documents that define the rows of the feature matrix
+        - fit_ids: if only a portion of all texts should be used to compute the weights and identify bigrams
+        - featurenames: a list of words that define the columns of the feature matrix
+                        (if empty, all words occurring in the docids documents are used)
+        - cache: an optional FeatureCache instance
+    Returns:
+        - featmat: a sparse csr matrix with docids x featurenames
+        - featurenames: the list of words defining the columns of the featmat
+    """
+    if cache is None:
+        docfeats = ft.texts2features(textdict, fit_ids)
+        freeze_bigrams(ft)
+        return features2csr(docfeats, docids, featurenames)
+    featmat, cached_ids, cached_names = cache.texts2featmat(ft, textdict, fit_ids)
+    if list(docids) != cached_ids:
+        docidx = {did: i for i, did in enumerate(cached_ids)}
+        featmat = featmat[[docidx[did] for did in docids]]
+    if featurenames:
+        # map the columns to the given words (words that are not in the cached vocabulary get an empty column)
+        fnamedict = {feat: i for i, feat in enumerate(cached_names)}
+        cols = [(fnamedict[feat], j) for j, feat in enumerate(featurenames) if feat in fnamedict]
+        select = csr_matrix((np.ones(len(cols)), ([i for i, _ in cols], [j for _, j in cols])), shape=(len(cached_names), len(featurenames)))
+        featmat = csr_matrix(featmat.dot(select))
+    else:
+        # like in features2csr, only the words occurring in the docids documents are used
+        used = np.flatnonzero(np.bincount(featmat.indices, minlength=featmat.shape[1]))
+        featurenames = cached_names
+        if len(used) < len(cached_names):
+            featmat, featurenames = featmat[:, used], [cached_names[j] for j in used]
+    # the memory-mapped arrays are read-only, so the matrix is only copied if zero entries need to be removed
+    if not featmat.has_sorted_indices or not np.all(featmat.data):
+        featmat = featmat.copy()
+        featmat.eliminate_zeros()
+        featmat.sort_indices()
+    return featmat, featurenames
@@ -0,0 +1,220 @@
+"""
+Lightweight instrumentation of the main entry points: the stages of the computations (e.g. computing the features,
+training the classifier, computing the contributions, creating the html files and word clouds) report structured
+events with the wall and cpu time, number of documents and peak memory usage to a sink.
+By default no sink is set and the instrumentation is disabled (only a check of a global variable per stage / item).
+
+Usage:
+    from textcatvis import instrument
+    # log the events with the logging module (logger 'textcatvis')
+    instrument.set_sink(instrument.LoggingSink())
+    # or write them as json lines to a file
+    instrument.set_sink(instrument.JSONLinesSink('events.jsonl'))
+    # or collect them in a list (any function taking the event dict can be used as a sink)
+    events = []
+    with instrument.recording(events.append):
+        visualize_clf(textdict, doccats)
+    # disable the instrumentation again
+    instrument.set_sink(None)
+
+Every event is a dict with 'event' (stage_end, item or a custom name), 'stage' (the names of the nested
+stages joined with '/', e.g. 'visualize_clf/training'), a timestamp 't' and e.g. for stage_end events
+'time' and 'cpu_time' (in seconds), 'n_docs' (if known) and 'peak_rss_mb' (the peak memory usage of the process
+so far) and 'peak_rss_increase_mb' (by how much the peak grew during the stage).
+The events only report the measurements, the progress messages are still printed by the functions themselves
+(so there is no event when a stage starts, which would only repeat the message that is printed at that point).
+The stages are tracked per thread; wrap functions that are run in a thread pool with propagate() to nest their
+stages in the stage in which they were submitted.
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+import functools
+import json
+import logging
+import sys
+import threading
+import time
+from contextlib import contextmanager
+try:
+    import resource
+except ImportError:
+    resource = None
+
+_sink = None
+_local = threading.local()
+
+
+def set_sink(sink):
+    """
+    set the function that receives the events (None: disable the instrumentation)
+
+    Returns:
+        the previous sink
+    """
+    global _sink
+    previous, _sink = _sink, sink
+    return previous
+
+
+def enabled():
+    return _sink is not None
+
+
+@contextmanager
+def recording(sink):
+    """
+    temporarily send the events to the given sink
+    """
+    previous = set_sink(sink)
+    try:
+        yield sink
+    finally:
+        set_sink(previous)
+
+
+def _peak_rss():
+    # peak resident set size of this process in MB (ru_maxrss is in KB on linux, but in bytes on mac)
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024.**2 if sys.platform == 'darwin' else rss / 1024.
+
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def event(name, **info):
+    """
+    emit an event (if the instrumentation is enabled) for the current stage
+
+    Input:
+        name: the type of the event
+        info: additional (json serializable) information, e.g. n_docs
+    """
+    sink = _sink
+    if sink is None:
+        return
+    info['event'] = name
+    info.setdefault('stage', '/'.join(_stack()))
+    info['t'] = time.time()
+    sink(info)
+
+
+class stage(object):
+    """
+    a context manager measuring a stage of the computations (reported as a stage_end event when the stage is done)
+
+    Usage:
+        with instrument.stage('features', n_docs=len(textdict)) as st:
+            docfeats = ft.texts2features(textdict)
+            # more information can be added for the stage_end event
+            st.set(n_features=len(featurenames))
+    """
+
+    def __init__(self, name, **info):
+        self.name = name
+        self.info = info
+
+    def set(self, **info):
+        self.info.update(info)
+
+    def __enter__(self):
+        self._active = _sink is not None
+        if self._active:
+            stack = _stack()
+            stack.append(self.name)
+            self._path = '/'.join(stack)
+            self._rss = _peak_rss()
+            self._t0, self._cpu0 = time.time(), time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._active:
+            info = dict(self.info, time=time.time() - self._t0, cpu_time=time.process_time() - self._cpu0)
+            rss = _peak_rss()
+            if rss is not None:
+                info.update(peak_rss_mb=rss, peak_rss_increase_mb=rss - self._rss)
+            if exc_type is not None:
+                info['error'] = exc_type.__name__
+            _stack().pop()
+            event('stage_end', stage=self._path, **info)
+        return False
+
+
+def timed(name):
+    """
+    decorator to report a call of the function as a stage
+    """
+    def decorator(fun):
+        @functools.wraps(fun)
+        def wrapper(*args, **kwargs):
+            if _sink is None:
+                return fun(*args, **kwargs)
+            with stage(name):
+                return fun(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def propagate(fun):
+    """
+    bind a function to the stages that are open in the current thread: the stack of stages is thread-local, so
+    without this, the stages opened when the function is called in another thread (e.g. by a ThreadPool)
+    would not be nested in the stage in which the function was submitted
+
+    Usage:
+        with instrument.stage('scores'):
+            # the events of the stages in score are reported as e.g. 'scores/tfidf' instead of 'tfidf'
+            results = pool.map(instrument.propagate(score), methods)
+    """
+    parent = list(_stack())
+
+    @functools.wraps(fun)
+    def wrapper(*args, **kwargs):
+        previous = getattr(_local, 'stack', None)
+        _local.stack = list(parent)
+        try:
+            return fun(*args, **kwargs)
+        finally:
+            _local.stack = previous if previous is not None else []
+    return wrapper
+
+
+class LoggingSink(object):
+    """
+    send the events to a logger (stage events with level INFO, all others, e.g. the item events, with level DEBUG)
+    """
+
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger if logger is not None else logging.getLogger('textcatvis')
+        self.level = level
+
+    def __call__(self, event):
+        info = {k: v for k, v in event.items() if k not in ('event', 'stage', 't')}
+        level = self.level if event['event'].startswith('stage') else logging.DEBUG
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, "%s %s %s", event['event'], event['stage'],
+                            ' '.join('%s=%s' % (k, '%.3f' % v if isinstance(v, float) else v) for k, v in sorted(info.items())))
+
+
+class JSONLinesSink(object):
+    """
+    write the events as json lines to a file (given as a path or an open file object)
+    """
+
+    def __init__(self, f):
+        self._own = not hasattr(f, 'write')
+        self.f = open(f, 'a') if self._own else f
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        line = json.dumps(event, default=str)
+        with self._lock:
+            self.f.write(line + '\n')
+            self.f.flush()
+
+    def close(self):
+        if self._own:
+            self.f.close()
@@ -0,0 +1,390 @@
+"""
+Run the tf-idf, distinctive words and classifier analyses of a dataset in one pass: the subset of documents is
+selected and the texts are transformed into features only once, and the tf-idf features of both the tf-idf and the
+classifier analysis are derived from the same term frequency matrix that is used for the distinctive words.
+The scores of the methods are computed concurrently and all word clouds are created in one batch afterwards.
+The completed stages are recorded in the output directory, so an interrupted run can be resumed.
+
+    $ python -m textcatvis.pipeline /path/to/dataset --out results/dataset --n_jobs 4
+
+creates results/dataset/{tfidf,distinctive,clf}/ with a word cloud for every category and the scores
+(results/ with a results.RelevantWords, which can be loaded with RelevantWords.load) and the classifier
+(clf/model.npz, which can be loaded with explain.LinearExplainer.load).
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+import argparse
+import codecs
+import hashlib
+import json
+import os
+from multiprocessing.pool import ThreadPool
+import numpy as np
+from scipy.sparse import csr_matrix
+from nlputils.features import FeatureTransform
+from . import instrument
+from .corpus import category_codes
+from .distinctive_words import compute_tprs, compute_distinctive_scores
+from .feature_cache import texts2featmat, freeze_bigrams
+from .results import RelevantWords
+from .sparse_utils import csr_row_topk, dense_row_topk, tfidf_weight
+from .vis_utils import create_wordclouds_batch
+from .visualize_relevantwords import select_subset, compute_contributions, collect_class_scores
+
+try:
+    _replace = os.replace
+except AttributeError:
+    # python 2 (os.rename only can't replace existing files on windows)
+    _replace = os.rename
+
+METHODS = ['tfidf', 'distinctive', 'clf']
+
+
+def _json_default(obj):
+    # the categories might be numpy types (e.g. the cluster ids returned by cluster_texts)
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError("Object of type %s is not JSON serializable" % type(obj).__name__)
+
+
+class SharedFeatures(object):
+    """
+    SharedFeatures
+
+    the features of a dataset shared by all methods: the max normalized term frequencies of all documents
+    (with the bigrams identified on all documents, i.e. the features used for the distinctive words),
+    from which the tf-idf features (for the tf-idf scores and the classifier) are derived, and the category codes
+
+    Usage:
+        data = SharedFeatures.from_texts(textdict, doccats)
+        # tf-idf features with the idf weights computed on all documents (like in visualize_tfidf)
+        featmat, featurenames, ft = data.weighted(renorm='max')
+        # or only on the training documents (like in visualize_clf)
+        featmat, featurenames, ft = data.weighted(train_idx, renorm='length')
+        data.save('features')
+        data = SharedFeatures.load('features')
+
+    Attributes:
+        - tf: sparse csr matrix with docids x featurenames with the max normalized term frequencies
+        - featurenames: list with the words corresponding to the columns of tf
+        - docids: list with the docids corresponding to the rows of tf
+        - labels: numpy int array with the category code of every document
+        - categories: list with the categories (sorted), i.e. the category with code j is categories[j]
+        - bigrams: the bigrams identified in the texts
+    """
+
+    def __init__(self, tf, featurenames, docids, labels, categories, bigrams):
+        self.tf = tf
+        self.featurenames = featurenames
+        self.docids = docids
+        self.labels = labels
+        self.categories = categories
+        self.bigrams = bigrams
+
+    @classmethod
+    def from_texts(cls, textdict, doccats, cache=None):
+        """
+        Input:
+            textdict: dict with {doc_id: text}
+            doccats: dict with {doc_id: category}
+            cache: an optional FeatureCache to load the features from instead of recomputing them
+        """
+        ft = FeatureTransform(norm='max', weight=False, renorm=False, identify_bigrams=True, norm_num=False)
+        docids = list(textdict.keys())
+        tf, featurenames = texts2featmat(ft, textdict, docids, cache=cache)
+        labels, categories = category_codes(doccats, docids)
+        return cls(tf, featurenames, docids, labels, categories, ft.bigrams)
+
+    def indices(self, docids):
+        """
+        Returns:
+            numpy int array with the indices of the documents with the given docids
+        """
+        docidx = {did: i for i, did in enumerate(self.docids)}
+        return np.array([docidx[did] for did in docids], dtype=int)
+
+    def indicator(self, idx=None):
+        """
+        Returns:
+            a sparse csr matrix with documents (in idx or all documents) x categories
+            with a 1 where the document belongs to the category
+        """
+        labels = self.labels if idx is None else self.labels[idx]
+        return csr_matrix((np.ones(len(labels)), labels, np.arange(len(labels) + 1)), shape=(len(labels), len(self.categories)))
+
+    def weighted(self, idx=None, renorm='max'):
+        """
+        compute the tf-idf features of all documents, i.e. the same features as
+        FeatureTransform(norm='max', weight=True, renorm=renorm, identify_bigrams=True, norm_num=False).texts2features(textdict, fit_ids)
+
+        Input:
+            idx: indices of the documents used to compute the idf weights (default: all documents),
+                 only the words occurring in some but not all of these documents are kept
+            renorm: how the features should be renormalized ('max' or 'length')
+        Returns:
+            featmat: a sparse csr matrix with all docs x featurenames with the tf-idf features
+            featurenames: the words corresponding to the columns of the featmat
+            ft: the FeatureTransform with the corresponding idf weights and bigrams (e.g. to transform new documents)
+        """
+        featmat, idf = tfidf_weight(self.tf, idx, renorm)
+        # words occurring in none or all of the idx documents (i.e. with a weight of 0) are dropped like in features2csr
+        keep = np.flatnonzero(idf)
+        featmat, idf = csr_matrix(featmat[:, keep]), idf[keep]
+        featurenames = [self.featurenames[j] for j in keep]
+        ft = FeatureTransform(norm='max', weight=True, renorm=renorm, identify_bigrams=True, norm_num=False)
+        ft.Dw, ft.bigrams = dict(zip(featurenames, idf.tolist())), list(self.bigrams)
+        return featmat, featurenames, freeze_bigrams(ft)
+
+    def save(self, path):
+        """
+        store the features in a directory (created if it doesn't exist)
+        """
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for name in ['data', 'indices', 'indptr']:
+            np.save(os.path.join(path, '%s.npy' % name), getattr(self.tf, name))
+        np.save(os.path.join(path, 'labels.npy'), self.labels)
+        with codecs.open(os.path.join(path, 'vocab.txt'), 'w', encoding='utf8') as f:
+            f.write('\n'.join(self.featurenames))
+        with codecs.open(os.path.join(path, 'meta.json'), 'w', encoding='utf8') as f:
+            json.dump({'docids': self.docids, 'categories': self.categories, 'bigrams': self.bigrams}, f, default=_json_default)
+
+    @classmethod
+    def load(cls, path):
+        """
+        load the features stored with save (the term frequency matrix is memory-mapped)
+        """
+        data, indices, indptr = [np.load(os.path.join(path, '%s.npy' % name), mmap_mode='r') for name in ['data', 'indices', 'indptr']]
+        with codecs.open(os.path.join(path, 'vocab.txt'), encoding='utf8') as f:
+            featurenames = f.read()
+            featurenames = featurenames.split('\n') if featurenames else []
+        with codecs.open(os.path.join(path, 'meta.json'), encoding='utf8') as f:
+            meta = json.load(f)
+        tf = csr_matrix((data, indices, indptr), shape=(len(meta['docids']), len(featurenames)), copy=False)
+        return cls(tf, featurenames, meta['docids'], np.load(os.path.join(path, 'labels.npy')), meta['categories'], meta['bigrams'])
+
+
+def score_tfidf(data):
+    """
+    sum up the tf-idf features of the documents of every category (like visualize_tfidf)
+
+    Returns:
+        results: the RelevantWords
+        wc_scores: list with the words for the word cloud of every category
+    """
+    featmat, featurenames, _ = data.weighted(renorm='max')
+    scores = csr_matrix(data.indicator().T.dot(featmat))
+    return RelevantWords.from_sparse(scores, data.categories, featurenames), [csr_row_topk(scores, i, featurenames) for i in range(len(data.categories))]
+
+
+def score_distinctive(data, n_jobs=1):
+    """
+    compute the distinctive scores of the words for every category (like visualize_distinctive)
+
+    Returns:
+        results: the RelevantWords
+        wc_scores: list with the words for the word cloud of every category
+    """
+    scores = compute_distinctive_scores(compute_tprs(data.tf, data.indicator()), n_jobs=n_jobs)
+    return RelevantWords.from_sparse(scores, data.categories, data.featurenames), [csr_row_topk(scores, i, data.featurenames) for i in range(len(data.categories))]
+
+
+def score_clf(data, vis_idx, use_logreg=False):
+    """
+    train a classifier on all but the vis_idx documents and sum up the contributions of the words
+    to the classification of the vis_idx documents (like visualize_clf)
+
+    Returns:
+        results: the RelevantWords
+        wc_scores: list with the words for the word cloud of every class
+        model: the explain.LinearExplainer with the trained classifier
+    """
+    # sklearn is only imported when it's needed since it takes a while
+    from sklearn.svm import LinearSVC
+    from sklearn.linear_model import LogisticRegression as logreg
+    from .explain import LinearExplainer
+    mask = np.ones(len(data.docids), dtype=bool)
+    mask[vis_idx] = False
+    train_idx = np.flatnonzero(mask)
+    if not len(train_idx):
+        raise ValueError("no documents left to train the classifier (all %i documents are used for the visualization)" % len(mask))
+    if use_logreg:
+        renorm = 'max'
+        clf = logreg(class_weight='balanced', random_state=1)
+    else:
+        renorm = 'length'
+        clf = LinearSVC(C=10., class_weight='balanced', random_state=1)
+    featmat, featurenames, ft = data.weighted(train_idx, renorm)
+    print("training classifier")
+    clf.fit(featmat[train_idx], [data.categories[label] for label in data.labels[train_idx]])
+    featmat_test = featmat[vis_idx]
+    y_true = [data.categories[label] for label in data.labels[vis_idx]]
+    predictions_labels = clf.predict(featmat_test)
+    print("Accuracy: %.3f" % np.mean(predictions_labels == np.array(y_true)))
+    contribs, offsets = compute_contributions(clf, featmat_test, predictions_labels)
+    scores_collected = collect_class_scores(clf, featmat_test, y_true, contribs, offsets, np.float32)
+    wc_scores = [dense_row_topk(scores_collected[:, k], featurenames) for k in range(len(clf.classes_))]
+    return RelevantWords(scores_collected.T, clf.classes_, featurenames), wc_scores, LinearExplainer(ft, clf, featurenames)
+
+
+def _fingerprint(doccats):
+    # identifies the dataset for resuming a run (the texts themselves are assumed not to change)
+    h = hashlib.sha1()
+    for did in sorted(doccats, key=str):
+        h.update(json.dumps([did, doccats[did]], default=_json_default).encode('utf8'))
+    return h.hexdigest()
+
+
+class _State(object):
+    """
+    the completed stages of a pipeline run, stored in out_dir/pipeline.json
+    """
+
+    def __init__(self, out_dir, params, resume):
+        self.fname = os.path.join(out_dir, 'pipeline.json')
+        self.params = params
+        self.done = []
+        if resume and os.path.exists(self.fname):
+            with codecs.open(self.fname, encoding='utf8') as f:
+                state = json.load(f)
+            # the stages can only be reused if they were computed with the same parameters
+            if state['params'] == params:
+                self.done = state['done']
+
+    def __contains__(self, stage):
+        return stage in self.done
+
+    def add(self, stage):
+        self.done.append(stage)
+        # write a new file and replace the old one, so the state is never incomplete
+        with codecs.open(self.fname + '.tmp', 'w', encoding='utf8') as f:
+            json.dump({'params': self.params, 'done': self.done}, f)
+        _replace(self.fname + '.tmp', self.fname)
+
+
+@instrument.timed('pipeline')
+def run_pipeline(textdict, doccats, out_dir, methods=METHODS, max_docs=10000, sampling='shuffle', min_per_cat=0, use_logreg=False,
+                 maskfiles={}, n_jobs=1, resume=True, headless=True, cache=None):
+    """
+    compute the relevant words of a text categorization dataset with several methods and create their word clouds,
+    sharing the selected subset of documents and the features between the methods
+
+    Input:
+        textdict: dict with {doc_id: text}
+        doccats: dict with {doc_id: category}
+        out_dir: directory where the results are saved (created if it doesn't exist):
+                 out_dir/method/ contains the word clouds and out_dir/method/results/ the RelevantWords
+                 (and out_dir/clf/model.npz the LinearExplainer with the classifier)
+        methods: which of 'tfidf', 'distinctive' and 'clf' should be computed (default: all)
+        max_docs, sampling, min_per_cat: how to select a random subset of the documents (see select_subset)
+        use_logreg: default False; whether to use logistic regression instead of linear SVM
+        maskfiles: dict with {category: path_to_maskfile} for creating the word clouds in a specific form
+        n_jobs: number of threads used to compute the scores of the methods concurrently and
+                processes used to create the word clouds (default 1; -1: use all cores)
+        resume: if True (default), stages that were completed in an earlier run with the same parameters
+                are not computed again (e.g. after the previous run failed)
+        headless: if True (default), the word clouds are only saved without creating matplotlib figures
+        cache: an optional FeatureCache to load the features from instead of recomputing them
+    Returns:
+        results: dict with {method: RelevantWords}
+    """
+    for method in methods:
+        if method not in METHODS:
+            raise ValueError("unknown method %r (has to be one of %s)" % (method, ', '.join(METHODS)))
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    params = {'max_docs': max_docs, 'sampling': sampling, 'min_per_cat': min_per_cat, 'use_logreg': use_logreg,
+              'dataset': _fingerprint(doccats)}
+    state = _State(out_dir, params, resume)
+    # select the subset of documents and compute the features shared by all methods
+    features_dir = os.path.join(out_dir, 'features')
+    if 'features' in state:
+        print("loading features from %s" % features_dir)
+        data = SharedFeatures.load(features_dir)
+        with codecs.open(os.path.join(features_dir, 'visids.json'), encoding='utf8') as f:
+            visids = json.load(f)
+    else:
+        with instrument.stage('select_subset', n_docs=len(textdict)):
+            print("possibly selecting subset of %s examples" % max_docs)
+            textdict, doccats, visids = select_subset(textdict, doccats, [], max_docs, sampling, min_per_cat)
+        with instrument.stage('features', n_docs=len(textdict)):
+            print("transforming text into features")
+            data = SharedFeatures.from_texts(textdict, doccats, cache)
+            data.save(features_dir)
+            with codecs.open(os.path.join(features_dir, 'visids.json'), 'w', encoding='utf8') as f:
+                json.dump(list(visids), f)
+        state.add('features')
+    # compute the scores of all methods that aren't done yet (at the same time, since they only share read-only data)
+    results, wc_scores = {}, {}
+    todo = [method for method in methods if 'scores_' + method not in state]
+    for method in methods:
+        if method not in todo:
+            results[method] = RelevantWords.load(os.path.join(out_dir, method, 'results'))
+
+    def score(method):
+        with instrument.stage(method, n_docs=len(data.docids)):
+            print("computing the %s scores" % method)
+            if method == 'tfidf':
+                return method, score_tfidf(data)
+            elif method == 'distinctive':
+                return method, score_distinctive(data, n_jobs)
+            return method, score_clf(data, data.indices(visids), use_logreg)
+
+    n_threads = min(len(todo), n_jobs if n_jobs > 0 else len(todo))
+    pool = ThreadPool(n_threads) if n_threads > 1 else None
+    try:
+        # the results are saved as soon as a method is done, so they don't need to be recomputed if another one fails
+        for method, res in (pool.imap_unordered(instrument.propagate(score), todo) if pool is not None else map(score, todo)):
+            results[method], wc_scores[method] = res[0], res[1]
+            results[method].save(os.path.join(out_dir, method, 'results'))
+            if method == 'clf':
+                res[2].save(os.path.join(out_dir, method, 'model.npz'))
+            state.add('scores_' + method)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    # create the word clouds of all methods in one batch
+    todo = [method for method in methods if 'wordclouds_' + method not in state]
+    wc_args = []
+    for method in todo:
+        res = results[method]
+        for i, cat in enumerate(res.categories):
+            ws_dict = wc_scores[method][i] if method in wc_scores else res.topk_dict(cat)
+            wc_args.append((ws_dict, os.path.join(out_dir, method, "%s.png" % cat), maskfiles[cat] if cat in maskfiles else None))
+    if wc_args:
+        print("creating word clouds")
+        with instrument.stage('wordclouds', n_clouds=len(wc_args)):
+            create_wordclouds_batch(wc_args, n_jobs, len(wc_args), headless)
+    for method in todo:
+        state.add('wordclouds_' + method)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="compute the relevant words of a text categorization dataset with several methods")
+    parser.add_argument('path', help="path to the dataset (a folder with a subdirectory with .txt files for every category)")
+    parser.add_argument('--out', default='', help="output directory (default: results/<name of the dataset>)")
+    parser.add_argument('--methods', nargs='+', default=METHODS, choices=METHODS)
+    parser.add_argument('--max_docs', type=int, default=10000, help="size of the random subset of documents (0: use all documents)")
+    parser.add_argument('--sampling', default='shuffle', choices=['shuffle', 'hash'])
+    parser.add_argument('--min_per_cat', type=int, default=0)
+    parser.add_argument('--logreg', action='store_true', help="use logistic regression instead of a linear SVM")
+    parser.add_argument('--n_jobs', type=int, default=1, help="number of threads / processes (-1: use all cores)")
+    parser.add_argument('--no_resume', action='store_true', help="compute all stages again")
+    parser.add_argument('--events', default='', help="json lines file to write the timing events to")
+    args = parser.parse_args()
+    from .data_utils import load_data
+    dataset = os.path.basename(os.path.normpath(args.path))
+    if args.events:
+        instrument.set_sink(instrument.JSONLinesSink(args.events))
+    print("loading data for dataset %s" % dataset)
+    textdict, doccats = load_data(args.path)
+    methods = args.methods
+    if len(set(doccats.values())) == 1:
+        # without categories, the texts are clustered and the clusters are used as categories (but not classified)
+        from .cluster import cluster_texts
+        print("clustering")
+        doccats = cluster_texts(textdict)
+        methods = [method for method in methods if method != 'clf']
+    run_pipeline(textdict, doccats, args.out or os.path.join('results', dataset), methods, args.max_docs or None, args.sampling,
+                 args.min_per_cat, args.logreg, n_jobs=args.n_jobs, resume=not args.no_resume)
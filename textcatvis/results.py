@@ -0,0 +1,191 @@
+from __future__ import unicode_literals, division, print_function, absolute_import
+import codecs
+import json
+import os
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+import numpy as np
+from .sparse_utils import dense_row_topk
+
+
+def _jsonable(categories):
+    # the categories might be numpy types (e.g. the classes_ of a classifier)
+    return [cat.item() if isinstance(cat, np.generic) else cat for cat in categories]
+
+
+class _CategoryScores(Mapping):
+    """
+    a read-only dict-like view with {word: score} on one row of the RelevantWords scores
+    (only the words with a score, i.e. not NaN, are included)
+    """
+
+    def __init__(self, results, i):
+        self._results = results
+        self._row = results.scores[i]
+
+    def __getitem__(self, word):
+        score = self._row[self._results.index(word)]
+        if np.isnan(score):
+            raise KeyError(word)
+        return float(score)
+
+    def __iter__(self):
+        vocab = self._results.vocab
+        return (vocab[j] for j in np.flatnonzero(~np.isnan(self._row)))
+
+    def __len__(self):
+        return int(np.count_nonzero(~np.isnan(self._row)))
+
+
+class RelevantWords(Mapping):
+    """
+    RelevantWords
+
+    the relevancy scores of the words for all categories (as returned by the visualize_* functions with
+    return_results=True) stored as one float32 matrix with categories x words and a shared vocabulary array
+    instead of a dict with {category: {word: score}}, i.e. without millions of python objects.
+    The object itself behaves like the dict (results[cat][word]), but the dicts for the individual categories
+    are only views on the rows of the matrix. Words without a score for a category (e.g. because they don't occur
+    in any document of the category) are NaN in the matrix and not included in the category's dict.
+
+    Usage:
+        results = visualize_clf(textdict, doccats, return_results=True)
+        # dict-like access
+        score = results['cat1']['word']
+        # the 10 words with the highest scores for a category as a list with (word, score) tuples
+        top_words = results.topk('cat1', 10)
+        # store the results as .npy files in a directory, which are memory-mapped when loading them again
+        # (or as a single file if the path ends in .npz, which is read into memory completely)
+        results.save('results_clf')
+        results = RelevantWords.load('results_clf')
+        # the original nested dict
+        relevant_words = results.to_dict()
+
+    Attributes:
+        - scores: numpy float32 array (or memmap) with categories x vocab with the scores (NaN: no score)
+        - categories: list with the categories corresponding to the rows of the scores
+        - vocab: numpy unicode array with the words corresponding to the columns of the scores
+    """
+
+    def __init__(self, scores, categories, vocab, dtype=np.float32):
+        """
+        Input:
+            scores: array with categories x vocab with the scores (NaN: no score)
+            categories: list with the categories
+            vocab: list with the words
+            dtype: type of the stored scores (default: float32, the scores of a loaded memmap aren't converted)
+        """
+        self.scores = scores if isinstance(scores, np.memmap) else np.asarray(scores, dtype=dtype)
+        self.categories = list(categories)
+        self.vocab = np.asarray(vocab, dtype=str)
+        self._catidx = {cat: i for i, cat in enumerate(self.categories)}
+        self._wordidx = None
+
+    @classmethod
+    def from_sparse(cls, mat, categories, featurenames, dtype=np.float32):
+        """
+        create the results from a sparse matrix with categories x featurenames (e.g. as returned with return_mats=True)
+        where only the stored entries have a score
+        """
+        scores = np.full(mat.shape, np.nan, dtype=dtype)
+        scores[np.repeat(np.arange(mat.shape[0]), np.diff(mat.indptr)), mat.indices] = mat.data
+        return cls(scores, categories, featurenames, dtype)
+
+    def __getitem__(self, cat):
+        return _CategoryScores(self, self._catidx[cat])
+
+    def __iter__(self):
+        return iter(self.categories)
+
+    def __len__(self):
+        return len(self.categories)
+
+    def index(self, word):
+        """
+        Returns:
+            the index of the word in the vocabulary (i.e. the column of the scores)
+        """
+        if self._wordidx is None:
+            self._wordidx = {word: j for j, word in enumerate(self.vocab.tolist())}
+        return self._wordidx[word]
+
+    def topk(self, cat, k=10, largest=True):
+        """
+        get the words with the highest (or lowest) scores for a category
+
+        Input:
+            cat: the category
+            k: number of words
+            largest: if False, return the words with the lowest scores instead
+        Returns:
+            list with (word, score) tuples, sorted by the score
+        """
+        row = self.scores[self._catidx[cat]]
+        idx = np.flatnonzero(~np.isnan(row))
+        values = row[idx] if largest else -row[idx]
+        if len(idx) > k:
+            keep = np.argpartition(-values, k)[:k]
+            idx, values = idx[keep], values[keep]
+        order = np.argsort(-values, kind='mergesort')
+        return [(str(self.vocab[j]), float(row[j])) for j in idx[order]]
+
+    def topk_dict(self, cat, n_pos=160, n_neg=40):
+        """
+        get the words with the largest positive and smallest negative scores of a category as a dict
+        (i.e. the words shown in the word cloud, see sparse_utils.csr_row_topk)
+        """
+        return dense_row_topk(self.scores[self._catidx[cat]], self.vocab, n_pos, n_neg)
+
+    def to_dict(self):
+        """
+        Returns:
+            a dict with {category: {word: score}} (only the words with a score)
+        """
+        vocab = self.vocab.tolist()
+        result = {}
+        for i, cat in enumerate(self.categories):
+            idx = np.flatnonzero(~np.isnan(self.scores[i]))
+            result[cat] = dict(zip([vocab[j] for j in idx], self.scores[i, idx].tolist()))
+        return result
+
+    def save(self, path):
+        """
+        store the results
+
+        Input:
+            path: a directory where the scores, vocabulary and categories are stored as scores.npy, vocab.npy and
+                  categories.json (created if it doesn't exist) or the path to a single file ending in .npz
+        """
+        categories = json.dumps(_jsonable(self.categories))
+        if path.endswith('.npz'):
+            np.savez(path, scores=self.scores, vocab=self.vocab, categories=np.array(categories))
+            return
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        np.save(os.path.join(path, 'scores.npy'), self.scores)
+        np.save(os.path.join(path, 'vocab.npy'), self.vocab)
+        with codecs.open(os.path.join(path, 'categories.json'), 'w', encoding='utf8') as f:
+            f.write(categories)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """
+        load results stored with save
+
+        Input:
+            path: the directory (or .npz file) with the results
+            mmap_mode: how the scores and vocabulary stored in a directory are memory-mapped
+                       (default 'r': read-only, only the accessed parts are read from disk; None: read everything)
+        Returns:
+            results: the RelevantWords
+        """
+        if path.endswith('.npz'):
+            with np.load(path) as data:
+                return cls(data['scores'], json.loads(str(data['categories'])), data['vocab'], data['scores'].dtype)
+        scores = np.load(os.path.join(path, 'scores.npy'), mmap_mode=mmap_mode)
+        vocab = np.load(os.path.join(path, 'vocab.npy'), mmap_mode=mmap_mode)
+        with codecs.open(os.path.join(path, 'categories.json'), encoding='utf8') as f:
+            categories = json.load(f)
+        return cls(scores, categories, vocab, scores.dtype)
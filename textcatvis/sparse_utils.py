@@ -0,0 +1,187 @@
+from __future__ import unicode_literals, division, print_function, absolute_import
+from multiprocessing.sharedctypes import RawArray
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+def features2csr(docfeats, docids, featurenames=[]):
+    """
+    Transform a dictionary with features into a sparse csr matrix
+    (same as nlputils.features.features2mat, but the matrix is built directly from index arrays instead of a dok_matrix)
+
+    Input:
+        docfeats: a dictionary with {docid: {word: count}}
+        docids: the subset of the docfeats (keys to the dict) that should be regarded,
+                defines rows of the feature matrix
+        featurenames: a list of words that define the columns of the feature matrix
+                      (if empty, all words occurring in the docids documents are used)
+    Returns:
+        featmat: a sparse csr matrix with docids x featurenames
+        featurenames: the list of words defining the columns of the featmat
+    """
+    if not featurenames:
+        featurenames = sorted(set(word for did in docids for word in docfeats[did]))
+    fnamedict = {feat: i for i, feat in enumerate(featurenames)}
+    indptr, indices, data = [0], [], []
+    for did in docids:
+        for word, value in docfeats[did].items():
+            # like in features2mat, unknown words and zero entries are not stored
+            if value and word in fnamedict:
+                indices.append(fnamedict[word])
+                data.append(value)
+        indptr.append(len(indices))
+    featmat = csr_matrix((np.array(data, dtype=float), np.array(indices, dtype=np.int32), np.array(indptr, dtype=np.int32)),
+                         shape=(len(docids), len(featurenames)))
+    featmat.sort_indices()
+    return featmat, featurenames
+
+
+def tfidf_weight(tf, idx=None, renorm='max'):
+    """
+    Weight a matrix with (max normalized) term frequencies with idf weights and renormalize the rows, i.e. compute the
+    same features as FeatureTransform(norm='max', weight=True, renorm=renorm) with the weights fitted on the idx documents
+
+    Input:
+        tf: a sparse csr matrix with docs x words with the term frequencies
+        idx: indices of the documents used to compute the idf weights (default: all documents)
+        renorm: how the features should be renormalized ('max' or 'length')
+    Returns:
+        featmat: a sparse csr matrix with the tf-idf features of all documents (with the same columns as tf; words
+                 that don't occur in some but not all of the idx documents get a weight of 0 and are not stored)
+        idf: array with the idf weight of every word
+    """
+    fit = tf if idx is None else tf[idx]
+    # like in nlputils.features.compute_idf: log(N / document frequency), normalized by the maximum weight
+    df = np.bincount(fit.indices, minlength=tf.shape[1])
+    idf = np.zeros(tf.shape[1])
+    idf[df > 0] = np.log(fit.shape[0] / df[df > 0])
+    if idf.size and idf.max():
+        idf /= idf.max()
+    featmat = csr_matrix(tf.multiply(idf.reshape(1, -1)))
+    featmat.eliminate_zeros()
+    if renorm == 'max':
+        norms = np.asarray(abs(featmat).max(axis=1).todense()).ravel()
+    elif renorm == 'length':
+        norms = np.sqrt(np.asarray(featmat.multiply(featmat).sum(axis=1)).ravel())
+    else:
+        raise ValueError("renorm has to be 'max' or 'length', not %r" % renorm)
+    norms[norms == 0] = 1.
+    featmat.data /= np.repeat(norms, np.diff(featmat.indptr))
+    return featmat, idf
+
+
+def category_indicator(doccats, docids, categories=[]):
+    """
+    Create a sparse indicator matrix mapping documents to their categories
+
+    Input:
+        doccats: dict with {docid: category}
+        docids: list of docids defining the rows of the matrix
+        categories: list of categories defining the columns of the matrix
+                    (if empty, all categories of the docids documents in the order they first occur)
+    Returns:
+        catmat: a sparse csr matrix with docids x categories with a 1 where the document belongs to the category
+        categories: the list of categories defining the columns of the catmat
+    """
+    if not len(categories):
+        categories = list(dict.fromkeys(doccats[did] for did in docids))
+    catidx = {cat: i for i, cat in enumerate(categories)}
+    cols = np.array([catidx[doccats[did]] for did in docids], dtype=np.int32)
+    catmat = csr_matrix((np.ones(len(docids)), cols, np.arange(len(docids) + 1, dtype=np.int32)),
+                        shape=(len(docids), len(categories)))
+    return catmat, categories
+
+
+def csr2dicts(mat, rownames, featurenames):
+    """
+    Transform the rows of a sparse matrix into dictionaries (only stored entries are included)
+
+    Input:
+        mat: a sparse csr matrix with rownames x featurenames
+        rownames: a list with names for the rows of the matrix (e.g. categories)
+        featurenames: a list of words defining the columns of the matrix
+    Returns:
+        a dict with {rowname: {word: value}}
+    """
+    return {name: {featurenames[j]: v for j, v in zip(mat.indices[mat.indptr[i]:mat.indptr[i + 1]],
+                                                       mat.data[mat.indptr[i]:mat.indptr[i + 1]])}
+            for i, name in enumerate(rownames)}
+
+
+def _to_shared(arr):
+    shared = RawArray(np.ctypeslib.as_ctypes_type(arr.dtype), max(arr.size, 1))
+    np.frombuffer(shared, dtype=arr.dtype)[:arr.size] = arr
+    return shared, arr.dtype.str, arr.size
+
+
+def _from_shared(shared):
+    arr, dtype, size = shared
+    return np.frombuffer(arr, dtype=dtype)[:size]
+
+
+def csr2shared(mat):
+    """
+    Copy a sparse csr matrix into shared memory, e.g. to pass it to the worker processes of a multiprocessing.Pool
+    (as the initargs) without pickling a copy of the matrix for every task
+
+    Input:
+        mat: a sparse csr matrix
+    Returns:
+        shared: a tuple with the multiprocessing RawArrays of the data, indices and indptr and the shape of the matrix
+                (turned into a csr matrix again with shared2csr)
+    """
+    mat = csr_matrix(mat)
+    return _to_shared(mat.data), _to_shared(mat.indices), _to_shared(mat.indptr), mat.shape
+
+
+def shared2csr(shared):
+    """
+    Returns:
+        mat: the sparse csr matrix stored with csr2shared (a view on the shared memory, i.e. without copying it)
+    """
+    data, indices, indptr, shape = shared
+    return csr_matrix((_from_shared(data), _from_shared(indices), _from_shared(indptr)), shape=shape, copy=False)
+
+
+def _topk_dict(indices, data, featurenames, n_pos, n_neg):
+    # the n_pos largest positive and n_neg smallest negative entries (NaNs are neither) as a dict with {word: value}
+    pos, neg = np.flatnonzero(data > 0), np.flatnonzero(data < 0)
+    if len(pos) > n_pos:
+        pos = pos[np.argpartition(-data[pos], n_pos)[:n_pos]]
+    if len(neg) > n_neg:
+        neg = neg[np.argpartition(data[neg], n_neg)[:n_neg]]
+    idx = np.concatenate([pos, neg])
+    return {featurenames[j]: v for j, v in zip(indices[idx].tolist(), data[idx].tolist())}
+
+
+def csr_row_topk(mat, i, featurenames, n_pos=160, n_neg=40):
+    """
+    Get the entries with the largest positive and the smallest negative values of a row of a sparse matrix as a dict
+    (e.g. only the words shown in a word cloud, without transforming the whole row into a dict)
+
+    Input:
+        mat: a sparse csr matrix with rownames x featurenames
+        i: index of the row
+        featurenames: a list of words defining the columns of the matrix
+        n_pos: number of entries with the largest positive values (default 160, like in create_wordcloud)
+        n_neg: number of entries with the smallest negative values (default 40, like in create_wordcloud)
+    Returns:
+        a dict with {word: value} for the selected entries
+    """
+    return _topk_dict(mat.indices[mat.indptr[i]:mat.indptr[i + 1]], mat.data[mat.indptr[i]:mat.indptr[i + 1]],
+                      featurenames, n_pos, n_neg)
+
+
+def dense_row_topk(row, featurenames, n_pos=160, n_neg=40):
+    """
+    Same as csr_row_topk, but for a dense array with the values of all features (NaN entries are ignored)
+
+    Input:
+        row: a numpy array with one value for every word in featurenames
+        featurenames: a list of words corresponding to the entries of the row
+        n_pos, n_neg: number of entries with the largest positive and smallest negative values
+    Returns:
+        a dict with {word: value} for the selected entries
+    """
+    row = np.asarray(row)
+    return _topk_dict(np.arange(len(row)), row, featurenames, n_pos, n_neg)
@@ -1,33 +1,44 @@
 from __future__ import unicode_literals, division, print_function, absolute_import
 import codecs
+import heapq
 import re
-from PIL import Image
+import time
+from collections import deque
+from multiprocessing import Pool, cpu_count
 import numpy as np
-import matplotlib
-from matplotlib.cm import get_cmap
-import matplotlib.pyplot as plt
-from wordcloud import WordCloud
 from nlputils.features import preprocess_text
+from . import instrument
 
+
+# the state used by posneg_color_func (the colormaps and default normalizations are only created when they are
+# needed, since matplotlib takes a while to import)
 word_scores_dict = None
-# colormaps for positive and negative scores
-cmap_pos = get_cmap('Greens')
-cmap_neg = get_cmap('Reds')
-norm_pos = matplotlib.colors.Normalize(0., 1.)
-norm_neg = matplotlib.colors.Normalize(0., 1.)
+cmap_pos = None
+cmap_neg = None
+norm_pos = None
+norm_neg = None
 
 
 def posneg_color_func(word=None, font_size=None, position=None,
                       orientation=None, font_path=None, random_state=None):
     """
     Generates colors based on the word's positive/negative score
+    (a color_func for the WordCloud that uses the module level word_scores_dict, norm_pos and norm_neg;
+    to create several word clouds at the same time, use a function created with make_posneg_color_func instead)
 
     Parameters
     ----------
     word: the word in question, used to pick the score from the global word_scores_dict
     all other parameters are ignored
     """
-    global word_scores_dict
+    global cmap_pos, cmap_neg, norm_pos, norm_neg
+    if cmap_pos is None or cmap_neg is None:
+        from matplotlib.cm import get_cmap
+        cmap_pos, cmap_neg = get_cmap('Greens'), get_cmap('Reds')
+    if norm_pos is None or norm_neg is None:
+        from matplotlib.colors import Normalize
+        norm_pos = Normalize(0., 1.) if norm_pos is None else norm_pos
+        norm_neg = Normalize(0., 1.) if norm_neg is None else norm_neg
     score = word_scores_dict[word]
     if score < 0:
         rgbc = cmap_neg(norm_neg(-score))
@@ -36,17 +47,45 @@ def posneg_color_func(word=None, font_size=None, position=None,
     return "rgb(%d, %d, %d)" % (round(255 * rgbc[0]), round(255 * rgbc[1]), round(255 * rgbc[2]))
 
 
-def create_wordcloud(ws_dict, fname=None, maskfile=None):
+def make_posneg_color_func(ws_dict, norm_pos, norm_neg):
     """
-    given a dictionary with words and their relevancy scores, visualize the resulting wordcloud
+    Create a function which generates colors based on the words' positive/negative scores
+    (like posneg_color_func, but the state is kept in the closure so multiple word clouds can be created at the same time)
 
-    Inputs:
-        - ws_dict: dictionary with {word:score}, where the score can be positive or negative
-        - fname: file name where the resulting wordcloud should be saved
-        - maskfile: filename where the shape of the wordcloud can be loaded (else it will be a rectangle)
+    Parameters
+    ----------
+    ws_dict: dictionary with {word:score} used to pick the score of the word in question
+    norm_pos, norm_neg: matplotlib.colors.Normalize instances for the positive and (absolute) negative scores
+    """
+    from matplotlib.cm import get_cmap
+    # colormaps for positive and negative scores
+    cmap_pos = get_cmap('Greens')
+    cmap_neg = get_cmap('Reds')
+
+    def color_func(word=None, font_size=None, position=None,
+                   orientation=None, font_path=None, random_state=None):
+        score = ws_dict[word]
+        if score < 0:
+            rgbc = cmap_neg(norm_neg(-score))
+        else:
+            rgbc = cmap_pos(norm_pos(score))
+        return "rgb(%d, %d, %d)" % (round(255 * rgbc[0]), round(255 * rgbc[1]), round(255 * rgbc[2]))
+    return color_func
+
+
+def _make_wordcloud(ws_dict, maskfile=None):
+    """
+    generate the wordcloud for a dictionary with words and their relevancy scores (see create_wordcloud)
+
+    Returns:
+        - wc: the WordCloud object
     """
+    # matplotlib, PIL and wordcloud take a while to import, so this is only done when they are needed
+    import matplotlib.colors
+    from wordcloud import WordCloud
     if maskfile:
         # read the mask image - make sure it's black and white (not black and transparent)
+        from PIL import Image
         maskimg = np.array(Image.open(maskfile))
         height, width, _ = maskimg.shape
     else:
@@ -54,18 +93,20 @@ def create_wordcloud(ws_dict, fname=None, maskfile=None):
         width, height = 900, 600
 
     # check how many positive and negative words we have in the dict
-    n_pos = len([1 for w in ws_dict if ws_dict[w] > 0])
-    n_neg = len([1 for w in ws_dict if ws_dict[w] < 0])
-    # get the 160 most positive words + 40 negative words
-    relwords_pos = sorted(ws_dict, key=ws_dict.get, reverse=True)[:min(160, n_pos)]
-    relwords_neg = sorted(ws_dict, key=ws_dict.get)[:min(40, n_neg)]
+    n_pos, n_neg = 0, 0
+    for score in ws_dict.values():
+        if score > 0:
+            n_pos += 1
+        elif score < 0:
+            n_neg += 1
+    # get the 160 most positive words + 40 negative words (same as sorted(...)[:n], but without sorting the whole dict)
+    relwords_pos = heapq.nlargest(min(160, n_pos), ws_dict, key=ws_dict.get)
+    relwords_neg = heapq.nsmallest(min(40, n_neg), ws_dict, key=ws_dict.get)
     words_freq = {w: abs(ws_dict[w]) for w in relwords_pos + relwords_neg}
-    # set the ws_dict to the global dict - we need this for coloring
-    global word_scores_dict
-    word_scores_dict = ws_dict
 
     # normalize the color scales so you actually see some colors ;)
-    global norm_pos, norm_neg
+    norm_pos = matplotlib.colors.Normalize(0., 1.)
+    norm_neg = matplotlib.colors.Normalize(0., 1.)
     if n_pos:
         norm_pos = matplotlib.colors.Normalize(
             2 * ws_dict[relwords_pos[-1]] - ws_dict[relwords_pos[0]], ws_dict[relwords_pos[0]])
@@ -74,81 +115,231 @@ def create_wordcloud(ws_dict, fname=None, maskfile=None):
             2 * abs(ws_dict[relwords_neg[-1]]) - abs(ws_dict[relwords_neg[0]]), abs(ws_dict[relwords_neg[0]]))
 
     # generate wordcloud from the given scores
-    wc = WordCloud(background_color="white", max_words=len(words_freq), width=width,
-                   height=height, mask=maskimg, color_func=posneg_color_func)
+    wc = WordCloud(background_color="white", max_words=len(words_freq), width=width, height=height, mask=maskimg,
+                   color_func=make_posneg_color_func({w: ws_dict[w] for w in words_freq}, norm_pos, norm_neg))
     wc.generate_from_frequencies(words_freq)
+    return wc
+
+
+def create_wordcloud(ws_dict, fname=None, maskfile=None, headless=False):
+    """
+    given a dictionary with words and their relevancy scores, visualize the resulting wordcloud
+
+    Inputs:
+        - ws_dict: dictionary with {word:score}, where the score can be positive or negative
+        - fname: file name where the resulting wordcloud should be saved
+        - maskfile: filename where the shape of the wordcloud can be loaded (else it will be a rectangle)
+        - headless: if True, the wordcloud is only saved to fname without creating a matplotlib figure
+                    (e.g. in batch jobs, where the figures would otherwise pile up in memory)
+    """
+    wc = _make_wordcloud(ws_dict, maskfile)
 
     # store to file
     if fname:
         wc.to_file(fname)
 
     # show
-    plt.figure()
-    plt.imshow(wc)
-    plt.axis("off")
+    if not headless:
+        import matplotlib.pyplot as plt
+        plt.figure()
+        plt.imshow(wc)
+        plt.axis("off")
 
 
-def scores2html(text, scores, fname='testfile', metainf='', highlight_oov=False):
+def _wordcloud2file(ws_dict, fname, maskfile=None):
+    # only save the wordcloud (for the worker processes, which can't show it anyways)
+    create_wordcloud(ws_dict, fname, maskfile, headless=True)
+
+
+def create_wordclouds_batch(wc_args, n_jobs=1, n_clouds=None, headless=False):
     """
-    Based on the original text and relevance scores, generate a html doc highlighting positive / negative words
+    Create the word clouds for multiple categories with create_wordcloud, possibly in parallel
+
+    Inputs:
+        - wc_args: an iterable (e.g. a generator) with (ws_dict, fname, maskfile) tuples,
+                   i.e. the arguments for create_wordcloud for each category
+        - n_jobs: number of processes used to create the word clouds (default 1: no parallelization;
+                  -1: use all cores); at most 2*n_jobs word clouds are waiting to be rendered at any time
+        - n_clouds: the total number of word clouds (only used when reporting the progress)
+        - headless: if True, the word clouds are only saved to the files without creating matplotlib figures
+    With n_jobs=1 and headless=False, the word clouds are also shown (like with create_wordcloud), otherwise they are
+    only saved to the given files; if an error occurs while creating one of the word clouds, it is raised here.
+    """
+    _run_batch(_wordcloud2file if headless else create_wordcloud, _wordcloud2file, wc_args, n_jobs, n_clouds, 10, "word clouds")
+
+
+def _align_scores(text, scores):
+    """
+    align the scored words with the original text
 
     Inputs:
         - text: the raw text in which the words should be highlighted
         - scores: a dictionary with {word: score} or a list with tuples [(word, score)]
-        - fname: the name (path) of the file
+    Yields:
+        - (pos, start, end, word, score) tuples, i.e. the text before the word is text[pos:start],
+          the word itself was found at text[start:end] and the (normalized) score is None for unknown words
+    """
+    if isinstance(scores, dict):
+        # normalize score by absolute max value (a text without any known words has no scores)
+        N = np.max(np.abs(list(scores.values()))) if scores else 1.
+        # tokenize the text once (keeping the positions of the words) and preprocess every distinct word only once
+        words_pp = {}
+        pos = 0
+        for m in re.finditer(r'[\w-]+', text, re.UNICODE):
+            word = m.group()
+            if word not in words_pp:
+                words_pp[word] = preprocess_text(word, norm_num=False)
+            score = scores[words_pp[word]] / N if words_pp[word] in scores else None
+            yield pos, m.start(), m.end(), word, score
+            pos = m.end()
+    else:
+        N = np.max(np.abs([t[1] for t in scores if t[1] is not None]))
+        pos = 0
+        for word, score in scores:
+            start = text.find(word, pos)
+            if start < 0:
+                # the word is not in the text - same as cutting off text[pos:-1] before and len(word)-1 chars after it
+                yield pos, max(pos, len(text) - 1), min(pos + len(word) - 1, len(text)), word, score / N if score is not None else None
+                pos = min(pos + len(word) - 1, len(text))
+            else:
+                yield pos, start, start + len(word), word, score / N if score is not None else None
+                pos = start + len(word)
+
+
+def write_scores2html(f, text, scores, metainf='', highlight_oov=False):
+    """
+    Based on the original text and relevance scores, write a html doc highlighting positive / negative words
+    into an open file (or any other object with a write method)
+
+    Inputs:
+        - f: the file object the html is written to
+        - text: the raw text in which the words should be highlighted
+        - scores: a dictionary with {word: score} or a list with tuples [(word, score)]
         - metainf: an optional string which will be added at the top of the file (e.g. true class of the document)
         - highlight_oov: if True, out-of-vocabulary words will be highlighted in yellow (default False)
-    Saves the visualization in 'fname.html' (you probably want to make this a whole path to not clutter your main directory...)
     """
+    import matplotlib.colors
+    from matplotlib.cm import get_cmap
     # colormaps
     cmap_pos = get_cmap('Greens')
     cmap_neg = get_cmap('Reds')
     norm = matplotlib.colors.Normalize(0., 1.)
+    # the span tags only depend on the score, so they are cached
+    spans = {}
 
-    # if not isinstance(text, unicode):
-    #     text = text.decode("utf-8")
-
-    # normalize score by absolute max value
-    if isinstance(scores, dict):
-        N = np.max(np.abs(list(scores.values())))
-        scores_dict = {word: scores[word] / N for word in scores}
-        # transform dict into word list with scores
-        scores = []
-        for word in re.findall(r'[\w-]+', text, re.UNICODE):
-            word_pp = preprocess_text(word, norm_num=False)
-            if word_pp in scores_dict:
-                scores.append((word, scores_dict[word_pp]))
-            else:
-                scores.append((word, None))
-    else:
-        N = np.max(np.abs([t[1] for t in scores if t[1] is not None]))
-        scores = [(w, s / N) if s is not None else (w, None) for w, s in scores]
-
-    htmlstr = u'<body><div style="white-space: pre-wrap; font-family: monospace;">'
+    f.write(u'<body><div style="white-space: pre-wrap; font-family: monospace;">')
     if metainf:
-        htmlstr += '%s\n\n' % metainf
-    resttext = text
-    for word, score in scores:
+        f.write('%s\n\n' % metainf)
+    pos = 0
+    for pos, start, end, word, score in _align_scores(text, scores):
         # was anything before the identified word? add it unchanged to the html
-        htmlstr += resttext[:resttext.find(word)]
-        # cut off the identified word
-        resttext = resttext[resttext.find(word) + len(word):]
-        # get the colorcode of the word
-        rgbac = (1., 1., 0.)  # for unknown words
-        if highlight_oov:
-            alpha = 0.3
-        else:
-            alpha = 0.
-        if score is not None:
-            if score < 0:
-                rgbac = cmap_neg(norm(-score))
+        f.write(text[pos:start])
+        pos = end
+        if score not in spans:
+            # get the colorcode of the word
+            rgbac = (1., 1., 0.)  # for unknown words
+            if highlight_oov:
+                alpha = 0.3
             else:
-                rgbac = cmap_pos(norm(score))
-            alpha = 0.5
-        htmlstr += u'<span style="background-color: rgba(%i, %i, %i, %.1f)">%s</span>'\
-            % (round(255 * rgbac[0]), round(255 * rgbac[1]), round(255 * rgbac[2]), alpha, word)
+                alpha = 0.
+            if score is not None:
+                if score < 0:
+                    rgbac = cmap_neg(norm(-score))
+                else:
+                    rgbac = cmap_pos(norm(score))
+                alpha = 0.5
+            spans[score] = u'<span style="background-color: rgba(%i, %i, %i, %.1f)">'\
+                % (round(255 * rgbac[0]), round(255 * rgbac[1]), round(255 * rgbac[2]), alpha)
+        f.write(spans[score])
+        f.write(word)
+        f.write(u'</span>')
     # after the last word, add the rest of the text
-    htmlstr += resttext
-    htmlstr += u'</div></body>'
+    f.write(text[pos:])
+    f.write(u'</div></body>')
+
+
+def scores2html(text, scores, fname='testfile', metainf='', highlight_oov=False):
+    """
+    Based on the original text and relevance scores, generate a html doc highlighting positive / negative words
+
+    Inputs:
+        - text: the raw text in which the words should be highlighted
+        - scores: a dictionary with {word: score} or a list with tuples [(word, score)]
+        - fname: the name (path) of the file
+        - metainf: an optional string which will be added at the top of the file (e.g. true class of the document)
+        - highlight_oov: if True, out-of-vocabulary words will be highlighted in yellow (default False)
+    Saves the visualization in 'fname.html' (you probably want to make this a whole path to not clutter your main directory...)
+    """
     with codecs.open('%s.html' % fname, 'w', encoding='utf8') as f:
-        f.write(htmlstr)
+        write_scores2html(f, text, scores, metainf, highlight_oov)
+
+
+def scores2html_batch(html_args, n_jobs=1, n_docs=None):
+    """
+    Create the html files for multiple documents with scores2html, possibly in parallel
+
+    Inputs:
+        - html_args: an iterable (e.g. a generator) with (text, scores, fname, metainf) tuples,
+                     i.e. the arguments for scores2html for each document
+        - n_jobs: number of processes used to create the html files (default 1: no parallelization;
+                  -1: use all cores); at most 2*n_jobs documents are waiting to be rendered at any time
+        - n_docs: the total number of documents (only used when reporting the progress)
+    The files are named and written exactly as with scores2html; if an error occurs while creating one
+    of the files, it is raised here.
+    """
+    _run_batch(scores2html, scores2html, html_args, n_jobs, n_docs, 100, "documents")
+
+
+def _timed_call(fun, args):
+    # call the function (in a worker process) and return how long it took
+    t0 = time.time()
+    fun(*args)
+    return time.time() - t0
+
+
+def _run_batch(fun, fun_parallel, args_list, n_jobs=1, n_items=None, report_every=100, items_name="documents"):
+    """
+    call fun with all the arguments in args_list, or fun_parallel in a pool of n_jobs processes
+    (see scores2html_batch and create_wordclouds_batch)
+    if the instrumentation is enabled, an 'item' event with the time needed for every item is emitted
+    """
+    if n_jobs < 0:
+        n_jobs = max(1, cpu_count() + 1 + n_jobs)
+    if n_items is None:
+        n_items = len(args_list) if hasattr(args_list, '__len__') else 0
+    timed = instrument.enabled()
+    if n_jobs == 1:
+        for i, args in enumerate(args_list):
+            if not i % report_every:
+                print("progress: at %i of %i %s" % (i, n_items, items_name))
+            if timed:
+                instrument.event('item', item=i, items=items_name, time=_timed_call(fun, args))
+            else:
+                fun(*args)
+        return
+    pool = Pool(n_jobs)
+    try:
+        pending = deque()
+
+        def get_oldest():
+            i, result = pending.popleft()
+            if timed:
+                instrument.event('item', item=i, items=items_name, time=result.get())
+            else:
+                result.get()
+        for i, args in enumerate(args_list):
+            if not i % report_every:
+                print("progress: at %i of %i %s" % (i, n_items, items_name))
+            pending.append((i, pool.apply_async(_timed_call, (fun_parallel, args)) if timed else pool.apply_async(fun_parallel, args)))
+            # don't let the queue grow too much (the scores can be big) - wait for the oldest items first
+            while len(pending) >= 2 * n_jobs:
+                get_oldest()
+        while pending:
+            get_oldest()
+    except BaseException:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
@@ -2,49 +2,233 @@ from __future__ import unicode_literals, division, print_function, absolute_impo
 from builtins import zip
 import os
 import random
+import zlib
+from collections import Counter
+from itertools import repeat
+from math import log
+from multiprocessing import Pool, cpu_count
 import numpy as np
-from scipy.sparse import csr_matrix, lil_matrix
-from sklearn.svm import LinearSVC
-from sklearn.linear_model import LogisticRegression as logreg
-import sklearn.metrics as skmet
-from nlputils.features import FeatureTransform, features2mat
-from nlputils.dict_utils import invert_dict0, combine_dicts
-from .vis_utils import create_wordcloud, scores2html
-from .distinctive_words import get_distinctive_words
+from scipy.sparse import csr_matrix, vstack
+from nlputils.features import FeatureTransform, features2mat, preprocess_text, find_bigrams
+from nlputils.dict_utils import norm_dict
+from .vis_utils import create_wordclouds_batch, scores2html_batch
+from .distinctive_words import get_distinctive_words, get_distinctive_words_chunked
+from .sparse_utils import features2csr, category_indicator, csr2dicts, csr_row_topk, dense_row_topk, csr2shared, shared2csr, tfidf_weight
+from .results import RelevantWords
+from .corpus import Corpus
+from .feature_cache import texts2featmat, freeze_bigrams
+from . import instrument
 
 
-def select_subset(textdict, doccats, visids=[]):
+def _hash_docids(docids, seed=42):
     """
-    select a random subset of the dataset if it contains more than 10000 examples
+    compute a pseudo-random number in [0, 2**64) for every docid, which (unlike hash() or random.shuffle)
+    doesn't depend on the order of the ids, the python version or the machine
+    """
+    # (map is used instead of generator expressions since this is the bottleneck for millions of ids)
+    docids = list(map(str.encode, map(str, docids)))
+    hashes = np.fromiter(map(zlib.crc32, docids, repeat(seed)), dtype=np.uint64, count=len(docids)) << np.uint64(32)
+    hashes |= np.fromiter(map(zlib.adler32, docids, repeat(seed)), dtype=np.uint64, count=len(docids))
+    # mix the bits (finalizer of MurmurHash3), since the checksums of similar ids are similar as well
+    hashes ^= hashes >> np.uint64(33)
+    hashes *= np.uint64(0xff51afd7ed558ccd)
+    hashes ^= hashes >> np.uint64(33)
+    hashes *= np.uint64(0xc4ceb9fe1a85ec53)
+    hashes ^= hashes >> np.uint64(33)
+    return hashes
+
+
+def sample_docids(doccats, n_samples, min_per_cat=0, exclude=[], seed=42):
+    """
+    select a reproducible random sample of docids in a single pass over all ids without sorting or shuffling them:
+    the ids with the n_samples smallest hash values are selected (bottom-k sampling), which is a uniform random sample
+
+    Input:
+        doccats: dict with {doc_id: category}
+        n_samples: number of docids to select
+        min_per_cat: every category should be represented by at least this many docids (incl. the excluded ones)
+                     or by all its docids if it has fewer; if this requires more than n_samples ids, the sample gets bigger
+        exclude: docids that should not be selected (e.g. because they are added to the sample anyways)
+        seed: random seed
+    Returns:
+        sample: list with the selected docids (ordered by their hash values)
+    """
+    docids = list(doccats.keys())
+    hashes = _hash_docids(docids, seed)
+    exclude = set(exclude)
+    candidates = np.array([i for i, did in enumerate(docids) if did not in exclude], dtype=int) if exclude else np.arange(len(docids))
+    selected = np.zeros(len(docids), dtype=bool)
+    if min_per_cat:
+        # for every category, select the docids with the smallest hash values needed to reach the minimum count
+        catidx = {cat: i for i, cat in enumerate(set(doccats.values()))}
+        codes = np.fromiter(map(catidx.__getitem__, doccats.values()), dtype=int, count=len(docids))
+        n_excluded = np.bincount([catidx[doccats[did]] for did in exclude if did in doccats], minlength=len(catidx))
+        need = min_per_cat - n_excluded
+        # the smallest hash values of the categories that are already well represented among the overall smallest
+        # hash values are found among those, so only for the other categories all docids need to be considered
+        bottom = candidates[np.argpartition(hashes[candidates], n_samples)[:n_samples]] if n_samples < len(candidates) else candidates
+        rare = np.bincount(codes[bottom], minlength=len(catidx)) < need
+        cands = np.union1d(bottom, candidates[rare[codes[candidates]]])
+        order = cands[np.lexsort((hashes[cands], codes[cands]))]
+        codes_sorted = codes[order]
+        rank = np.arange(len(order)) - np.searchsorted(codes_sorted, np.arange(len(catidx)))[codes_sorted]
+        selected[order[rank < need[codes_sorted]]] = True
+        if selected.sum() > n_samples:
+            print("WARNING: sampling %i instead of %i documents to include at least %i documents of every category" % (selected.sum(), n_samples, min_per_cat))
+    # fill up the sample with the remaining docids with the smallest hash values
+    n_fill = n_samples - selected.sum()
+    if n_fill > 0:
+        rest = candidates[~selected[candidates]]
+        if n_fill < len(rest):
+            rest = rest[np.argpartition(hashes[rest], n_fill)[:n_fill]]
+        selected[rest] = True
+    idx = np.flatnonzero(selected)
+    return [docids[i] for i in idx[np.argsort(hashes[idx], kind='mergesort')]]
+
+
+def select_subset(textdict, doccats, visids=[], max_docs=10000, sampling='shuffle', min_per_cat=0):
+    """
+    select a random subset of the dataset if it contains more than max_docs examples
 
     Input and Returns:
         textdict: dict with {doc_id: text}
         doccats: dict with {doc_id: category}
         visids: a subset of docids for which the html visualization should be created
+    Input:
+        max_docs: maximum number of examples to keep (default 10000; None: keep all examples)
+        sampling: how to select the random subset:
+                  'shuffle' (default): shuffle all (sorted) docids and take the first max_docs
+                  'hash': select the docids with the smallest hash values (see sample_docids), which is
+                          a lot faster for millions of docids and can guarantee a minimum number of
+                          examples for every category
+        min_per_cat: with sampling='hash', keep at least this many examples of every category (default 0)
     """
-    docids = sorted(textdict.keys())  # sort for consistency across OS
-    random.seed(42)
-    random.shuffle(docids)
+    if sampling not in ('shuffle', 'hash'):
+        raise ValueError("sampling has to be either 'shuffle' or 'hash', not %r" % sampling)
+    subsample = max_docs is not None and len(textdict) > max_docs
+    docids = None
+    if sampling == 'shuffle':
+        docids = sorted(textdict.keys())  # sort for consistency across OS
+        random.seed(42)
+        random.shuffle(docids)
+    elif subsample and not len(visids):
+        # the visids are then the first docids of the sample
+        docids = sample_docids(doccats, max_docs, min_per_cat)
     # visualize up to 1000 documents
     if not len(visids):
-        visids = docids[:1000]
+        visids = docids[:1000] if docids is not None else sample_docids(doccats, 1000)
     elif len(visids) > 1000:
         print("WARNING: creating visualizations for %i, i.e. more than 1000 documents can be slow!" % len(visids))
         if len(visids) > 10000:
             print("You don't know what you're doing....Truncating visids to 5000 examples.")
             visids = visids[:5000]
     # select subsets of examples to speed up the computations
-    if len(docids) > 10000:
-        # always make sure you end up with exactly 10k random examples (incl visids) but also don't shuffle a lot more than 10k ids
-        docids = list(set(docids[:10000+len(visids)]).difference(set(visids)))
-        random.shuffle(docids)
-        docids = docids[:10000-len(visids)] + visids
+    if subsample:
+        if sampling == 'shuffle':
+            # always make sure you end up with exactly max_docs random examples (incl visids) but also don't shuffle a lot more than max_docs ids
+            docids = list(set(docids[:max_docs+len(visids)]).difference(set(visids)))
+            random.shuffle(docids)
+            docids = docids[:max_docs-len(visids)] + visids
+        elif docids is None:
+            # the visids were given, i.e. we still need to sample the other docids
+            docids = sample_docids(doccats, max(max_docs - len(visids), 0), min_per_cat, visids) + list(visids)
         textdict = {d: textdict[d] for d in docids}
         doccats = {d: doccats[d] for d in docids}
     return textdict, doccats, visids
 
 
-def visualize_tfidf(textdict, doccats, create_html=True, visids=[], subdir_html='', subdir_wc='', maskfiles={}):
+def _iter_batches(docids, batch_size):
+    for i in range(0, len(docids), batch_size):
+        yield docids[i:i + batch_size]
+
+
+def fit_features_batches(ft, textdict, docids, batch_size=10000):
+    """
+    fit a FeatureTransform on a large dataset without transforming all texts at once:
+    the bigrams are identified on a random sample of batch_size documents, while the idf weights
+    are computed from the document frequencies of all documents, which are counted batch by batch
+
+    Input:
+        ft: a FeatureTransform instance (will have the fitted weights and bigrams afterwards)
+        textdict: dict with {doc_id: text}
+        docids: the documents used to fit the FeatureTransform (e.g. only the training documents)
+        batch_size: number of documents that are transformed at once
+    Returns:
+        featurenames: sorted list of all words known to the FeatureTransform (if weight=True, else [])
+    """
+    if ft.identify_bigrams and not ft.bigrams:
+        sample = random.Random(42).sample(sorted(docids), min(batch_size, len(docids)))
+        ft.bigrams = find_bigrams({did: preprocess_text(textdict[did], ft.to_lower, ft.norm_num) for did in sample}, ft.bg_threshold)
+        # otherwise the bigrams would be searched again in every batch
+        freeze_bigrams(ft)
+    if not ft.weight:
+        return []
+    if not ft.Dw:
+        # count in how many documents each word occurs (with the same preprocessing and bigrams)
+        ft_counts = FeatureTransform(norm='binary', weight=False, renorm=None, identify_bigrams=ft.identify_bigrams,
+                                     to_lower=ft.to_lower, norm_num=ft.norm_num, bg_threshold=ft.bg_threshold)
+        ft_counts.bigrams = ft.bigrams
+        df = Counter()
+        for batch in _iter_batches(docids, batch_size):
+            for feats in ft_counts.texts2features({did: textdict[did] for did in batch}).values():
+                df.update(feats.keys())
+        # same as nlputils.features.compute_idf
+        ft.Dw = norm_dict({term: log(len(docids) / df[term]) for term in df})
+    return sorted(ft.Dw)
+
+
+def transform_batches(ft, textdict, docids, featurenames, batch_size=10000):
+    """
+    transform the texts into features batch by batch with a fitted FeatureTransform
+
+    Input:
+        ft: a fitted FeatureTransform instance (e.g. with fit_features_batches)
+        textdict: dict with {doc_id: text}
+        docids: the documents to transform
+        featurenames: the words defining the columns of the feature matrices
+        batch_size: number of documents that are transformed at once
+    Yields:
+        batch: list with the docids of the batch
+        docfeats: dict with {doc_id: {term: (normalized/weighted) count}} for the documents of the batch
+        featmat: sparse csr matrix with the features of the documents of the batch
+    """
+    for batch in _iter_batches(docids, batch_size):
+        docfeats = ft.texts2features({did: textdict[did] for did in batch})
+        featmat, _ = features2csr(docfeats, batch, featurenames)
+        yield batch, docfeats, featmat
+
+
+def _add_zero_scores(scores, featurenames, words):
+    """
+    store explicit zero scores for the given words in every row of the scores matrix
+    (words that are not in featurenames yet are added as new columns)
+
+    Input:
+        scores: sparse csr matrix with categories x featurenames (without stored entries for the words)
+        featurenames: list of words corresponding to the columns of scores
+        words: the words that should get a score of 0
+    Returns:
+        scores: sparse csr matrix with categories x (extended) featurenames
+        featurenames: the (extended) list of words
+    """
+    fnamedict = {word: j for j, word in enumerate(featurenames)}
+    featurenames = list(featurenames) + sorted(word for word in words if word not in fnamedict)
+    fnamedict.update((word, j) for j, word in enumerate(featurenames) if word not in fnamedict)
+    cols = np.array(sorted(fnamedict[word] for word in words), dtype=int)
+    scores = scores.tocoo()
+    n_rows = scores.shape[0]
+    # (converting to csr sums up duplicate entries, but explicit zeros are kept)
+    scores = csr_matrix((np.concatenate([scores.data, np.zeros(n_rows * len(cols))]),
+                         (np.concatenate([scores.row, np.repeat(np.arange(n_rows), len(cols))]),
+                          np.concatenate([scores.col, np.tile(cols, n_rows)]))), shape=(n_rows, len(featurenames)))
+    scores.sort_indices()
+    return scores, featurenames
+
+
+@instrument.timed('visualize_tfidf')
+def visualize_tfidf(textdict, doccats, create_html=True, visids=[], subdir_html='', subdir_wc='', maskfiles={}, n_jobs=1, cache=None,
+                    max_docs=10000, sampling='shuffle', min_per_cat=0, batch_size=None, return_mats=False,
+                    headless=False, return_results=False):
     """
     visualize a text categorization dataset w.r.t. tf-idf features (create htmls with highlighted words and word clouds)
 
@@ -57,39 +241,366 @@ def visualize_tfidf(textdict, doccats, create_html=True, visids=[], subdir_html=
         subdir_html: subdirectory to save the created html files in (has to exist)
         subdir_wc: subdirectory to save the created word cloud images in (has to exist)
         maskfiles: dict with {category: path_to_maskfile} for creating the word clouds in a specific form
+        n_jobs: number of processes used to create the html files and word clouds (default 1; -1: use all cores)
+        cache: an optional FeatureCache to load the features from instead of recomputing them (not used with batch_size)
+        max_docs: use a random subset of max_docs documents (default 10000; None: use the full dataset)
+        sampling, min_per_cat: how to select the random subset (see select_subset)
+        batch_size: if given, the features are computed for batch_size documents at a time and the tf-idf scores
+                    are summed up batch by batch, so the memory requirements don't grow with the size of the dataset
+        return_mats: if True, the scores are returned as a sparse matrix instead of a dict (default: False)
+        headless: if True, the word clouds are only saved to subdir_wc without creating matplotlib figures
+        return_results: if True, the scores are returned as a results.RelevantWords object instead of a dict (default: False)
     Returns:
-        relevant_words: dict with {category: {word: relevancy score}}
+        relevant_words: dict with {category: {word: relevancy score}} (or the RelevantWords if return_results=True)
+        or if return_mats=True:
+        scores: a sparse csr matrix with categories x featurenames with the summed up tf-idf scores
+        categories: the list of categories corresponding to the rows of the scores matrix
+        featurenames: the list of words corresponding to the columns of the scores matrix
     """
-    print("possibly selecting subset of 10000 examples")
-    textdict, doccats, visids = select_subset(textdict, doccats, visids)
+    with instrument.stage('select_subset', n_docs=len(textdict)) as st:
+        print("possibly selecting subset of %s examples" % max_docs)
+        textdict, doccats, visids = select_subset(textdict, doccats, visids, max_docs, sampling, min_per_cat)
+        st.set(n_selected=len(textdict))
     print("transforming text into features")
     # we can identify bigrams if we don't have to create htmls
     ft = FeatureTransform(norm='max', weight=True, renorm='max', identify_bigrams=not create_html, norm_num=False)
-    docfeats = ft.texts2features(textdict)
+    corpus = Corpus(textdict, doccats)
+    textdict, docids, categories = corpus.textdict(), corpus.docids, corpus.categories
+    with instrument.stage('features', n_docs=len(docids)):
+        # the tf-idf scores of every category are summed up by multiplying the doc x word matrix with the doc x category matrix
+        if batch_size:
+            # sum up the tf-idf scores of every category batch by batch and only keep the features of the visids
+            featurenames = fit_features_batches(ft, textdict, docids, batch_size)
+            visidset = set(visids) if create_html else set()
+            docfeats, scores_sum = {}, csr_matrix((len(categories), len(featurenames)))
+            for i, (batch, batchfeats, featmat) in enumerate(transform_batches(ft, textdict, docids, featurenames, batch_size)):
+                print("summing up the scores of batch %i" % i)
+                catmat = corpus.indicator(np.arange(i * batch_size, i * batch_size + len(batch)))
+                scores_sum = scores_sum + catmat.T.dot(featmat)
+                docfeats.update((did, batchfeats[did]) for did in batch if did in visidset)
+        else:
+            featmat, featurenames = texts2featmat(ft, textdict, docids, cache=cache)
+            catmat = corpus.indicator()
+            scores_sum = csr_matrix(catmat.T.dot(featmat))
+            del featmat
+            # only the visids need the features as dicts (with the fitted FeatureTransform, they are the same as above)
+            docfeats = ft.texts2features({did: textdict[did] for did in visids}) if create_html else {}
+        # words occurring in all documents have an idf weight (and therefore a score) of 0, but like in the dicts
+        # summed up from the documents' features, they still get a score for every category
+        scores_sum, featurenames = _add_zero_scores(scores_sum, featurenames, [word for word, w in ft.Dw.items() if not w])
     # maybe highlight the tf-idf scores in the documents
     if create_html:
-        print("creating htmls for %i of %i documents" % (len(visids), len(docfeats)))
-        for i, did in enumerate(visids):
-            if not i % 100:
-                print("progress: at %i of %i documents" % (i, len(visids)))
-            metainf = did + '\n' + 'True Class: %s\n' % doccats[did]
-            name = did + '_' + doccats[did]
-            scores2html(textdict[did], docfeats[did], os.path.join(subdir_html, name.replace(' ', '_').replace('/', '_')), metainf)
-    # get a map for each category to the documents belonging to it
-    catdocs = invert_dict0(doccats)
-    # create word clouds for each category by summing up tfidf scores
-    scores_collected = {}
-    for cat in catdocs:
-        print("creating word cloud for category %r with %i samples" % (cat, len(catdocs[cat])))
-        scores_collected[cat] = {}
-        for did in catdocs[cat]:
-            scores_collected[cat] = combine_dicts(scores_collected[cat], docfeats[did], sum)
-        # create word cloud
-        create_wordcloud(scores_collected[cat], os.path.join(subdir_wc, "%s.png" % cat), maskfiles[cat] if cat in maskfiles else None)
-    return scores_collected
-
-
-def visualize_clf(textdict, doccats, create_html=True, visids=[], subdir_html='', subdir_wc='', maskfiles={}, use_logreg=False):
+        print("creating htmls for %i of %i documents" % (len(visids), len(textdict)))
+
+        def html_args():
+            for did in visids:
+                metainf = did + '\n' + 'True Class: %s\n' % doccats[did]
+                name = did + '_' + doccats[did]
+                yield textdict[did], docfeats[did], os.path.join(subdir_html, name.replace(' ', '_').replace('/', '_')), metainf
+        with instrument.stage('html', n_docs=len(visids)):
+            scores2html_batch(html_args(), n_jobs, len(visids))
+    # create word clouds for each category from the summed up tfidf scores (only the top words are needed for this)
+    n_samples = corpus.counts()
+
+    def wc_args():
+        for i, cat in enumerate(categories):
+            print("creating word cloud for category %r with %i samples" % (cat, n_samples[i]))
+            yield csr_row_topk(scores_sum, i, featurenames), os.path.join(subdir_wc, "%s.png" % cat), maskfiles[cat] if cat in maskfiles else None
+    with instrument.stage('wordclouds', n_clouds=len(categories)):
+        create_wordclouds_batch(wc_args(), n_jobs, len(categories), headless)
+    if return_mats:
+        return scores_sum, categories, featurenames
+    if return_results:
+        return RelevantWords.from_sparse(scores_sum, categories, featurenames)
+    return csr2dicts(scores_sum, categories, featurenames)
+
+
+def compute_contributions(clf, featmat, labels):
+    """
+    compute the contributions of the individual features to the decision function of a linear classifier
+    for all documents at once (i.e. the elementwise product of the feature vectors with the coefficients)
+
+    Input:
+        clf: a trained linear classifier (e.g. LinearSVC or LogisticRegression)
+        featmat: sparse feature matrix with docs x features
+        labels: for every document the class for which the scores should be computed
+                (in the binary case, the scores are reversed if the label is the negative class)
+    Returns:
+        contribs: sparse csr matrix with docs x features with the scores of every feature occurring in the document,
+                  including the document's share of the intercept
+        offsets: array with the share of the intercept for every document, i.e. the score of the features
+                 not occurring in the document
+    """
+    featmat = csr_matrix(featmat)
+    n_features = featmat.shape[1]
+    if len(clf.classes_) > 2:
+        classidx = {c: i for i, c in enumerate(clf.classes_)}
+        rows = np.array([classidx[label] for label in labels], dtype=int)
+        signs = np.ones(len(labels))
+    else:
+        rows = np.zeros(len(labels), dtype=int)
+        # we want the scores which speak for the class - for the negative class, the sign needs to be reversed
+        signs = np.array([-1. if label == clf.classes_[0] else 1. for label in labels])
+    # in the decision function every feature would get the full intercept, but we only keep a 1/n_features share
+    intercepts = clf.intercept_[rows]
+    offsets = signs * (intercepts - (1. - 1. / n_features) * intercepts)
+    nnz = np.diff(featmat.indptr)
+    rows, signs, intercepts = np.repeat(rows, nnz), np.repeat(signs, nnz), np.repeat(intercepts, nnz)
+    data = signs * ((featmat.data * clf.coef_[rows, featmat.indices] + intercepts) - (1. - 1. / n_features) * intercepts)
+    contribs = csr_matrix((data, featmat.indices.copy(), featmat.indptr.copy()), shape=featmat.shape)
+    return contribs, offsets
+
+
+def sum_class_contributions(clf, featmat, y_true, contribs, offsets):
+    """
+    sum up the contributions of the features to the decision function for the true class of every document
+    (only the contributions for the true class of the features occurring in the documents are computed)
+
+    Input:
+        clf: a trained linear classifier
+        featmat: sparse feature matrix with docs x features
+        y_true: for every document the true class (documents from classes unknown to the classifier are ignored)
+        contribs, offsets: the contributions for the predicted classes (see compute_contributions),
+                           which are reused for binary problems
+    Returns:
+        sums: sparse csr matrix with classes (in the order of clf.classes_) x features with the summed up contributions
+              of the features occurring in the documents (without the offsets)
+        class_offsets: array with the summed up offsets of the documents of every class,
+                       i.e. the score every feature gets in addition to the sums
+    """
+    classes = set(clf.classes_)
+    known = [i for i, y in enumerate(y_true) if y in classes]
+    if len(clf.classes_) > 2:
+        contribs_true, offsets_true = compute_contributions(clf, featmat[known], [y_true[i] for i in known])
+    else:
+        # for binary problems, the same scores (which speak for the predicted class) are collected for the actual class
+        contribs_true, offsets_true = contribs[known], offsets[known]
+    # the features not occurring in a document still get the document's share of the intercept, i.e. the offset
+    # (the rows correspond to the classifier's classes, which might include classes without documents for a given model)
+    catmat, _ = category_indicator(dict(enumerate(y_true)), known, list(clf.classes_))
+    contribs_true.data -= np.repeat(offsets_true, np.diff(contribs_true.indptr))
+    return csr_matrix(catmat.T.dot(contribs_true)), catmat.T.dot(offsets_true)
+
+
+def class_scores(sums, class_offsets, dtype=np.float64):
+    """
+    compute the scores of the words for every class from the summed up contributions (see sum_class_contributions),
+    normalized by the maximum absolute score of every class
+
+    Input:
+        sums: sparse matrix with classes x features with the summed up contributions
+        class_offsets: array with the summed up offsets of every class
+        dtype: type of the scores (e.g. float32 to halve the memory needed for many classes)
+    Returns:
+        scores_collected: array with features x classes with the scores
+                          (the transpose of a C-contiguous array with classes x features)
+    """
+    sums = csr_matrix(sums)
+    sums.sum_duplicates()
+    # only one dense buffer is allocated, the sparse sums are added to the offsets in place
+    scores = np.empty(sums.shape, dtype=dtype)
+    scores[:] = np.asarray(class_offsets).reshape(-1, 1)
+    scores[np.repeat(np.arange(sums.shape[0]), np.diff(sums.indptr)), sums.indices] += sums.data
+    # normalize the scores for each class
+    for row in scores:
+        row /= np.max(np.abs(row))
+    return scores.T
+
+
+def collect_class_scores(clf, featmat, y_true, contribs, offsets, dtype=np.float64):
+    """
+    sum up the contributions of the features to the decision function for the true class of every document,
+    i.e. the scores of the words for every class shown in the word clouds
+
+    Input:
+        clf: a trained linear classifier
+        featmat: sparse feature matrix with docs x features
+        y_true: for every document the true class (documents from classes unknown to the classifier are ignored)
+        contribs, offsets: the contributions for the predicted classes (see compute_contributions),
+                           which are reused for binary problems
+        dtype: type of the scores (default: float64)
+    Returns:
+        scores_collected: array with features x classes (in the order of clf.classes_) with the summed up scores,
+                          normalized by the maximum absolute score of every class
+    """
+    return class_scores(*sum_class_contributions(clf, featmat, y_true, contribs, offsets), dtype=dtype)
+
+
+def train_clf_batches(ft, textdict, doccats, trainids, use_logreg=False, batch_size=10000, n_epochs=1):
+    """
+    train a linear classifier with stochastic gradient descent on minibatches of the training documents,
+    so that the features never have to be computed for more than batch_size documents at once
+
+    Input:
+        ft: a FeatureTransform instance (fitted with fit_features_batches on the trainids if it wasn't fitted yet)
+        textdict: dict with {doc_id: text}
+        doccats: dict with {doc_id: category}
+        trainids: the documents to train the classifier on
+        use_logreg: default False; whether to use the logistic regression instead of the hinge (i.e. linear SVM) loss
+        batch_size: number of documents that are transformed and used for a partial fit at once
+        n_epochs: how often to go over all training documents (the features are recomputed every time)
+    Returns:
+        clf: the trained SGDClassifier
+        featurenames: the words defining the columns of the classifier's coef_
+    """
+    from sklearn.linear_model import SGDClassifier
+    trainids = sorted(trainids)
+    featurenames = fit_features_batches(ft, textdict, trainids, batch_size)
+    y = [doccats[tid] for tid in trainids]
+    classes = np.unique(y)
+    # class_weight='balanced' can't be used with partial_fit, so we compute the weights from all training labels ourselves
+    counts = Counter(y)
+    class_weight = {c: len(y) / (len(classes) * counts[c]) for c in classes}
+    clf = SGDClassifier(loss='log_loss' if use_logreg else 'hinge', class_weight=class_weight, random_state=1)
+    rng = random.Random(42)
+    for epoch in range(n_epochs):
+        # go over the documents in a different random order in every epoch
+        rng.shuffle(trainids)
+        for i, (batch, _, featmat) in enumerate(transform_batches(ft, textdict, trainids, featurenames, batch_size)):
+            print("training on batch %i (epoch %i)" % (i, epoch))
+            clf.partial_fit(featmat, [doccats[tid] for tid in batch], classes=classes)
+    return clf, featurenames
+
+
+def assign_folds(labels, n_folds, seed=42):
+    """
+    randomly assign the documents to n_folds folds, stratified by their category
+    (i.e. the documents of every category are distributed evenly across the folds)
+
+    Input:
+        labels: numpy int array with the category code of every document (e.g. Corpus.labels)
+        n_folds: number of folds
+        seed: random seed
+    Returns:
+        folds: numpy int array with the fold of every document
+    """
+    rng = np.random.RandomState(seed)
+    folds = np.empty(len(labels), dtype=int)
+    order = np.argsort(labels, kind='mergesort')
+    bounds = np.flatnonzero(np.diff(labels[order])) + 1
+    start = 0
+    for idx in np.split(order, bounds):
+        # continue where the last category stopped, so the folds have the same size
+        folds[rng.permutation(idx)] = (start + np.arange(len(idx))) % n_folds
+        start += len(idx)
+    return folds
+
+
+# the data shared by all folds in a worker process (set by _init_fold_worker)
+_fold_data = {}
+
+
+def _init_fold_worker(clf, tf, labels, folds, categories, renorm, vis):
+    # the term frequency matrix is given in shared memory (see csr2shared) if this is called in a worker process
+    _fold_data.update(clf=clf, tf=shared2csr(tf) if isinstance(tf, tuple) else tf,
+                      y=np.asarray(categories)[labels], folds=folds, renorm=renorm, vis=vis)
+
+
+def _fit_fold(k):
+    # compute the features with the idf weights of the training documents, train a classifier on all but the
+    # documents in fold k and sum up the contributions of the words for the held-out documents
+    # (if there are none, i.e. k == n_folds, the classifier is trained on all documents)
+    from sklearn.base import clone
+    y, folds = _fold_data['y'], _fold_data['folds']
+    train = folds != k
+    featmat, idf = tfidf_weight(_fold_data['tf'], np.flatnonzero(train), _fold_data['renorm'])
+    clf = clone(_fold_data['clf']).fit(featmat[train], y[train])
+    test = np.flatnonzero(~train)
+    if not len(test):
+        return clf, idf, test, None, None, None
+    featmat_test = featmat[test]
+    y_pred = clf.predict(featmat_test)
+    contribs, offsets = compute_contributions(clf, featmat_test, y_pred)
+    # the explanations of the held-out documents that are visualized in the html files
+    vis = np.flatnonzero(_fold_data['vis'][test])
+    explanations = (test[vis], clf.decision_function(featmat_test[vis]), y_pred[vis], contribs[vis], offsets[vis]) if len(vis) else None
+    # (besides these, only the sparse sums are sent back to the main process)
+    return clf, idf, test, y_pred, sum_class_contributions(clf, featmat_test, list(y[test]), contribs, offsets), explanations
+
+
+def crossval_clf(clf, tf, labels, categories, n_folds=5, n_jobs=1, train_all=False, dtype=np.float64, renorm='length', vis_idx=[]):
+    """
+    k-fold cross-validation of a linear classifier: for every fold, the idf weights are computed on the other folds,
+    a classifier is trained on them and the contributions of the words to the classification of the held-out documents
+    are summed up for their true class, i.e. every document is scored exactly once by a classifier (and features)
+    that were not fitted on it. The folds are trained in parallel processes, which share the term frequency matrix
+    (in shared memory).
+
+    Input:
+        clf: the (unfitted) linear classifier, which is cloned for every fold
+        tf: sparse matrix with docs x words with the max normalized term frequencies
+        labels: numpy int array with the category code of every document
+        categories: list with the categories, i.e. the category of a document is categories[label]
+                    (every category needs at least 2 documents)
+        n_folds: number of folds (default 5)
+        n_jobs: number of processes used to train the classifiers (default 1; -1: use all cores)
+        train_all: if True, an additional classifier is trained on all documents
+        dtype: type of the scores (default: float64)
+        renorm: how the tf-idf features are renormalized ('max' or 'length', see sparse_utils.tfidf_weight)
+        vis_idx: indices of documents for which the explanations should be returned (e.g. to create the html files)
+    Returns:
+        clfs: list with the classifier of every fold (and the one trained on all documents as the last if train_all=True)
+        idfs: list with the idf weights of the words used for the features of every classifier
+        y_pred: numpy array with the out-of-fold prediction for every document
+        scores_collected: array with words x classes (in the order of clfs[0].classes_) with the summed up scores
+                          of all documents, normalized by the maximum absolute score of every class
+        explanations: for the vis_idx documents (in this order) the out-of-fold predictions (decision function and labels)
+                      and the contributions for the predicted classes (contribs, offsets, see compute_contributions)
+    """
+    if np.bincount(labels, minlength=len(categories)).min() < 2:
+        raise ValueError("every category needs at least 2 documents for the cross-validation")
+    tf = csr_matrix(tf)
+    folds = assign_folds(labels, n_folds)
+    vis = np.zeros(len(labels), dtype=bool)
+    vis[vis_idx] = True
+    tasks = list(range(n_folds + 1 if train_all else n_folds))
+    if n_jobs < 0:
+        n_jobs = max(1, cpu_count() + 1 + n_jobs)
+    n_jobs = min(n_jobs, len(tasks))
+    if n_jobs == 1:
+        _init_fold_worker(clf, tf, labels, folds, categories, renorm, vis)
+        try:
+            results = [_fit_fold(k) for k in tasks]
+        finally:
+            _fold_data.clear()
+    else:
+        # the term frequency matrix is copied into shared memory once instead of being pickled for every worker
+        pool = Pool(n_jobs, _init_fold_worker, (clf, csr2shared(tf), labels, folds, categories, renorm, vis))
+        try:
+            results = pool.map(_fit_fold, tasks, chunksize=1)
+        except BaseException:
+            # stop the remaining folds, the error is raised again
+            pool.terminate()
+            raise
+        else:
+            pool.close()
+        finally:
+            pool.join()
+    clfs, idfs = [r[0] for r in results], [r[1] for r in results]
+    # since every category has at least 2 documents, all classifiers know all classes
+    y_pred = np.empty(len(labels), dtype=clfs[0].classes_.dtype)
+    sums, class_offsets = csr_matrix((len(clfs[0].classes_), tf.shape[1])), np.zeros(len(clfs[0].classes_))
+    parts = []
+    for _, _, test, y_pred_fold, (sums_fold, class_offsets_fold), explanations in results[:n_folds]:
+        y_pred[test] = y_pred_fold
+        sums, class_offsets = sums + sums_fold, class_offsets + class_offsets_fold
+        if explanations is not None:
+            parts.append(explanations)
+    explanations = None
+    if parts:
+        # bring the explanations from the order of the folds into the order of the vis_idx
+        position = np.empty(len(labels), dtype=int)
+        position[vis_idx] = np.arange(len(vis_idx))
+        order = np.argsort(position[np.concatenate([p[0] for p in parts])], kind='mergesort')
+        explanations = (np.concatenate([p[1] for p in parts])[order], np.concatenate([p[2] for p in parts])[order],
+                        csr_matrix(vstack([p[3] for p in parts], format='csr')[order]), np.concatenate([p[4] for p in parts])[order])
+    return clfs, idfs, y_pred, class_scores(sums, class_offsets, dtype), explanations
+
+
+@instrument.timed('visualize_clf')
+def visualize_clf(textdict, doccats, create_html=True, visids=[], subdir_html='', subdir_wc='', maskfiles={}, use_logreg=False, n_jobs=1, cache=None,
+                  max_docs=10000, sampling='shuffle', min_per_cat=0, batch_size=None, n_epochs=1,
+                  headless=False, model=None, return_model=False, return_results=False, n_folds=None):
     """
     visualize a text categorization dataset w.r.t. classification scores (create htmls with highlighted words and word clouds)
 
@@ -103,97 +614,167 @@ def visualize_clf(textdict, doccats, create_html=True, visids=[], subdir_html=''
         subdir_wc: subdirectory to save the created word cloud images in (has to exist)
         maskfiles: dict with {category: path_to_maskfile} for creating the word clouds in a specific form
         use_logreg: default False; whether to use logistic regression instead of linear SVM
+        n_jobs: number of processes used to create the html files and word clouds (default 1; -1: use all cores)
+        cache: an optional FeatureCache to load the features from instead of recomputing them (not used with batch_size)
+        max_docs: use a random subset of max_docs documents (default 10000; None: use the full dataset)
+        sampling, min_per_cat: how to select the random subset (see select_subset)
+        batch_size: if given, a linear classifier is trained with stochastic gradient descent on minibatches of
+                    batch_size documents (see train_clf_batches), so the memory requirements don't grow with the size of the dataset
+        n_epochs: number of passes over the training documents when training on minibatches (default 1)
+        headless: if True, the word clouds are only saved to subdir_wc without creating matplotlib figures
+        model: an optional explain.LinearExplainer (e.g. stored in an earlier run) that is used instead of training a new
+               classifier (the features are then computed with the model's FeatureTransform)
+        return_model: if True, the LinearExplainer with the (trained or given) classifier is returned as well
+        return_results: if True, the scores are returned as a results.RelevantWords object instead of a dict
+                        (without creating a dict over the whole vocabulary for every class, default: False)
+        n_folds: if given, n_folds classifiers are trained with cross-validation (in n_jobs processes, see crossval_clf)
+                 and the word clouds are created from the out-of-fold scores of all documents instead of only the visids
+                 (which are still used for the html files); the idf weights are computed for every fold on its training
+                 documents, but the term frequencies (incl. the bigrams if create_html=False) are only computed once
+                 on all documents; the returned model is trained on all documents (not with model or batch_size)
     Returns:
-        relevant_words: dict with {category: {word: relevancy score}}
-    """
-    print("possibly selecting subset of 10000 examples")
-    textdict, doccats, visids = select_subset(textdict, doccats, visids)
-    # training examples are all but visids
-    trainids = list(set(textdict.keys()).difference(set(visids)))
-    # train a classifier and predict
-    if use_logreg:
-        renorm = 'max'
-        clf = logreg(class_weight='balanced', random_state=1)
-    else:
-        renorm = 'length'
-        clf = LinearSVC(C=10., class_weight='balanced', random_state=1)
-    print("transforming text into features")
-    # make features (we can use bigrams if we don't have to create htmls)
-    ft = FeatureTransform(norm='max', weight=True, renorm=renorm, identify_bigrams=not create_html, norm_num=False)
-    docfeats = ft.texts2features(textdict, fit_ids=trainids)
-    # convert training data to feature matrix
-    featmat_train, featurenames = features2mat(docfeats, trainids)
-    y_train = [doccats[tid] for tid in trainids]
-    # fit classifier
-    print("training classifier")
-    clf.fit(featmat_train, y_train)
-    del featmat_train
-    # make test featmat and label vector
-    print("making predictions")
-    featmat_test, featurenames = features2mat(docfeats, visids, featurenames)
-    # get actual classification results for all test samples
-    predictions = clf.decision_function(featmat_test)
-    predictions_labels = clf.predict(featmat_test)
-    y_true, y_pred = [doccats[tid] for tid in visids], list(predictions_labels)
-    # report classification accuracy
-    if len(clf.classes_) > 2:
-        f1_micro, f1_macro = skmet.f1_score(y_true, y_pred, average='micro'), skmet.f1_score(y_true, y_pred, average='macro')
-        print("F1 micro-avg: %.3f, F1 macro-avg: %.3f" % (f1_micro, f1_macro))
-    print("Accuracy: %.3f" % skmet.accuracy_score(y_true, y_pred))
-    # create the visualizations
-    print("creating the visualization for %i test examples" % len(visids))
-    # collect all the accumulated scores to later create a wordcloud
-    scores_collected = np.zeros((len(featurenames), len(clf.classes_)))
-    # run through all test documents
-    for i, tid in enumerate(visids):
-        if not i % 100:
-            print("progress: at %i of %i test examples" % (i, len(visids)))
-        # transform the feature vector into a diagonal matrix
-        feat_vec = lil_matrix((len(featurenames), len(featurenames)), dtype=float)
-        feat_vec.setdiag(featmat_test[i, :].toarray().flatten())
-        feat_vec = csr_matrix(feat_vec)
-        # get the scores (i.e. before summing up)
-        scores = clf.decision_function(feat_vec)
-        # adapt for the intercept
-        scores -= (1. - 1./len(featurenames)) * clf.intercept_
-        # when creating the html visualization we want the words speaking for the prediction
-        # but when creating the word cloud, we want the words speaking for the actual class
-        metainf = tid + '\n'
-        # binary or multi class?
-        if len(scores.shape) == 1:
-            if clf.classes_[0] == predictions_labels[i]:
-                # we want the scores which speak for the class - for the negative class,
-                # the sign needs to be reversed
-                scores *= -1.
-            scores_dict = dict(zip(featurenames, scores))
-            metainf += 'True Class: %s\n' % doccats[tid]
-            metainf += 'Predicted Class: %s  (Score: %.4f)' % (predictions_labels[i], predictions[i])
-            scores_collected[:, clf.classes_ == doccats[tid]] += np.array([scores]).T
+        relevant_words: dict with {category: {word: relevancy score}} (or the RelevantWords if return_results=True)
+        model: the LinearExplainer (only if return_model=True)
+    """
+    if n_folds and (model is not None or batch_size):
+        raise ValueError("n_folds can't be used together with a given model or batch_size")
+    # the RelevantWords store float32 scores anyway, so the scores of all classes are collected as float32 right away
+    dtype = np.float32 if return_results else np.float64
+    # sklearn is only imported when it's needed since it takes a while
+    from sklearn.svm import LinearSVC
+    from sklearn.linear_model import LogisticRegression as logreg
+    import sklearn.metrics as skmet
+    with instrument.stage('select_subset', n_docs=len(textdict)) as st:
+        print("possibly selecting subset of %s examples" % max_docs)
+        textdict, doccats, visids = select_subset(textdict, doccats, visids, max_docs, sampling, min_per_cat)
+        corpus = Corpus(textdict, doccats)
+        textdict = corpus.textdict()
+        # training examples are all but visids
+        vis_idx = corpus.indices(visids)
+        trainids = [corpus.docids[i] for i in corpus.complement(vis_idx)]
+        st.set(n_selected=len(textdict))
+    with instrument.stage('training', n_docs=0 if model is not None else len(trainids)):
+        if model is not None:
+            # use the stored classifier and FeatureTransform instead of training a new one
+            print("transforming text into features with the given model")
+            clf, ft, featurenames = model, model.ft, model.featurenames
+            docfeats = ft.texts2features({tid: textdict[tid] for tid in visids})
         else:
-            scores_dict = dict(zip(featurenames, scores[:, clf.classes_ == predictions_labels[i]][:, 0]))
-            metainf += 'True Class: %s  (Score: %.4f)\n' % (doccats[tid], predictions[i, clf.classes_ == doccats[tid]][0])
-            metainf += 'Predicted Class: %s  (Score: %.4f)' % (predictions_labels[i], predictions[i, clf.classes_ == predictions_labels[i]][0])
-            scores_collected[:, clf.classes_ == doccats[tid]] += scores[:, clf.classes_ == doccats[tid]]
-        # use the vector with scores together with the corresponding feature names and the original text
-        # to create the pretty visualization
-        if create_html:
-            if y_true[i] == y_pred[i]:
-                name = 'correct_'
+            # train a classifier and predict
+            if use_logreg:
+                renorm = 'max'
+                clf = logreg(class_weight='balanced', random_state=1)
+            else:
+                renorm = 'length'
+                clf = LinearSVC(C=10., class_weight='balanced', random_state=1)
+            print("transforming text into features")
+            # make features (we can use bigrams if we don't have to create htmls)
+            ft = FeatureTransform(norm='max', weight=True, renorm=renorm, identify_bigrams=not create_html, norm_num=False)
+            if batch_size:
+                print("training classifier on batches of %i documents" % batch_size)
+                clf, featurenames = train_clf_batches(ft, textdict, doccats, trainids, use_logreg, batch_size, n_epochs)
+                docfeats = ft.texts2features({tid: textdict[tid] for tid in visids})
+            elif n_folds:
+                with instrument.stage('features', n_docs=len(textdict)):
+                    # the term frequencies are computed once, the idf weights for every fold on its training documents
+                    ft_tf = FeatureTransform(norm='max', weight=False, renorm=False, identify_bigrams=not create_html, norm_num=False)
+                    tf, featurenames = texts2featmat(ft_tf, textdict, corpus.docids, cache=cache)
+                    # words occurring in all documents would get a weight of 0 in every fold
+                    keep = np.flatnonzero(np.bincount(tf.indices, minlength=tf.shape[1]) < tf.shape[0])
+                    tf, featurenames = tf[:, keep], [featurenames[j] for j in keep]
+                print("training classifiers with %i-fold cross-validation" % n_folds)
+                with instrument.stage('crossval', n_docs=len(textdict), n_folds=n_folds):
+                    clfs, idfs, y_pred_all, scores_collected, explanations = crossval_clf(
+                        clf, tf, corpus.labels, corpus.categories, n_folds, n_jobs, return_model, dtype, renorm, vis_idx)
+                clf = clfs[-1]
+                # the FeatureTransform of the last classifier (i.e. the one trained on all documents if return_model=True)
+                ft.Dw, ft.bigrams = dict(zip(featurenames, idfs[-1].tolist())), ft_tf.bigrams
+                freeze_bigrams(ft)
             else:
-                name = 'error_'
-            name += tid + '_' + doccats[tid]
-            scores2html(textdict[tid], scores_dict, os.path.join(subdir_html, name.replace(' ', '_').replace('/', '_')), metainf)
+                with instrument.stage('features', n_docs=len(textdict)):
+                    # the training feature matrix (the test documents are transformed with the fitted FeatureTransform)
+                    featmat_train, featurenames = texts2featmat(ft, textdict, trainids, trainids, cache=cache)
+                    docfeats = ft.texts2features({tid: textdict[tid] for tid in visids})
+                y_train = [doccats[tid] for tid in trainids]
+                # fit classifier
+                print("training classifier")
+                clf.fit(featmat_train, y_train)
+                del featmat_train
+    with instrument.stage('predict', n_docs=len(visids)):
+        # make test featmat and label vector
+        print("making predictions")
+        if n_folds:
+            # the visids were predicted by the classifiers of the folds in which they were held out
+            predictions, predictions_labels, contribs, offsets = explanations
+        else:
+            featmat_test, featurenames = features2mat(docfeats, visids, featurenames)
+            # get actual classification results for all test samples
+            predictions = clf.decision_function(featmat_test)
+            predictions_labels = clf.predict(featmat_test)
+        y_true, y_pred = [doccats[tid] for tid in visids], list(predictions_labels)
+        # report classification accuracy (with cross-validation of the out-of-fold predictions of all documents)
+        y_eval, y_pred_eval = ([corpus.categories[label] for label in corpus.labels], list(y_pred_all)) if n_folds else (y_true, y_pred)
+        if len(clf.classes_) > 2:
+            f1_micro, f1_macro = skmet.f1_score(y_eval, y_pred_eval, average='micro'), skmet.f1_score(y_eval, y_pred_eval, average='macro')
+            print("F1 micro-avg: %.3f, F1 macro-avg: %.3f" % (f1_micro, f1_macro))
+        print("Accuracy: %.3f" % skmet.accuracy_score(y_eval, y_pred_eval))
+    # create the visualizations
+    print("creating the visualization for %i test examples" % len(visids))
+    with instrument.stage('contributions', n_docs=len(visids)):
+        # (with cross-validation, the contributions were already computed for the folds)
+        if not n_folds:
+            # get the scores (i.e. before summing up) for all test documents at once -
+            # when creating the html visualization we want the words speaking for the prediction
+            # but when creating the word cloud, we want the words speaking for the actual class
+            contribs, offsets = compute_contributions(clf, featmat_test, predictions_labels)
+            # collect all the accumulated scores to later create a wordcloud
+            scores_collected = collect_class_scores(clf, featmat_test, y_true, contribs, offsets, dtype)
+    # use the vectors with scores together with the corresponding feature names and the original text
+    # to create the pretty visualization
+    if create_html:
+
+        def html_args():
+            for i, tid in enumerate(visids):
+                start, end = contribs.indptr[i], contribs.indptr[i + 1]
+                scores = np.full(len(featurenames), offsets[i])
+                scores[contribs.indices[start:end]] = contribs.data[start:end]
+                metainf = tid + '\n'
+                # binary or multi class?
+                if len(clf.classes_) == 2:
+                    metainf += 'True Class: %s\n' % doccats[tid]
+                    metainf += 'Predicted Class: %s  (Score: %.4f)' % (predictions_labels[i], predictions[i])
+                else:
+                    metainf += 'True Class: %s  (Score: %.4f)\n' % (doccats[tid], predictions[i, clf.classes_ == doccats[tid]][0])
+                    metainf += 'Predicted Class: %s  (Score: %.4f)' % (predictions_labels[i], predictions[i, clf.classes_ == predictions_labels[i]][0])
+                if y_true[i] == y_pred[i]:
+                    name = 'correct_'
+                else:
+                    name = 'error_'
+                name += tid + '_' + doccats[tid]
+                yield textdict[tid], dict(zip(featurenames, scores)), os.path.join(subdir_html, name.replace(' ', '_').replace('/', '_')), metainf
+        with instrument.stage('html', n_docs=len(visids)):
+            scores2html_batch(html_args(), n_jobs, len(visids))
     print("creating word clouds")
-    # normalize the scores for each class
-    scores_collected /= np.max(np.abs(scores_collected), axis=0)
-    # transform the collected scores into a dictionary and create word clouds
-    scores_collected_dict = {cat: dict(zip(featurenames, scores_collected[:, clf.classes_ == cat][:, 0])) for cat in clf.classes_}
-    for cat in scores_collected_dict:
-        create_wordcloud(scores_collected_dict[cat], os.path.join(subdir_wc, "%s.png" % cat), maskfiles[cat] if cat in maskfiles else None)
+    with instrument.stage('wordclouds', n_clouds=len(clf.classes_)):
+        if return_results:
+            # the word clouds only need the top words, so no dicts over the whole vocabulary are created
+            scores_collected_dict = RelevantWords(scores_collected.T, clf.classes_, featurenames)
+            wc_scores = [dense_row_topk(scores_collected[:, k], featurenames) for k in range(len(clf.classes_))]
+        else:
+            # transform the collected scores into a dictionary and create word clouds
+            scores_collected_dict = {cat: dict(zip(featurenames, scores_collected[:, k])) for k, cat in enumerate(clf.classes_)}
+            wc_scores = [scores_collected_dict[cat] for cat in clf.classes_]
+        create_wordclouds_batch([(wc_scores[k], os.path.join(subdir_wc, "%s.png" % cat), maskfiles[cat] if cat in maskfiles else None)
+                                 for k, cat in enumerate(clf.classes_)], n_jobs, headless=headless)
+    if return_model:
+        from .explain import LinearExplainer
+        return scores_collected_dict, model if model is not None else LinearExplainer(ft, clf, featurenames)
     return scores_collected_dict
 
 
-def visualize_distinctive(textdict, doccats, subdir_wc='', maskfiles={}):
+@instrument.timed('visualize_distinctive')
+def visualize_distinctive(textdict, doccats, subdir_wc='', maskfiles={}, cache=None, max_docs=10000, sampling='shuffle', min_per_cat=0, batch_size=None,
+                          n_jobs=1, headless=False, return_results=False):
     """
     visualize a text categorization dataset by creating word clouds of `distinctive' words
 
@@ -202,16 +783,44 @@ def visualize_distinctive(textdict, doccats, subdir_wc='', maskfiles={}):
         doccats: dict with {doc_id: category}
         subdir_wc: subdirectory to save the created word cloud images in (has to exist)
         maskfiles: dict with {category: path_to_maskfile} for creating the word clouds in a specific form
+        cache: an optional FeatureCache to load the features from instead of recomputing them (not used with batch_size)
+        max_docs: use a random subset of max_docs documents (default 10000; None: use the full dataset)
+        sampling, min_per_cat: how to select the random subset (see select_subset)
+        batch_size: if given, the word counts are accumulated for batch_size documents at a time
+                    (see DistinctiveWordsAccumulator), so the memory requirements don't grow with the size of the dataset
+        n_jobs: number of processes used to create the word clouds and threads used to compute the scores
+                (default 1; -1: use all cores)
+        headless: if True, the word clouds are only saved to subdir_wc without creating matplotlib figures
+        return_results: if True, the scores are returned as a results.RelevantWords object instead of a dict (default: False)
     Returns:
-        relevant_words: dict with {category: {word: relevancy score}}
+        relevant_words: dict with {category: {word: relevancy score}} (or the RelevantWords if return_results=True)
     """
-    print("possibly selecting subset of 10000 examples")
-    textdict, doccats, _ = select_subset(textdict, doccats, {})
+    with instrument.stage('select_subset', n_docs=len(textdict)) as st:
+        print("possibly selecting subset of %s examples" % max_docs)
+        textdict, doccats, _ = select_subset(textdict, doccats, {}, max_docs, sampling, min_per_cat)
+        st.set(n_selected=len(textdict))
     print("get 'distinctive' words")
     # this contains a dict for every category with {word: trend_score_for_this_category}
-    distinctive_words = get_distinctive_words(textdict, doccats)
+    with instrument.stage('distinctive_words', n_docs=len(textdict)):
+        if batch_size:
+            # the bigrams are identified on the first batch, so it should be a random sample
+            docids = sorted(textdict.keys())
+            random.Random(42).shuffle(docids)
+            chunks = ([(did, textdict[did], doccats[did]) for did in batch] for batch in _iter_batches(docids, batch_size))
+            distinctive_words = get_distinctive_words_chunked(chunks, return_mats=return_results)
+        else:
+            distinctive_words = get_distinctive_words(textdict, doccats, cache=cache, n_jobs=n_jobs, return_mats=return_results)
     # create the corresponding word clouds
     print("creating word clouds")
-    for cat in distinctive_words:
-        create_wordcloud(distinctive_words[cat], os.path.join(subdir_wc, "%s.png" % cat), maskfiles[cat] if cat in maskfiles else None)
+    if return_results:
+        # only the top words of every category are needed for the word clouds
+        scores, categories, featurenames = distinctive_words
+        distinctive_words = RelevantWords.from_sparse(scores, categories, featurenames)
+        wc_scores = [csr_row_topk(scores, i, featurenames) for i in range(len(categories))]
+    else:
+        categories = list(distinctive_words)
+        wc_scores = [distinctive_words[cat] for cat in categories]
+    with instrument.stage('wordclouds', n_clouds=len(categories)):
+        create_wordclouds_batch([(wc_scores[i], os.path.join(subdir_wc, "%s.png" % cat), maskfiles[cat] if cat in maskfiles else None)
+                                 for i, cat in enumerate(categories)], n_jobs, headless=headless)
     return distinctive_words